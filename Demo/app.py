@@ -1,5 +1,55 @@
+import os
+import html
+import json
+import requests
 import streamlit as st
-from chat_bot import initialize_conversation, generate_response, load_conversation_state, save_conversation_state
+
+# The interview engine runs in interview_server.py; this script only renders and relays
+INTERVIEW_BACKEND_URL = os.getenv('INTERVIEW_BACKEND_URL', 'http://localhost:5002')
+REQUEST_TIMEOUT = (3.05, 60)
+
+@st.cache_resource
+def get_http_session():
+    """Keep-alive connection pool shared by all Streamlit sessions."""
+    return requests.Session()
+
+def render_message(message):
+    content = html.escape(message["content"])
+    if message['role'] == 'user':
+        return f'<p class="chat-user"><strong>User:</strong> {content}</p>'
+    return f'<p class="chat-assistant"><strong>Assistant:</strong> {content}</p>'
+
+def start_interview():
+    response = get_http_session().post(f"{INTERVIEW_BACKEND_URL}/interviews", json={}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    st.session_state['session_id'] = data["session_id"]
+    st.session_state['chat_history'] = data["chat_history"]
+
+def stream_reply(user_input, placeholder):
+    """Send the message and render the reply as it streams in."""
+    reply = ""
+    with get_http_session().post(
+        f"{INTERVIEW_BACKEND_URL}/interviews/{st.session_state['session_id']}/messages",
+        json={"message": user_input}, stream=True, timeout=REQUEST_TIMEOUT,
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "token":
+                reply += event["content"]
+                placeholder.markdown(render_message({"role": "assistant", "content": reply}), unsafe_allow_html=True)
+            elif event["type"] == "error":
+                raise RuntimeError(event["error"])
+    return reply
+
+def get_answers():
+    response = get_http_session().get(
+        f"{INTERVIEW_BACKEND_URL}/interviews/{st.session_state['session_id']}", timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json()["answers"]
 
 # Custom CSS for improved styling
 st.markdown("""
@@ -55,30 +105,21 @@ st.markdown("""
 
 def ask_questions():
     """Main function to manage the conversation."""
-    if 'conversation_state' not in st.session_state:
-        st.session_state['conversation_state'] = load_conversation_state()
-        st.session_state['conversation_state']['chat_history'] = []
-
     st.title("Introductie gesprek")
 
     # Initialize conversation
-    if 'initialized' not in st.session_state:
-        initial_prompt = initialize_conversation()
-        st.session_state['conversation_state']['chat_history'].append({"role": "assistant", "content": initial_prompt})
-        st.session_state['initialized'] = True
+    if 'session_id' not in st.session_state:
+        try:
+            start_interview()
+        except requests.RequestException as e:
+            st.error(f"Error: Unable to start the interview. {e}")
+            return
 
     # Display chat history in one consolidated chat box
     st.markdown('<div class="main-container">', unsafe_allow_html=True)
-    st.markdown('<div class="chat-box">', unsafe_allow_html=True)
-
-    for message in st.session_state['conversation_state']['chat_history']:
-        if message['role'] == 'user':
-            st.markdown(f'<p class="chat-user"><strong>User:</strong> {message["content"]}</p>', unsafe_allow_html=True)
-        else:
-            st.markdown(f'<p class="chat-assistant"><strong>Assistant:</strong> {message["content"]}</p>', unsafe_allow_html=True)
-    
-    st.markdown('</div>', unsafe_allow_html=True)  # Close chat-box
+    st.markdown('<div class="chat-box">' + "".join(render_message(message) for message in st.session_state['chat_history']) + '</div>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)  # Close main-container
+    placeholder = st.empty()
 
     # Input box and submit button within a form to enable Enter key submission
     with st.form(key='input_form', clear_on_submit=True):
@@ -87,24 +128,24 @@ def ask_questions():
 
     if submit_button and user_input:
         if user_input.lower() == 'pause':
+            # Every exchange is saved by the server as it happens
             st.write("Conversation paused. Your progress has been saved.")
-            save_conversation_state(st.session_state['conversation_state'])
-        elif user_input.lower() == 'finish':
-            response = generate_response(user_input, st.session_state['conversation_state']['chat_history'])
-            st.session_state['conversation_state']['chat_history'].append({"role": "user", "content": user_input})
-            st.session_state['conversation_state']['chat_history'].append({"role": "assistant", "content": response})
-            st.write(response)
+            return
+        placeholder.markdown(render_message({"role": "user", "content": user_input}), unsafe_allow_html=True)
+        try:
+            response = stream_reply(user_input, st.empty())
+        except (requests.RequestException, RuntimeError, ValueError) as e:
+            st.error(f"Error: Unable to get a response. {e}")
+            return
+        st.session_state['chat_history'].append({"role": "user", "content": user_input})
+        st.session_state['chat_history'].append({"role": "assistant", "content": response})
+        if user_input.lower() == 'finish':
             st.write("\nThank you for the conversation! Here is a summary of your responses:")
-            for question in st.session_state['conversation_state']["questions"]:
-                answer = st.session_state['conversation_state']['answers'].get(question, "Not answered")
-                st.write(f"{question}: {answer}")
-            save_conversation_state(st.session_state['conversation_state'])
-        else:
-            response = generate_response(user_input, st.session_state['conversation_state']['chat_history'])
-            st.session_state['conversation_state']['chat_history'].append({"role": "user", "content": user_input})
-            st.session_state['conversation_state']['chat_history'].append({"role": "assistant", "content": response})
-            save_conversation_state(st.session_state['conversation_state'])
-            st.rerun()  # To refresh the chat history and show new messages
+            try:
+                for question, answer in get_answers().items():
+                    st.write(f"{question}: {answer or 'Not answered'}")
+            except requests.RequestException as e:
+                st.error(f"Error: Unable to load the answers. {e}")
 
 # Start the conversation
 ask_questions()
@@ -1,9 +1,16 @@
 import os
-import json
+import sys
 import logging
+import threading
 from dotenv import load_dotenv
+from cachetools import LRUCache
 from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, SystemMessagePromptTemplate, HumanMessagePromptTemplate
+
+# Shared modules live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from conversation_store import get_conversation_store
+from interview_memory import InterviewMemory
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,12 +22,9 @@ openai_api_key = os.getenv('OPENAI_API_KEY')
 # Debug flag
 DEBUG = False
 
-# Initialize the model
+# Initialize the model; it is shared by all sessions
 model = ChatOpenAI(model="gpt-4o-mini")
 
-# Define memory to track conversation history
-memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-
 # List of questions to ask
 questions = [
     "What is your name?",
@@ -30,71 +34,113 @@ questions = [
     "What is the mission of your company?"
 ]
 
-# Path for saving and loading conversation state
-conversation_state_file = "conversation_state.json"
-
-def load_conversation_state():
-    """Load conversation state from a file."""
-    try:
-        if os.path.exists(conversation_state_file):
-            with open(conversation_state_file, 'r') as file:
-                if DEBUG:
-                    logging.debug("Loading conversation state from file.")
-                state = json.load(file)
-                if "current_question_index" not in state:
-                    state["current_question_index"] = 0
-                return state
-    except json.JSONDecodeError:
-        logging.error("Failed to load conversation state. Starting a new conversation.")
-    return {"questions": questions, "answers": {}, "current_question_index": 0}
-
-def save_conversation_state(state):
-    """Save conversation state to a file."""
-    try:
-        with open(conversation_state_file, 'w') as file:
-            if DEBUG:
-                logging.debug("Saving conversation state to file.")
-            json.dump(state, file)
-    except IOError:
-        logging.error("Failed to save conversation state.")
+# Conversation state lives in a shared store, keyed per session
+conversation_store = get_conversation_store(os.getenv('CONVERSATION_STORE_PATH', 'conversation_state.db'))
 
-def initialize_conversation():
-    """Initialize the conversation with the list of questions."""
-    initial_prompt = f"Hello! I'm here to collect some information from you about you and your company.\nIf you type 'pause', you will save and exit the program, if you type 'finish' you will save and end the conversation. I'll be asking you the following questions:\n\n{chr(10).join(questions)}\n\nLet's get started!\n\nCan you please tell me your name?"
-    memory.save_context({"input": ""}, {"output": initial_prompt})
-    return initial_prompt
-
-def generate_response(user_input, chat_history):
-    """Generate a response based on the conversation history and user input."""
-    inputs = {
-        "input": user_input,
-        "questions": "\n".join(questions),
-        "chat_history": "\n".join([msg['content'] for msg in chat_history])
-    }
-
-    prompt = (
-        "You are a helpful assistant having a conversation with a user. Your goal is to collect information based on the provided list of questions.\n\n"
-        "Instructions:\n"
-        "1. Analyze the conversation history to determine which questions have been answered satisfactorily.\n"
-        "2. If there are unanswered questions, ask the next question in a natural way, building upon the previous conversation.\n"
-        "3. If the user's response does not directly answer the question, rephrase the question or ask for clarification. Only do this once per question to avoid annoying the user.\n"
-        "4. If the user provides a satisfactory answer, save the answer and move on to the next question.\n"
-        "5. If all questions have been answered, provide a summary of the user's responses and ask if everything is correct and end the program by typing 'finish' or if something needs to be changed.\n"
-        "6. If the user agrees with the summary and nothing needs to change, ask them to type finish.\n"
-        "7. Be concise and professional in your communication. Use the user's name when addressing them.\n\n"
-        "Questions to ask:\n{questions}\n\n"
-        "Conversation history:\n{chat_history}\n\n"
-        "User: {input}\n"
-        "Assistant:"
-    )
+def load_conversation_state(session_id):
+    """Load the conversation state of one session."""
+    if DEBUG:
+        logging.debug(f"Loading conversation state for session {session_id}.")
+    return conversation_store.load(session_id, questions)
 
+def save_conversation_state(session_id, state):
+    """Record what changed in the session's state since it was last saved."""
     if DEBUG:
-        logging.debug(f"Inputs for conversation prompt: {inputs}")
+        logging.debug(f"Saving conversation state for session {session_id}.")
+    conversation_store.save(session_id, state)
+
+# Define the prompt template; memory supplies the answers, summary and recent messages
+conversation_prompt = ChatPromptTemplate(
+    messages=[
+        SystemMessagePromptTemplate.from_template(
+            "You are a helpful assistant having a conversation with a user. Your goal is to collect information based on the provided list of questions.\n\n"
+            "Instructions:\n"
+            "1. Analyze the conversation history to determine which questions have been answered satisfactorily.\n"
+            "2. If there are unanswered questions, ask the next question in a natural way, building upon the previous conversation.\n"
+            "3. If the user's response does not directly answer the question, rephrase the question or ask for clarification. Only do this once per question to avoid annoying the user.\n"
+            "4. If the user provides a satisfactory answer, save the answer and move on to the next question.\n"
+            "5. If all questions have been answered, provide a summary of the user's responses and ask if everything is correct and end the program by typing 'finish' or if something needs to be changed.\n"
+            "6. If the user agrees with the summary and nothing needs to change, ask them to type finish.\n"
+            "7. Be concise and professional in your communication. Use the user's name when addressing them.\n\n"
+            "Questions to ask:\n{questions}"
+        ),
+        MessagesPlaceholder(variable_name="chat_history"),
+        HumanMessagePromptTemplate.from_template("{input}")
+    ]
+)
+
+conversation_chain = conversation_prompt | model
 
-    # Updated call to use invoke method
-    response = model.invoke(prompt.format(**inputs))
+def initialize_conversation():
+    """The opening message of every interview."""
+    return f"Hello! I'm here to collect some information from you about you and your company.\nIf you type 'pause', you will save and exit the program, if you type 'finish' you will save and end the conversation. I'll be asking you the following questions:\n\n{chr(10).join(questions)}\n\nLet's get started!\n\nCan you please tell me your name?"
+
+class InterviewSession:
+    """One user's interview: persisted conversation state plus its own prompt memory."""
+    def __init__(self, session_id):
+        self.session_id = session_id
+        # One turn at a time per session; different sessions run concurrently
+        self.lock = threading.Lock()
+        self.state = load_conversation_state(session_id)
+        self.memory = InterviewMemory(model, answers=self.state["answers"])
+        # A resumed interview continues from its most recent messages
+        for message in self.state["chat_history"][-self.memory.window_messages:]:
+            if message["role"] == "user":
+                self.memory.save_context({"input": message["content"]}, {"output": ""})
+            else:
+                self.memory.save_context({"input": ""}, {"output": message["content"]})
+
+    def start(self):
+        """Post the opening message to a new interview; returns the history so far."""
+        with self.lock:
+            if not self.state["chat_history"]:
+                initial_prompt = initialize_conversation()
+                self.memory.save_context({"input": ""}, {"output": initial_prompt})
+                self.state["chat_history"].append({"role": "assistant", "content": initial_prompt})
+                save_conversation_state(self.session_id, self.state)
+            return list(self.state["chat_history"])
+
+    def stream_response(self, user_input, cancelled=None):
+        """Yield the reply in chunks; the exchange is recorded once the reply is complete."""
+        with self.lock:
+            inputs = {
+                "input": user_input,
+                "questions": "\n".join(questions),
+                "chat_history": self.memory.load_memory_variables({})['chat_history']
+            }
 
-    if DEBUG:
-        logging.debug(f"Generated response: {response.content}")
+            if DEBUG:
+                logging.debug(f"Inputs for conversation prompt: {inputs}")
 
-    return response.content
+            parts = []
+            for chunk in conversation_chain.stream(inputs):
+                if cancelled is not None and cancelled.is_set():
+                    logging.info(f"Reply for session {self.session_id} cancelled")
+                    return
+                parts.append(chunk.content)
+                yield chunk.content
+            response = "".join(parts)
+
+            if DEBUG:
+                logging.debug(f"Generated response: {response}")
+
+            self.memory.save_context({"input": user_input}, {"output": response})
+            self.state["chat_history"].append({"role": "user", "content": user_input})
+            self.state["chat_history"].append({"role": "assistant", "content": response})
+            save_conversation_state(self.session_id, self.state)
+
+    def generate_response(self, user_input):
+        """Generate the complete reply to the user's input."""
+        return "".join(self.stream_response(user_input))
+
+# Active sessions; evicted sessions are rebuilt from the store on their next request
+sessions = LRUCache(maxsize=int(os.getenv('INTERVIEW_MAX_SESSIONS', 1000)))
+sessions_lock = threading.Lock()
+
+def get_session(session_id):
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            session = InterviewSession(session_id)
+            sessions[session_id] = session
+        return session
@@ -0,0 +1,95 @@
+import os
+import json
+import queue
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, Response, stream_with_context
+from chat_bot import get_session, conversation_store, questions, sessions, sessions_lock
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+port = int(os.getenv('INTERVIEW_PORT', 5002))
+
+# LLM calls run on a bounded worker pool so request threads only relay chunks
+interview_workers = int(os.getenv('INTERVIEW_WORKERS', 32))
+executor = ThreadPoolExecutor(max_workers=interview_workers, thread_name_prefix="interview")
+# Seconds to wait for the next chunk before giving up on a reply
+stream_timeout = float(os.getenv('INTERVIEW_STREAM_TIMEOUT', 60))
+
+@app.route('/interviews', methods=['POST'])
+def create_interview():
+    """Start a new interview, or resume one when a session_id is given."""
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id') or uuid.uuid4().hex
+    chat_history = get_session(session_id).start()
+    return jsonify({"session_id": session_id, "chat_history": chat_history})
+
+@app.route('/interviews/<session_id>', methods=['GET'])
+def get_interview(session_id):
+    state = get_session(session_id).state
+    answers = {question: state["answers"].get(question) for question in questions}
+    return jsonify({"session_id": session_id, "chat_history": state["chat_history"], "answers": answers})
+
+@app.route('/interviews/<session_id>', methods=['DELETE'])
+def delete_interview(session_id):
+    # Evict the live session too, or its next message would write the deleted state back
+    with sessions_lock:
+        session = sessions.pop(session_id, None)
+    if session is not None:
+        # Let a turn in progress save before the log is deleted
+        with session.lock:
+            conversation_store.delete(session_id)
+    else:
+        conversation_store.delete(session_id)
+    return '', 204
+
+@app.route('/interviews/<session_id>/messages', methods=['POST'])
+def post_message(session_id):
+    """Stream the reply as newline-delimited JSON events: token, done or error."""
+    data = request.get_json(silent=True) or {}
+    message = (data.get('message') or '').strip()
+    if not message:
+        return jsonify({"error": "No message provided"}), 400
+    session = get_session(session_id)
+    chunks = queue.Queue()
+    cancelled = threading.Event()
+
+    def run():
+        try:
+            for text in session.stream_response(message, cancelled=cancelled):
+                chunks.put(("token", text))
+            chunks.put(("done", None))
+        except Exception as e:
+            logger.error(f"Error generating reply for session {session_id}: {e}")
+            chunks.put(("error", "An error occurred. Please try again later."))
+
+    executor.submit(run)
+
+    def generate():
+        try:
+            while True:
+                try:
+                    kind, content = chunks.get(timeout=stream_timeout)
+                except queue.Empty:
+                    yield json.dumps({"type": "error", "error": "The reply timed out."}) + "\n"
+                    return
+                if kind == "token":
+                    yield json.dumps({"type": "token", "content": content}) + "\n"
+                elif kind == "done":
+                    yield json.dumps({"type": "done", "session_id": session_id}) + "\n"
+                    return
+                else:
+                    yield json.dumps({"type": "error", "error": content}) + "\n"
+                    return
+        finally:
+            # Client gone or reply finished: stop the worker at its next chunk
+            cancelled.set()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+if __name__ == '__main__':
+    app.run(port=port, threaded=True)
@@ -0,0 +1,155 @@
+# answer_validators.py
+import logging
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ACCEPT, REJECT, UNCERTAIN = "accept", "reject", "uncertain"
+
+INTEGER, NAME, YES_NO, FREE_TEXT = "integer", "name", "yes_no", "free_text"
+
+NUMBER_WORDS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+    "hundred": 100, "thousand": 1000,
+    "nul": 0, "een": 1, "één": 1, "twee": 2, "drie": 3, "vier": 4, "vijf": 5, "zes": 6, "zeven": 7, "acht": 8,
+    "negen": 9, "tien": 10, "elf": 11, "twaalf": 12, "twintig": 20, "dertig": 30, "veertig": 40, "vijftig": 50,
+    "honderd": 100, "duizend": 1000,
+}
+
+YES_WORDS = {"yes", "y", "yeah", "yep", "correct", "right", "confirmed", "exactly", "sure", "that's right", "that is correct",
+             "ja", "klopt", "precies", "dat klopt", "jazeker", "inderdaad"}
+NO_WORDS = {"no", "n", "nope", "wrong", "incorrect", "not correct", "that's wrong",
+            "nee", "niet", "klopt niet", "fout", "dat klopt niet"}
+
+NAME_PREFIX = re.compile(r"^(?:my name is|my name's|i am|i'm|it's|it is|this is|call me|mijn naam is|ik ben|ik heet|het is)\s+", re.IGNORECASE)
+NAME_PATTERN = re.compile(r"^[A-Za-zÀ-ÖØ-öø-ÿ][A-Za-zÀ-ÖØ-öø-ÿ'\-\.]*(?:\s+[A-Za-zÀ-ÖØ-öø-ÿ][A-Za-zÀ-ÖØ-öø-ÿ'\-\.]*){0,4}$")
+INTEGER_PATTERN = re.compile(r"\b\d{1,3}(?:[.,\s]\d{3})+\b|\b\d+\b")
+HEDGE_PATTERN = re.compile(r"\b(?:about|around|roughly|approximately|maybe|perhaps|between|or|few|several|some|ongeveer|zo'n|rond|misschien|tussen|of|paar|enkele)\b|-|~", re.IGNORECASE)
+# Replies that look like words but say "I don't know" or push back
+EVASIVE_PATTERN = re.compile(r"\b(?:don't|dont|not|no|know|why|what|sure|skip|weet|niet|geen|waarom|wat|liever)\b", re.IGNORECASE)
+CONTRAST_PATTERN = re.compile(r"\b(?:but|although|actually|except|maar|behalve|eigenlijk)\b", re.IGNORECASE)
+
+
+@dataclass
+class ValidationResult:
+    status: str
+    value: Optional[object] = None
+    reason: str = ""
+
+    @property
+    def certain(self) -> bool:
+        return self.status != UNCERTAIN
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"[\s!.?]+$", "", text.strip().lower())
+
+
+def validate_integer(answer: str) -> ValidationResult:
+    """A single whole number, in digits or words; hedged, multiple or worded answers ("just me") go to the LLM."""
+    text = answer.strip()
+    if not re.search(r"\w", text):
+        return ValidationResult(REJECT, reason="please give a number")
+    numbers = INTEGER_PATTERN.findall(text)
+    if HEDGE_PATTERN.search(text) or len(numbers) > 1:
+        return ValidationResult(UNCERTAIN, reason="approximate or several numbers")
+    if len(numbers) == 1:
+        return ValidationResult(ACCEPT, int(re.sub(r"[.,\s]", "", numbers[0])))
+    words = [NUMBER_WORDS[word] for word in re.findall(r"\w+", text.lower()) if word in NUMBER_WORDS]
+    if len(words) == 1:
+        return ValidationResult(ACCEPT, words[0])
+    return ValidationResult(UNCERTAIN)
+
+
+def validate_name(answer: str) -> ValidationResult:
+    """One to five name-like words, optionally after "my name is" / "ik heet"."""
+    text = NAME_PREFIX.sub("", answer.strip()).strip(" .!")
+    if not text:
+        return ValidationResult(REJECT, reason="no name given")
+    if any(char.isdigit() for char in text):
+        return ValidationResult(UNCERTAIN, reason="contains digits")
+    if NAME_PATTERN.match(text) and normalize(text) not in YES_WORDS | NO_WORDS and not EVASIVE_PATTERN.search(text):
+        return ValidationResult(ACCEPT, text)
+    return ValidationResult(UNCERTAIN)
+
+
+def validate_yes_no(answer: str) -> ValidationResult:
+    confirmed = is_confirmation(answer)
+    if confirmed is None:
+        return ValidationResult(UNCERTAIN)
+    return ValidationResult(ACCEPT, confirmed)
+
+
+def validate_free_text(answer: str, min_words: int = 3) -> ValidationResult:
+    """Accept substantive text; short or dismissive replies go to the LLM."""
+    text = answer.strip()
+    if not text:
+        return ValidationResult(REJECT, reason="empty answer")
+    if normalize(text) in YES_WORDS | NO_WORDS or len(text.split()) < min_words:
+        return ValidationResult(UNCERTAIN)
+    return ValidationResult(ACCEPT, text)
+
+
+def is_confirmation(answer: str) -> Optional[bool]:
+    """True/False for a plain yes or no (English or Dutch), None when it is anything else."""
+    text = normalize(answer)
+    if text in YES_WORDS:
+        return True
+    if text in NO_WORDS:
+        return False
+    words = [word for word in re.split(r"[\s,!.]+", text) if word]
+    # "yes, that's right" / "nee, fout" are still plain answers; "yes but it's 60" is not
+    if not words or len(words) > 4 or CONTRAST_PATTERN.search(text):
+        return None
+    if words[0] in YES_WORDS and words[0] not in ("correct", "right", "sure"):
+        return True
+    if words[0] in ("no", "nope", "nee"):
+        return False
+    return None
+
+
+VALIDATORS: Dict[str, Callable[[str], ValidationResult]] = {
+    INTEGER: validate_integer,
+    NAME: validate_name,
+    YES_NO: validate_yes_no,
+    FREE_TEXT: validate_free_text,
+}
+
+
+def infer_answer_type(question: str) -> str:
+    """Guess the answer schema from the wording of the question."""
+    text = question.lower()
+    if re.search(r"\bhow many\b|\bnumber of\b|\bhoeveel\b|\baantal\b", text):
+        return INTEGER
+    if re.search(r"\bname\b|\bnaam\b|\bwho is\b|\bwie is\b", text):
+        return NAME
+    if re.match(r"^(?:is|are|do|does|did|can|have|has|heeft|zijn|kunt|bent)\b", text):
+        return YES_NO
+    return FREE_TEXT
+
+
+class ValidatorRegistry:
+    """Answer type and local validator per interview question."""
+    def __init__(self, questions: Optional[List[str]] = None, answer_types: Optional[Dict[str, str]] = None):
+        self.answer_types: Dict[str, str] = {}
+        for question in questions or []:
+            self.register(question, infer_answer_type(question))
+        for question, answer_type in (answer_types or {}).items():
+            self.register(question, answer_type)
+
+    def register(self, question: str, answer_type: str):
+        if answer_type not in VALIDATORS:
+            raise ValueError(f"Unknown answer type: {answer_type}")
+        self.answer_types[question] = answer_type
+
+    def validate(self, question: Optional[str], answer: str) -> ValidationResult:
+        """Validate locally; UNCERTAIN means the caller should ask the LLM."""
+        answer_type = self.answer_types.get(question) if question else None
+        if answer_type is None:
+            return ValidationResult(UNCERTAIN)
+        result = VALIDATORS[answer_type](answer)
+        logger.debug(f"Local validation of '{answer}' as {answer_type}: {result.status}")
+        return result
@@ -1,7 +1,7 @@
 import streamlit as st
 import sys
 from styles import apply_custom_css, apply_custom_js
-from chat_handler import init_session_state, display_chat_history, handle_user_input, clear_chat_history
+from chat_handler import init_session_state, display_chat_history, handle_user_input, clear_chat_history, export_transcript
 
 def main():
     # hosted_local = True if len(sys.argv) > 1 and sys.argv[1] == "local" else False
@@ -12,8 +12,9 @@ def main():
     apply_custom_js()
     st.title("AI Chat Interface")
     init_session_state()
-    display_chat_history()
-    handle_user_input(backend_url)  # Pass backend_url as an argument
+    live_message = display_chat_history(backend_url)
+    handle_user_input(backend_url, live_message)  # Streams the answer into the placeholder
+    export_transcript(backend_url)
     clear_chat_history()
 
 if __name__ == "__main__":
@@ -2,18 +2,120 @@
 import logging
 from azure.search.documents import SearchClient
 from langchain.schema import Document
-from typing import List
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from fast_answer import extract_identifiers
 
 logger = logging.getLogger(__name__)
 
+# Filterable metadata captured at ingestion, with the type each filter value must have
+FILTER_FIELDS = {"document": str, "page": int, "section": str, "language": str, "date": datetime}
+FACET_FIELDS = ["document", "section", "language"]
+FILTER_OPERATORS = {"eq", "ne", "gt", "ge", "lt", "le"}
+
+SELECT_FIELDS = ["id", "content", "embedding", "parent_id", "section_path"] + list(FILTER_FIELDS)
+
+def to_document(result) -> Document:
+    metadata = {"id": result["id"], "embedding": result["embedding"], "parent_id": result.get("parent_id"), "section_path": result.get("section_path")}
+    metadata.update({field: result.get(field) for field in FILTER_FIELDS if result.get(field) is not None})
+    return Document(page_content=result["content"], metadata=metadata)
+
+def _literal(field: str, value) -> str:
+    expected = FILTER_FIELDS[field]
+    if expected is int:
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"Filter on {field} needs a whole number")
+        return str(value)
+    if expected is datetime:
+        try:
+            moment = datetime.fromisoformat(str(value))
+        except ValueError:
+            raise ValueError(f"Filter on {field} needs an ISO 8601 date")
+        return (moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)).isoformat()
+    if not isinstance(value, str):
+        raise ValueError(f"Filter on {field} needs a string")
+    return "'" + value.replace("'", "''") + "'"
+
+def build_filter(filters: Optional[Dict]) -> Optional[str]:
+    """OData filter from {"field": value | [values] | {"ge": value, ...}}; raises ValueError on bad input.
+
+    Only the ingestion metadata fields can be filtered, so request data never reaches the query verbatim.
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("Filters must be an object")
+    clauses = []
+    for field, condition in filters.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Cannot filter on {field}")
+        if isinstance(condition, list):
+            if not condition:
+                raise ValueError(f"Empty value list for {field}")
+            clauses.append("(" + " or ".join(f"{field} eq {_literal(field, value)}" for value in condition) + ")")
+        elif isinstance(condition, dict):
+            for operator, value in condition.items():
+                if operator not in FILTER_OPERATORS:
+                    raise ValueError(f"Unknown filter operator: {operator}")
+                clauses.append(f"{field} {operator} {_literal(field, value)}")
+        else:
+            clauses.append(f"{field} eq {_literal(field, condition)}")
+    return " and ".join(clauses)
+
 class AzureSearchRetriever:
-    """Custom Azure Search Retriever."""
-    def __init__(self, search_client: SearchClient):
+    """Custom Azure Search Retriever.
+
+    A `filter` (OData, see build_filter) is applied by the search service before scoring; `scope`
+    is a filter added to every search, e.g. to hide document versions that are not published.
+    """
+    def __init__(self, search_client: SearchClient, clause_index=None, scope: Optional[str] = None):
         self.search_client = search_client
+        self.clause_index = clause_index
+        self.scope = scope
+
+    def _combine(self, filter: Optional[str]) -> Optional[str]:
+        if filter and self.scope:
+            return f"({self.scope}) and ({filter})"
+        return filter or self.scope
 
-    def get_relevant_documents(self, query: str, max_documents: int = 5) -> List[Document]:
-        logger.info(f"Retrieving relevant documents for query: {query}")
-        results = self.search_client.search(search_text=query, select=["id", "content", "embedding"], top=max_documents)
-        documents = [Document(page_content=result["content"], metadata={"id": result["id"], "embedding": result["embedding"]}) for result in results]
+    def resolve_references(self, query: str, max_documents: int, filter: Optional[str] = None) -> List[Document]:
+        """Fetch the chunks of clauses/controls named in the query by key, via the clause index."""
+        documents = []
+        for identifier in extract_identifiers(query):
+            record = self.clause_index.lookup(identifier)
+            if record is None:
+                continue
+            scoped = self._combine(filter)
+            if scoped:
+                # Keyed lookups bypass the filter and scope, so fetch the clause's chunks through a filtered search
+                ids = ",".join(record["chunk_ids"][:max_documents])
+                results = self.search_client.search(search_text="*", filter=f"({scoped}) and search.in(id, '{ids}', ',')",
+                                                    select=SELECT_FIELDS, top=max_documents)
+                documents.extend(map(to_document, results))
+                continue
+            for chunk_id in record["chunk_ids"][:max_documents]:
+                try:
+                    documents.append(to_document(self.search_client.get_document(key=chunk_id, selected_fields=SELECT_FIELDS)))
+                except Exception as e:
+                    logger.warning(f"Chunk {chunk_id} of clause {identifier} not found: {e}")
+        return documents[:max_documents]
+
+    def get_relevant_documents(self, query: str, max_documents: int = 5, filter: Optional[str] = None) -> List[Document]:
+        logger.info(f"Retrieving relevant documents for query: {query}" + (f" (filter: {filter})" if filter else ""))
+        documents = self.resolve_references(query, max_documents, filter) if self.clause_index else []
+        if documents:
+            logger.info(f"Resolved {len(documents)} documents from the clause index")
+        remaining = max_documents - len(documents)
+        if remaining > 0:
+            seen = {doc.metadata["id"] for doc in documents}
+            results = self.search_client.search(search_text=query, filter=self._combine(filter), select=SELECT_FIELDS, top=max_documents)
+            documents.extend([doc for doc in map(to_document, results) if doc.metadata["id"] not in seen][:remaining])
         logger.info(f"Retrieved {len(documents)} documents")
         return documents
+
+    def facets(self, filter: Optional[str] = None, fields: List[str] = FACET_FIELDS) -> Dict[str, List[Dict]]:
+        """Value counts per metadata field, e.g. to offer document or language choices."""
+        results = self.search_client.search(search_text="*", filter=self._combine(filter), facets=[f"{field},count:50" for field in fields], top=0)
+        return {field: [{"value": facet["value"], "count": facet["count"]} for facet in values]
+                for field, values in (results.get_facets() or {}).items()}
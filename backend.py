@@ -1,24 +1,40 @@
 import os
 import warnings
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 from dotenv import load_dotenv
 from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.indexes.models import SearchIndex, SimpleField, SearchFieldDataType, SearchableField
 from langchain_community.document_loaders import UnstructuredPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document, AIMessage
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from werkzeug.utils import secure_filename
 from cachetools import TTLCache
 from typing import List
 import logging
 import openai
 import time
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # Custom modules
-from azure_retriever import AzureSearchRetriever
-from initialization import initialize_system, load_chunks_from_pdf
+from initialization import initialize_system
+from corpus_registry import CorpusRegistry, CorpusConfig, CorpusUnavailableError, load_corpus_configs, DEFAULT_CORPUS
+from index_versions import IndexVersionManager
+from azure_retriever import build_filter
+from chunking import expand_to_parents
+from reranker import load_reranker
+from session_store import create_session_store, new_session_id, HistoryCompactor
+from query_rewriter import QueryRewriter
+from prompt_builder import PromptBuilder, PromptTooLargeError
+from rate_limiter import create_rate_limiter, rate_limited, call_with_retries, estimate_prompt_tokens, RateLimitTimeout, PRIORITY_INTERACTIVE
+from circuit_breaker import CircuitBreaker, CircuitOpenError, FallbackRouter, PROVIDER_ERRORS
+from model_router import ModelRouter, CLAUSE
+from fast_answer import find_extract
+from batch_scheduler import create_local_scheduler
+from ingestion_jobs import JobStore, IngestionWorkers
+from folder_watcher import FolderWatcher
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
@@ -39,6 +55,9 @@ search_service_name = os.getenv('AZURE_SEARCH_SERVICE_NAME')
 search_admin_key = os.getenv('AZURE_SEARCH_ADMIN_KEY')
 search_index_name = os.getenv('AZURE_SEARCH_INDEX_NAME')
 port = int(os.getenv('PORT', 5000))  # Use PORT from environment or default to 5000
+# LLM_BASE_URL points the answer model at a local OpenAI-compatible server (vLLM, Ollama) serving LLM_MODEL
+primary_base_url = os.getenv('LLM_BASE_URL')
+primary_model = os.getenv('LLM_MODEL', 'gpt-3.5-turbo')
 
 def check_env_variables():
     """Check that all required environment variables are set."""
@@ -51,19 +70,8 @@ check_env_variables()
 # Initialize Azure Cognitive Search client
 search_endpoint = f"https://{search_service_name}.search.windows.net"
 credential = AzureKeyCredential(search_admin_key)
-search_client = SearchClient(endpoint=search_endpoint, index_name=search_index_name, credential=credential)
 index_client = SearchIndexClient(endpoint=search_endpoint, credential=credential)
 
-# Define the index schema with searchable fields and vector field properties
-index_schema = SearchIndex(
-    name=search_index_name,
-    fields=[
-        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
-        SearchableField(name="content", type=SearchFieldDataType.String, searchable=True),
-        SimpleField(name="embedding", type=SearchFieldDataType.String)
-    ]
-)
-
 # Check if pytesseract is available
 try:
     import pytesseract
@@ -71,14 +79,55 @@ try:
 except ImportError:
     pytesseract_available = False
 
-def truncate_context(context, max_tokens):
-    """Truncate context to fit within the token limit."""
-    tokens = context.split()
-    if len(tokens) <= max_tokens:
-        return context
-    truncated_context = ' '.join(tokens[:max_tokens])
-    logger.info(f"Context truncated to {max_tokens} tokens")
-    return truncated_context
+# Chunk embeddings are computed at ingestion only when INGEST_EMBEDDINGS=true
+ingest_embedder = (OpenAIEmbeddings(model="text-embedding-ada-002", api_key=openai_api_key).embed_documents
+                   if os.getenv('INGEST_EMBEDDINGS', 'false').lower() == 'true' else None)
+
+# Other corpora (CORPUS_REGISTRY_PATH) share the credential and are loaded on first request, at most CORPUS_MAX_LOADED at once
+default_corpus_config = CorpusConfig(DEFAULT_CORPUS, search_index_name, documents=[local_path])
+corpus_registry = CorpusRegistry(
+    load_corpus_configs(os.getenv('CORPUS_REGISTRY_PATH', 'corpora.json'), default=default_corpus_config),
+    search_endpoint, credential, index_client,
+    max_loaded=int(os.getenv('CORPUS_MAX_LOADED', 4)),
+    pytesseract_available=pytesseract_available,
+    embedder=ingest_embedder,
+)
+# The default corpus is served from versioned indexes (see index_versions.py) once one is live
+corpus_registry.manage(DEFAULT_CORPUS)
+
+# Documents queued through /ingest or `python ingestion_jobs.py enqueue` are ingested in the background
+ingest_root = os.path.abspath(os.getenv('INGEST_ROOT', 'input_data'))
+ingestion_workers = IngestionWorkers(JobStore(), corpus_registry, pytesseract_available,
+                                     workers=int(os.getenv('INGEST_WORKERS', 2)), embedder=ingest_embedder)
+# Corpora with an empty index are filled by the workers while requests get a 503
+corpus_registry.workers = ingestion_workers
+
+# Optional cross-encoder rerank stage (RERANK_ENABLED=true)
+reranker = load_reranker()
+top_k = 5
+
+# All OpenAI calls share one requests/tokens-per-minute budget; retries are scheduled by the limiter
+rate_limiter = create_rate_limiter()
+request_deadline = float(os.getenv('OPENAI_REQUEST_DEADLINE', 30))
+max_completion_tokens = 1024
+
+# Conversation sessions; older turns are summarized to keep the history within budget
+session_store = create_session_store()
+history_compactor = HistoryCompactor(
+    session_store,
+    rate_limited(ChatOpenAI(api_key=openai_api_key, model="gpt-3.5-turbo", max_retries=0), rate_limiter),
+    token_budget=int(os.getenv('HISTORY_TOKEN_BUDGET', 1000)),
+)
+# Follow-up questions are condensed to standalone search queries; the client timeout frees the rewrite
+# pool from hung calls, the rewriter falls back to the raw question after REWRITE_TIMEOUT seconds
+rewrite_timeout = float(os.getenv('REWRITE_TIMEOUT', 5))
+query_rewriter = QueryRewriter(rate_limited(
+    ChatOpenAI(api_key=openai_api_key, model="gpt-3.5-turbo", temperature=0, max_retries=0, timeout=2 * rewrite_timeout),
+    rate_limiter), timeout=rewrite_timeout)
+# Instructions and sorted context first, question last, within MAX_PROMPT_TOKENS
+prompt_builder = PromptBuilder(max_prompt_tokens=int(os.getenv('MAX_PROMPT_TOKENS', 12000)))
+# Model, top-k and context budget per question class; decisions go to ROUTER_LOG_PATH
+model_router = ModelRouter(log_path=os.getenv('ROUTER_LOG_PATH', 'router_decisions.jsonl'))
 
 def response_to_dict(response):
     """Convert the AIMessage or other OpenAI response objects to a dictionary."""
@@ -95,6 +144,92 @@ def msg_to_dict(msg):
         }
     return msg
 
+def retrieve_documents(corpus, query, k=top_k, search_filter=None):
+    """Retrieve the top k chunks of a corpus for a search query, reranked when enabled."""
+    retriever = corpus.retriever()
+    if reranker and corpus.config.rerank:
+        # Over-fetch candidates and keep the best k by cross-encoder score
+        candidates = retriever.get_relevant_documents(query, max_documents=reranker.candidates, filter=search_filter)
+        return reranker.rerank(query, candidates, top_k=k)
+    return retriever.get_relevant_documents(query, max_documents=k, filter=search_filter)
+
+def retrieve_context(question, session_id, corpus, search_filter=None):
+    """Route the question, load the session history and retrieve chunks of the corpus for the standalone question.
+
+    `search_filter` narrows the candidates to matching metadata before they are scored.
+    """
+    # Pick model, top-k and context budget for this kind of question
+    decision = model_router.route(question)
+    # Summary plus recent turns of this session, within the history token budget
+    history = history_compactor.get_history(session_id)
+    # Retrieve relevant documents for the standalone form of the question
+    turn = session_store.turn_count(session_id)
+    k = corpus.config.top_k or decision.config.top_k
+    documents, search_query = query_rewriter.retrieve(
+        question, history, lambda query: retrieve_documents(corpus, query, k=k, search_filter=search_filter), session_id=session_id, turn=turn)
+    return decision, history, documents, search_query
+
+def answer_cache_key(corpus, search_query, search_filter=None):
+    """Cached fallback answers are kept per corpus and filter."""
+    key = search_query if corpus.name == DEFAULT_CORPUS else f"{corpus.name}: {search_query}"
+    return f"{key} [{search_filter}]" if search_filter else key
+
+def try_fast_answer(question, decision, documents, parents):
+    """Extractive answer for clause/control lookups whose clause text was retrieved, else None."""
+    if decision.question_class != CLAUSE:
+        return None
+    return find_extract(question, documents, parents)
+
+def stream_answer(messages, route_config, cache_key, cancelled=None):
+    """Yield answer text from the primary model as it is generated, or one fallback answer.
+
+    While a fallback answer is pending, empty strings are yielded as heartbeats so a disconnected
+    client is noticed and `cancelled` set before the answer is generated.
+    """
+    name, _, breaker = llm_routes[0]
+    if breaker.allow():
+        start = time.monotonic()
+        recorded = False
+        options = {"max_tokens": route_config.max_completion_tokens}
+        try:
+            # A local primary serves its one model outside the OpenAI quota, and batches concurrent streams itself
+            if not primary_base_url:
+                rate_limiter.acquire(estimate_prompt_tokens(messages) + route_config.max_completion_tokens,
+                                     priority=PRIORITY_INTERACTIVE, deadline=time.monotonic() + request_deadline)
+                if route_config.model:
+                    options["model"] = route_config.model
+            for chunk in sequence.stream(messages, **options):
+                if not recorded:
+                    # Time to first token is what the breaker judges for streamed calls
+                    breaker.record(True, time.monotonic() - start)
+                    recorded = True
+                yield chunk.content
+            if not recorded:
+                breaker.record(True, time.monotonic() - start)
+                recorded = True
+            return
+        except PROVIDER_ERRORS as e:
+            if recorded:
+                raise
+            breaker.record(False, time.monotonic() - start)
+            recorded = True
+            logger.warning(f"Streaming from {name} failed, falling back: {e}")
+        finally:
+            if not recorded:
+                # Caller errors and disconnects before the first token say nothing about the provider,
+                # but a half-open probe slot must not leak
+                breaker.release_probe()
+    # The primary failed or its circuit is open: go straight to the fallback routes and answer cache
+    future = fallback_executor.submit(llm_router.invoke, messages, cache_key=cache_key, skip=(name,), model=route_config.model,
+                                      max_tokens=route_config.max_completion_tokens, cancelled=cancelled)
+    while True:
+        try:
+            response, route = future.result(timeout=heartbeat_seconds)
+            break
+        except FutureTimeoutError:
+            yield ""
+    yield response.content
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -103,34 +238,164 @@ def index():
 def test():
     return jsonify({"message": "Server is running"}), 200
 
+@app.route('/corpora', methods=['GET'])
+def list_corpora():
+    return jsonify({"default": DEFAULT_CORPUS, "corpora": corpus_registry.describe()})
+
+@app.route('/corpora/<name>/facets', methods=['GET'])
+def corpus_facets(name):
+    """Document, section and language counts of a corpus, optionally within `filters` (JSON query parameter)."""
+    if name not in corpus_registry:
+        return jsonify({"error": f"Unknown corpus: {name}"}), 404
+    try:
+        search_filter = build_filter(json.loads(request.args.get('filters') or 'null'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        with corpus_registry.using(name) as corpus:
+            return jsonify({"corpus": name, "facets": corpus.retriever().facets(search_filter)})
+    except CorpusUnavailableError:
+        return jsonify({"error": "The document index is being prepared. Please try again shortly."}), 503
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    """Queue PDFs for ingestion: uploaded `files`, or `paths` under INGEST_ROOT; returns the jobs."""
+    data = request.form if request.files else (request.get_json(silent=True) or {})
+    corpus_name = data.get('corpus') or DEFAULT_CORPUS
+    if corpus_name not in corpus_registry:
+        return jsonify({"error": f"Unknown corpus: {corpus_name}"}), 404
+    paths = []
+    for upload in request.files.getlist('files'):
+        filename = secure_filename(upload.filename or "")
+        if not filename.lower().endswith('.pdf'):
+            return jsonify({"error": f"Not a PDF: {upload.filename}"}), 400
+        path = os.path.join(ingest_root, "uploads", corpus_name, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        upload.save(path)
+        paths.append(path)
+    for path in ([] if request.files else data.get('paths') or []):
+        path = os.path.abspath(os.path.join(ingest_root, path))
+        # Only files under the ingest root can be named
+        if os.path.commonpath([path, ingest_root]) != ingest_root or not os.path.isfile(path):
+            return jsonify({"error": f"No such file under the ingest root: {path}"}), 400
+        paths.append(path)
+    if not paths:
+        return jsonify({"error": "No files provided"}), 400
+    jobs = [ingestion_workers.enqueue(corpus_name, path) for path in paths]
+    return jsonify({"jobs": jobs}), 202
+
+@app.route('/ingest', methods=['GET'])
+def list_ingestion_jobs():
+    """Recent jobs (optionally by `status`) with their per-stage progress, and throughput."""
+    store = ingestion_workers.store
+    return jsonify({"stats": store.stats(), "jobs": store.list(status=request.args.get('status'),
+                                                                 limit=request.args.get('limit', 50, type=int))})
+
+@app.route('/ingest/<job_id>', methods=['GET'])
+def get_ingestion_job(job_id):
+    job = ingestion_workers.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "No such job"}), 404
+    return jsonify(job)
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    return jsonify({"session_id": new_session_id()}), 201
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """Turns of a session; `before` and `limit` page backwards through older turns."""
+    since = int(request.args.get('since', 0))
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', type=int)
+    if before is not None and limit:
+        since = max(since, before - limit)
+    turns = session_store.get_turns(session_id, since=since)
+    if before is not None:
+        turns = [turn for turn in turns if turn["seq"] < before]
+    if limit:
+        turns = turns[-limit:]
+    return jsonify({"session_id": session_id, "turns": turns, **session_store.get_summary(session_id)})
+
+@app.route('/sessions/<session_id>/export', methods=['GET'])
+def export_session(session_id):
+    """Transcript as a Markdown (default) or JSON download.
+
+    The in-memory store keeps only the last SESSION_MAX_TURNS turns of a session; an export missing
+    earlier turns says so (a note in Markdown, the X-Transcript-Omitted-Turns header for both).
+    """
+    turns = session_store.get_turns(session_id)
+    # Turns are numbered from 0, so the first kept turn's number is how many were dropped
+    omitted = turns[0]["seq"] if turns else 0
+    if request.args.get('format') == 'json':
+        body, mimetype, extension = json.dumps(turns, indent=2), 'application/json', 'json'
+    else:
+        lines = [f"**{'You' if turn['role'] == 'user' else 'AI'}:** {turn['content']}\n" for turn in turns]
+        if omitted:
+            lines.insert(0, f"_Transcript truncated: the first {omitted} turns are no longer stored._\n")
+        body, mimetype, extension = "\n".join(lines), 'text/markdown', 'md'
+    return Response(body, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=transcript-{session_id}.{extension}",
+                             "X-Transcript-Omitted-Turns": str(omitted)})
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    session_store.delete(session_id)
+    return '', 204
+
 @app.route('/ask', methods=['POST'])
 def ask():
     data = request.json
     question = data.get('question')
     if not question:
         return jsonify({"error": "No question provided"}), 400
+    session_id = data.get('session_id') or new_session_id()
+    corpus_name = data.get('corpus') or DEFAULT_CORPUS
+    if corpus_name not in corpus_registry:
+        return jsonify({"error": f"Unknown corpus: {corpus_name}"}), 404
+    # Metadata filters, e.g. {"document": "ISOIEC_27001.pdf", "page": {"ge": 10}}
+    try:
+        search_filter = build_filter(data.get('filters'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    logger.info(f"Received question: {question}")
+    logger.info(f"Received question for session {session_id} on corpus {corpus_name}: {question}")
+    corpus = None
+    # Set once the request is over, so a generation still queued for a micro-batch is dropped
+    cancelled = threading.Event()
     try:
         # Ensure sequence is initialized
         if 'sequence' not in globals():
             logger.error("Sequence not initialized")
             raise ValueError("Sequence not initialized")
 
-        # Retrieve relevant documents
-        retriever = AzureSearchRetriever(search_client=search_client)
-        documents = retriever.get_relevant_documents(question)
-        # Concatenate context
-        context = " ".join([doc.page_content for doc in documents])
-        logger.info("Context: %s", context)
-        # Truncate context to fit within the token limit
-        max_tokens = 16000  # slightly less than model's limit to accommodate other tokens
-        truncated_context = truncate_context(context, max_tokens)
-        logger.info("Truncated context: %s", truncated_context)
-        # Prepare the input
-        input_data = {"context": truncated_context, "question": question}
-        # Invoke the sequence
-        response = sequence.invoke(input_data)
+        start_time = time.monotonic()
+        corpus = corpus_registry.acquire(corpus_name)
+        decision, history, documents, search_query = retrieve_context(question, session_id, corpus, search_filter)
+        route_config = decision.config
+        # Clause lookups are answered with the clause text itself, skipping the LLM
+        fast_answer = None if data.get('elaborate') else try_fast_answer(question, decision, documents, corpus.parents)
+        if fast_answer:
+            model_router.record(question, decision, route="extract", latency_ms=round((time.monotonic() - start_time) * 1000))
+            user_turn = session_store.append_turn(session_id, "user", question)
+            session_store.append_turn(session_id, "assistant", fast_answer.text)
+            return jsonify({
+                "response": fast_answer.text,
+                "session_id": session_id,
+                "turn": user_turn["seq"],
+                "citations": fast_answer.citations,
+                "served_by": "extract",
+            })
+        # Expand the small retrieved chunks to their parent sections
+        documents = expand_to_parents(documents, corpus.parents)
+        # Build the prompt within the token budget
+        prompt = prompt_builder.build(documents, question, history, max_prompt_tokens=route_config.max_prompt_tokens)
+        logger.info(f"Estimated prompt tokens: {prompt.estimated_tokens} ({len(prompt.documents)} context blocks)")
+        # Invoke the primary model, or a fallback / cached answer when it is degraded
+        response, route = llm_router.invoke(prompt.messages, cache_key=answer_cache_key(corpus, search_query, search_filter),
+                                            model=route_config.model, max_tokens=route_config.max_completion_tokens,
+                                            cancelled=cancelled)
+        logger.info(f"Answer served by route: {route}")
         
         # Convert response to a JSON serializable format
         response_content = response.content if hasattr(response, 'content') else None
@@ -146,7 +411,29 @@ def ask():
         }
         
         logger.info("Response: %s", response_dict['content'])
-        return jsonify({"response": response_dict["content"]})
+        model_router.record(question, decision, route=route, estimated_prompt_tokens=prompt.estimated_tokens,
+                            usage=usage_metadata, latency_ms=round((time.monotonic() - start_time) * 1000))
+        user_turn = session_store.append_turn(session_id, "user", question)
+        session_store.append_turn(session_id, "assistant", response_dict["content"] or "")
+        return jsonify({
+            "response": response_dict["content"],
+            "session_id": session_id,
+            "turn": user_turn["seq"],
+            "estimated_prompt_tokens": prompt.estimated_tokens,
+            "served_by": route,
+        })
+    except CorpusUnavailableError:
+        logger.warning(f"Corpus {corpus_name} has no live index yet")
+        return jsonify({"error": "The document index is being prepared. Please try again shortly."}), 503, {"Retry-After": "30"}
+    except PromptTooLargeError as e:
+        logger.error(f"PromptTooLargeError: {e}")
+        return jsonify({"error": "The question is too long. Please shorten it."}), 400
+    except CircuitOpenError as e:
+        logger.error(f"CircuitOpenError: {e}")
+        return jsonify({"error": "The AI service is temporarily unavailable. Please try again later."}), 503
+    except RateLimitTimeout as e:
+        logger.error(f"RateLimitTimeout: {e}")
+        return jsonify({"error": "Rate limit exceeded. Please try again later."}), 429, {"Retry-After": str(max(1, round(e.retry_after)))}
     except openai.RateLimitError as e:
         logger.error(f"RateLimitError: {e}")
         return jsonify({"error": "Rate limit exceeded. Please try again later."}), 429
@@ -156,11 +443,183 @@ def ask():
     except Exception as e:
         logger.error(f"Error: {e}")
         return jsonify({"error": "An error occurred. Please try again later."}), 500
+    finally:
+        cancelled.set()
+        if corpus is not None:
+            corpus.release()
+
+@app.route('/ask/stream', methods=['POST'])
+def ask_stream():
+    """Stream the answer as newline-delimited JSON events: extract, token, done or error."""
+    data = request.json
+    question = data.get('question')
+    if not question:
+        return jsonify({"error": "No question provided"}), 400
+    session_id = data.get('session_id') or new_session_id()
+    elaborate = bool(data.get('elaborate'))
+    corpus_name = data.get('corpus') or DEFAULT_CORPUS
+    if corpus_name not in corpus_registry:
+        return jsonify({"error": f"Unknown corpus: {corpus_name}"}), 404
+    # Metadata filters, e.g. {"document": "ISOIEC_27001.pdf", "page": {"ge": 10}}
+    try:
+        search_filter = build_filter(data.get('filters'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    logger.info(f"Received streamed question for session {session_id} on corpus {corpus_name}: {question}")
+
+    cancelled = threading.Event()
+
+    def generate():
+        corpus = None
+        try:
+            start_time = time.monotonic()
+            corpus = corpus_registry.acquire(corpus_name)
+            decision, history, documents, search_query = retrieve_context(question, session_id, corpus, search_filter)
+            fast_answer = try_fast_answer(question, decision, documents, corpus.parents)
+            answer = ""
+            if fast_answer:
+                # The clause text goes out immediately; the LLM elaboration follows only on request
+                yield json.dumps({"type": "extract", "content": fast_answer.text, "citations": fast_answer.citations}) + "\n"
+                answer = fast_answer.text
+            if not fast_answer or elaborate:
+                documents = expand_to_parents(documents, corpus.parents)
+                prompt = prompt_builder.build(documents, question, history, max_prompt_tokens=decision.config.max_prompt_tokens)
+                parts = []
+                for text in stream_answer(prompt.messages, decision.config, answer_cache_key(corpus, search_query, search_filter), cancelled):
+                    if not text:
+                        yield "\n"  # heartbeat; fails once the client is gone
+                        continue
+                    parts.append(text)
+                    yield json.dumps({"type": "token", "content": text}) + "\n"
+                answer = "\n\n".join(part for part in (answer, "".join(parts)) if part)
+            model_router.record(question, decision, route="stream", extract=bool(fast_answer),
+                                latency_ms=round((time.monotonic() - start_time) * 1000))
+            user_turn = session_store.append_turn(session_id, "user", question)
+            session_store.append_turn(session_id, "assistant", answer)
+            yield json.dumps({"type": "done", "session_id": session_id, "turn": user_turn["seq"]}) + "\n"
+        except CorpusUnavailableError:
+            logger.warning(f"Corpus {corpus_name} has no live index yet")
+            yield json.dumps({"type": "error", "error": "The document index is being prepared. Please try again shortly."}) + "\n"
+        except (RateLimitTimeout, openai.RateLimitError) as e:
+            logger.error(f"Rate limit while streaming: {e}")
+            yield json.dumps({"type": "error", "error": "Rate limit exceeded. Please try again later."}) + "\n"
+        except Exception as e:
+            logger.error(f"Error while streaming: {e}")
+            yield json.dumps({"type": "error", "error": "An error occurred. Please try again later."}) + "\n"
+        finally:
+            # Reached on completion and when the client disconnects: drop any queued local generation
+            cancelled.set()
+            if corpus is not None:
+                corpus.release()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 # Initialize the sequence globally
 global sequence
-sequence = initialize_system(openai_api_key, search_index_name, index_client, index_schema, search_client, local_path, pytesseract_available)
+sequence = initialize_system(os.getenv('LLM_API_KEY', 'local') if primary_base_url else openai_api_key,
+                             base_url=primary_base_url, model=primary_model)
 logger.info(f"Sequence initialized: {sequence is not None}")
 
+ingestion_workers.start()
+
+# WATCH_FOLDER (e.g. input_data) keeps the WATCH_CORPUS corpus in sync with the PDFs dropped there
+watch_folder = os.getenv('WATCH_FOLDER')
+watch_corpus = os.getenv('WATCH_CORPUS', DEFAULT_CORPUS)
+folder_watcher = FolderWatcher(
+    watch_folder,
+    corpus_registry.configs[watch_corpus],
+    ingestion_workers,
+    debounce=float(os.getenv('WATCH_DEBOUNCE_SECONDS', 5)),
+    poll_interval=float(os.getenv('WATCH_POLL_SECONDS', 10)),
+    use_inotify=os.getenv('WATCH_INOTIFY', 'true').lower() == 'true',
+) if watch_folder else None
+if folder_watcher and watch_corpus != DEFAULT_CORPUS:
+    folder_watcher.start()
+
+def on_index_switch(corpus):
+    """Point the folder watcher at the new index version's records; it starts with the first live version."""
+    if folder_watcher is None or corpus.name != watch_corpus:
+        return
+    if folder_watcher.running:
+        folder_watcher.resync(corpus.config)
+    else:
+        folder_watcher.corpus = corpus.config
+        folder_watcher.start()
+
+# The live index version is served once its shared document records are downloaded (no parsing); a version
+# for the current documents is built, smoke-tested and switched to in the background, so startup never empties
+# the index. Incremental ingests on any replica reach the others within INDEX_POINTER_POLL_SECONDS
+index_versions = IndexVersionManager(
+    default_corpus_config, corpus_registry, index_client, search_endpoint, credential,
+    pytesseract_available=pytesseract_available,
+    embedder=ingest_embedder,
+    lease_seconds=float(os.getenv('INDEX_BUILD_LEASE_SECONDS', 900)),
+    poll_interval=float(os.getenv('INDEX_POINTER_POLL_SECONDS', 30)),
+    smoke_queries=[query for query in os.getenv('INDEX_SMOKE_QUERIES', '').split('|') if query.strip()],
+    on_switch=on_index_switch,
+)
+index_versions.start()
+
+def invoke_primary(messages, model=None, max_tokens=max_completion_tokens, cancelled=None):
+    """Call the primary model once the rate limiter admits it, retrying 429s until the deadline.
+
+    A local primary (LLM_BASE_URL) serves its one model through the micro-batch scheduler, where
+    `cancelled` drops a request still waiting for its batch; a remote call already sent is not cancelled.
+    """
+    if primary_base_url:
+        if primary_scheduler:
+            return primary_scheduler.call(messages, max_tokens, timeout=request_deadline, cancelled=cancelled)
+        return sequence.invoke(messages, max_tokens=max_tokens)
+    options = {"max_tokens": max_tokens}
+    if model:
+        options["model"] = model
+    return call_with_retries(
+        lambda: sequence.invoke(messages, **options),
+        rate_limiter,
+        estimate_prompt_tokens(messages) + max_tokens,
+        priority=PRIORITY_INTERACTIVE,
+        deadline=time.monotonic() + request_deadline,
+    )
+
+def create_fallback_route():
+    """Fallback model from FALLBACK_MODEL; FALLBACK_BASE_URL points it at a local OpenAI-compatible server."""
+    fallback_model = os.getenv('FALLBACK_MODEL')
+    if not fallback_model:
+        return None
+    fallback_base_url = os.getenv('FALLBACK_BASE_URL')
+    if fallback_base_url:
+        # Local model (e.g. Ollama): not subject to the OpenAI quota
+        local_scheduler = create_local_scheduler(fallback_base_url, fallback_model, api_key=os.getenv('FALLBACK_API_KEY', 'local'),
+                                                 timeout=fallback_timeout)
+        if local_scheduler:
+            # Concurrent requests share micro-batches; each keeps its own completion limit
+            return ("fallback",
+                    lambda messages, model=None, max_tokens=None, cancelled=None: local_scheduler.call(
+                        messages, max_tokens or max_completion_tokens, timeout=fallback_timeout, cancelled=cancelled),
+                    CircuitBreaker("fallback", slow_call_seconds=fallback_timeout))
+        fallback_llm = ChatOpenAI(api_key=os.getenv('FALLBACK_API_KEY', 'local'), base_url=fallback_base_url,
+                                  model=fallback_model, max_retries=0, timeout=fallback_timeout)
+        invoke = fallback_llm.invoke
+    else:
+        fallback_llm = ChatOpenAI(api_key=openai_api_key, model=fallback_model, max_retries=0, timeout=fallback_timeout)
+        invoke = rate_limited(fallback_llm, rate_limiter, priority=PRIORITY_INTERACTIVE, timeout=fallback_timeout).invoke
+    # The fallback keeps its own model and completion settings
+    return ("fallback", lambda messages, model=None, max_tokens=None, cancelled=None: invoke(messages),
+            CircuitBreaker("fallback", slow_call_seconds=fallback_timeout))
+
+# Circuit breakers bound the time spent on a degraded provider
+fallback_timeout = float(os.getenv('FALLBACK_TIMEOUT', 15))
+# Streamed requests wait for a fallback answer here, sending heartbeats meanwhile
+fallback_executor = ThreadPoolExecutor(max_workers=int(os.getenv('FALLBACK_STREAM_WORKERS', 16)), thread_name_prefix="fallback")
+heartbeat_seconds = float(os.getenv('STREAM_HEARTBEAT_SECONDS', 1.0))
+# Concurrent /ask requests to a local primary share micro-batches
+primary_scheduler = (create_local_scheduler(primary_base_url, primary_model, api_key=os.getenv('LLM_API_KEY', 'local'),
+                                            timeout=request_deadline) if primary_base_url else None)
+llm_routes = [("primary", invoke_primary, CircuitBreaker("primary", slow_call_seconds=float(os.getenv('LLM_SLOW_CALL_SECONDS', 15))))]
+fallback_route = create_fallback_route()
+if fallback_route:
+    llm_routes.append(fallback_route)
+llm_router = FallbackRouter(llm_routes)
+
 if __name__ == '__main__':
     app.run(port=port, debug=True)
@@ -0,0 +1,156 @@
+# batch_scheduler.py
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional
+from langchain.schema import AIMessage
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCancelled(Exception):
+    """The caller went away before its request was answered."""
+
+
+class BatchRequest:
+    def __init__(self, messages, max_tokens: int, cancelled: Optional[threading.Event] = None):
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.cancelled = cancelled or threading.Event()
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.future.cancel()
+
+
+def render_prompt(messages) -> str:
+    """Flatten chat messages into one completion prompt for servers that batch plain prompts."""
+    labels = {"system": "System", "human": "User", "ai": "Assistant"}
+    lines = [f"{labels.get(message.type, message.type.title())}: {message.content}" for message in messages]
+    return "\n\n".join(lines) + "\n\nAssistant:"
+
+
+def completions_dispatch(client, model: str) -> Callable[[List[BatchRequest], int], List]:
+    """One /v1/completions call with a list of prompts (vLLM, llama.cpp server, TGI)."""
+    def dispatch(requests: List[BatchRequest], max_tokens: int) -> List:
+        response = client.completions.create(model=model, prompt=[render_prompt(request.messages) for request in requests],
+                                             max_tokens=max_tokens)
+        texts = [""] * len(requests)
+        for choice in response.choices:
+            texts[choice.index] = choice.text.strip()
+        return [AIMessage(content=text) for text in texts]
+    return dispatch
+
+
+def concurrent_dispatch(llm) -> Callable[[List[BatchRequest], int], List]:
+    """Send the batch as parallel chat calls, for servers that batch internally across connections (Ollama)."""
+    def dispatch(requests: List[BatchRequest], max_tokens: int) -> List:
+        return llm.batch([request.messages for request in requests], config={"max_concurrency": len(requests)},
+                         return_exceptions=True, max_tokens=max_tokens)
+    return dispatch
+
+
+class MicroBatchScheduler:
+    """Group concurrent generation requests into micro-batches for a local model server.
+
+    Requests arriving within `max_wait_ms` of each other (up to `max_batch_size`) are sent together;
+    requests with different max_tokens go in separate batches so none generates more than it asked for.
+    Requests cancelled while queued are dropped before dispatch.
+    """
+    def __init__(self, dispatch: Callable[[List[BatchRequest], int], List], max_batch_size: int = 8,
+                 max_wait_ms: float = 15.0, max_workers: int = 2):
+        self.dispatch = dispatch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests: "queue.Queue[BatchRequest]" = queue.Queue()
+        # Batches in flight at once; more than the server's parallel slots only adds queueing there
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="micro-batch")
+        self.collector = threading.Thread(target=self._collect_loop, name="micro-batch-collector", daemon=True)
+        self.collector.start()
+
+    def submit(self, messages, max_tokens: int, cancelled: Optional[threading.Event] = None) -> BatchRequest:
+        request = BatchRequest(messages, max_tokens, cancelled)
+        self.requests.put(request)
+        return request
+
+    def call(self, messages, max_tokens: int, timeout: Optional[float] = None,
+             cancelled: Optional[threading.Event] = None, poll_seconds: float = 0.1):
+        """Block until the request's batch has run; raises TimeoutError or RequestCancelled."""
+        request = self.submit(messages, max_tokens, cancelled)
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            if request.cancelled.is_set():
+                request.cancel()
+                raise RequestCancelled("Client disconnected")
+            wait = poll_seconds if deadline is None else min(poll_seconds, deadline - time.monotonic())
+            if wait <= 0:
+                request.cancel()
+                raise TimeoutError("Local model did not answer in time")
+            try:
+                return request.future.result(timeout=wait)
+            except FutureTimeoutError:
+                continue
+
+    def _collect_loop(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            groups: Dict[int, List[BatchRequest]] = {}
+            for request in batch:
+                if request.cancelled.is_set() or not request.future.set_running_or_notify_cancel():
+                    continue
+                groups.setdefault(request.max_tokens, []).append(request)
+            for max_tokens, group in groups.items():
+                self.executor.submit(self._run_batch, group, max_tokens)
+
+    def _run_batch(self, group: List[BatchRequest], max_tokens: int):
+        start = time.monotonic()
+        try:
+            results = self.dispatch(group, max_tokens)
+        except Exception as e:
+            logger.error(f"Micro-batch of {len(group)} failed: {e}")
+            for request in group:
+                request.future.set_exception(e)
+            return
+        for request, result in zip(group, results):
+            if isinstance(result, Exception):
+                request.future.set_exception(result)
+            else:
+                request.future.set_result(result)
+        queued_ms = (start - min(request.enqueued_at for request in group)) * 1000
+        logger.info(f"Micro-batch of {len(group)} (max_tokens={max_tokens}) in {(time.monotonic() - start) * 1000:.0f} ms, "
+                    f"queued up to {queued_ms:.0f} ms")
+
+
+def create_local_scheduler(base_url: str, model: str, api_key: str = "local", timeout: float = 60.0) -> Optional[MicroBatchScheduler]:
+    """Scheduler for the local model server, from LOCAL_BATCH_MODE (completions|concurrent|off)."""
+    mode = os.getenv('LOCAL_BATCH_MODE', 'concurrent').lower()
+    if mode == 'off':
+        return None
+    if mode == 'completions':
+        from openai import OpenAI
+        dispatch = completions_dispatch(OpenAI(base_url=base_url, api_key=api_key, timeout=timeout, max_retries=0), model)
+    else:
+        from langchain_openai import ChatOpenAI
+        dispatch = concurrent_dispatch(ChatOpenAI(api_key=api_key, base_url=base_url, model=model, max_retries=0, timeout=timeout))
+    scheduler = MicroBatchScheduler(
+        dispatch,
+        max_batch_size=int(os.getenv('LOCAL_BATCH_SIZE', 8)),
+        max_wait_ms=float(os.getenv('LOCAL_BATCH_WAIT_MS', 15)),
+        max_workers=int(os.getenv('LOCAL_BATCH_WORKERS', 2)),
+    )
+    logger.info(f"Micro-batching requests to {base_url} ({mode}, batch={scheduler.max_batch_size}, wait={scheduler.max_wait * 1000:.0f} ms)")
+    return scheduler
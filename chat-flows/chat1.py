@@ -1,4 +1,5 @@
 import os
+import sys
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -11,6 +12,10 @@ from langchain.chains import LLMChain
 from langchain.memory import ConversationBufferMemory
 from langchain_core.messages import HumanMessage, AIMessage
 
+# Shared modules live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from answer_validators import ACCEPT, REJECT, ValidatorRegistry
+
 # Initialize the model
 model = ChatOpenAI(model="gpt-4o-mini")
 
@@ -80,6 +85,18 @@ def ask_question(question):
         # Combine question and answer for input handling
         combined_input = f"Question: {question}\nAnswer: {user_answer}"
 
+        # Clear-cut answers are settled locally; the exchange is still recorded for the summary
+        validation = validator_registry.validate(question, user_answer)
+        if validation.status == ACCEPT:
+            memory.save_context({"input": combined_input}, {"text": "yes"})
+            print("Correct answer!")
+            break
+        if validation.status == REJECT:
+            memory.save_context({"input": combined_input}, {"text": "no"})
+            print("Incorrect answer, please try again.")
+            print(f"Explanation: {validation.reason.capitalize()}.")
+            continue
+
         # Evaluate the user's answer using the evaluation chain with combined input
         evaluation_output = evaluation_chain.invoke({"input": combined_input})
         evaluation_result = evaluation_output['text'].strip().lower()  # Correctly extract the text
@@ -103,6 +120,9 @@ questions = [
     "What is the mission of your company?"
 ]
 
+# Typed answers per question, checked locally before asking the LLM
+validator_registry = ValidatorRegistry(questions)
+
 # Main loop to ask questions
 for question_template in questions:
     ask_question(question_template)
@@ -1,5 +1,5 @@
 import os
-import json
+import sys
 import logging
 from dotenv import load_dotenv
 import random
@@ -16,16 +16,21 @@ DEBUG = False
 
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, SystemMessagePromptTemplate, HumanMessagePromptTemplate
-from langchain.memory import ConversationBufferMemory
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.runnables import RunnableSequence
+from pydantic import BaseModel, Field, ValidationError, model_validator
+from typing import Literal, Optional
+
+# Shared modules live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from conversation_store import get_conversation_store
+from interview_memory import InterviewMemory
+from answer_validators import ACCEPT, ValidatorRegistry, is_confirmation
+from speculative import SpeculativeCache
 
 # Initialize the model
 model = ChatOpenAI(model="gpt-4o-mini")
 
-# Define memory to track conversation history
-memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-
 # List of questions to ask
 questions = [
     "What is your name?",
@@ -35,34 +40,31 @@ questions = [
     "What is the mission of your company?"
 ]
 
-# Path for saving and loading conversation state
-conversation_state_file = "conversation_state.json"
+# Typed answers per question, checked locally before asking the LLM
+validator_registry = ValidatorRegistry(questions)
+
+# Conversation state lives in a shared store, keyed per session
+conversation_store = get_conversation_store(os.getenv('CONVERSATION_STORE_PATH', 'conversation_state.db'))
+session_id = os.getenv('INTERVIEW_SESSION_ID', 'default')
 
 def load_conversation_state():
-    """Load conversation state from a file."""
-    try:
-        if os.path.exists(conversation_state_file):
-            with open(conversation_state_file, 'r') as file:
-                if DEBUG:
-                    logging.debug("Loading conversation state from file.")
-                return json.load(file)
-    except json.JSONDecodeError:
-        logging.error("Failed to load conversation state. Starting a new conversation.")
-    return {"questions": questions, "answers": {}}
+    """Load the conversation state of this session."""
+    if DEBUG:
+        logging.debug(f"Loading conversation state for session {session_id}.")
+    return conversation_store.load(session_id, questions)
 
 def save_conversation_state(state):
-    """Save conversation state to a file."""
-    try:
-        with open(conversation_state_file, 'w') as file:
-            if DEBUG:
-                logging.debug("Saving conversation state to file.")
-            json.dump(state, file)
-    except IOError:
-        logging.error("Failed to save conversation state.")
+    """Record what changed in the session's state since it was last saved."""
+    if DEBUG:
+        logging.debug(f"Saving conversation state for session {session_id}.")
+    conversation_store.save(session_id, state)
 
 # Load existing conversation state or initialize a new one
 conversation_state = load_conversation_state()
 
+# Answers, a rolling summary and a bounded window of recent messages keep the prompt size flat
+memory = InterviewMemory(model, answers=conversation_state["answers"])
+
 # Define the prompt template to dynamically handle questions and answers
 conversation_prompt = ChatPromptTemplate(
     messages=[
@@ -74,7 +76,6 @@ conversation_prompt = ChatPromptTemplate(
             "- Respond in a friendly and conversational tone.\n"
             "- Use the user's name when addressing them.\n"
             "Questions to be asked:\n{questions}\n"
-            "Conversation so far:\n{chat_history}\n"
             "Please ask the next unanswered or not fully answered question from the list to the user."
         ),
         MessagesPlaceholder(variable_name="chat_history"),
@@ -127,6 +128,65 @@ evaluation_chain = evaluation_prompt | model
 confirmation_chain = confirmation_prompt | model
 confirmation_evaluation_chain = confirmation_evaluation_prompt | model
 
+# Structured mode: one call per turn evaluates the response, handles confirmation and writes the next utterance
+STRUCTURED_OUTPUT = os.getenv('INTERVIEW_STRUCTURED_OUTPUT', 'true').lower() == 'true'
+
+class TurnAssessment(BaseModel):
+    """Schema for the single structured reply of the assessment chain."""
+    verdict: Literal["go ahead", "need validation", "confirmed", "not confirmed"]
+    answer: Optional[str] = None
+    next_utterance: str = Field(min_length=1)
+    awaiting_confirmation: bool = False
+
+    @model_validator(mode="after")
+    def check_consistency(self):
+        if self.verdict in ("go ahead", "need validation") and not self.answer:
+            raise ValueError(f"verdict '{self.verdict}' requires an extracted answer")
+        if self.awaiting_confirmation != (self.verdict == "need validation"):
+            raise ValueError("awaiting_confirmation must be set exactly when validation is needed")
+        return self
+
+assessment_prompt = ChatPromptTemplate(
+    messages=[
+        SystemMessagePromptTemplate.from_template(
+            "You are a helpful assistant interviewing a user, one question at a time.\n"
+            "Questions to be asked:\n{questions}\n"
+            "Current question: {current_question}\n"
+            "Answer awaiting the user's confirmation: {pending_answer}\n\n"
+            "Evaluate the user's latest message and reply with a single JSON object with these keys:\n"
+            "- \"verdict\": if an answer is awaiting confirmation, 'confirmed' or 'not confirmed' depending on whether the user confirms it; "
+            "otherwise 'go ahead' if the message answers the current question, or 'need validation' if it is ambiguous or unclear. "
+            "Be lenient with short answers.\n"
+            "- \"answer\": the answer to the current question extracted from the message, or null.\n"
+            "- \"awaiting_confirmation\": true only when the verdict is 'need validation'.\n"
+            "- \"next_utterance\": what you say next, in a friendly and conversational tone, using the user's name when known. "
+            "For 'go ahead' and 'confirmed' acknowledge the answer and ask the next unanswered question, or, if none are left, "
+            "tell the user they have finished and summarise their answers. For 'need validation' ask the user to confirm, "
+            "e.g. 'Just to confirm, your name is Mark. Is that correct?'. For 'not confirmed' ask the current question again."
+        ),
+        MessagesPlaceholder(variable_name="chat_history"),
+        HumanMessagePromptTemplate.from_template("{input}")
+    ]
+)
+
+assessment_chain = assessment_prompt | model.bind(response_format={"type": "json_object"})
+
+def assess_turn(user_input, current_question, pending_answer):
+    """Run the structured assessment; None if the reply does not match the schema."""
+    output = assessment_chain.invoke({
+        "input": user_input,
+        "questions": "\n".join(conversation_state["questions"]),
+        "current_question": current_question or "(all questions answered)",
+        "pending_answer": pending_answer or "(none)",
+        "chat_history": memory.load_memory_variables({})['chat_history']
+    })
+    content = output.content if isinstance(output, AIMessage) else str(output)
+    try:
+        return TurnAssessment.model_validate_json(content)
+    except ValidationError as e:
+        logging.warning(f"Structured assessment did not match the schema, using the legacy chains: {e}")
+        return None
+
 def validate_user_input(user_input):
     """Validate user input."""
     if not user_input.strip():
@@ -142,136 +202,249 @@ def get_random_acknowledgement():
     acknowledgements = ["I see", "Okay", "Alright", "Understood"]
     return random.choice(acknowledgements)
 
-def ask_questions():
-    """Main function to manage the conversation."""
-    while True:
-        try:
-            # Prepare inputs with the current state of questions and answers
-            inputs = {
-                "input": "Please continue the conversation.",
-                "questions": "\n".join(conversation_state["questions"]),
-                "chat_history": memory.load_memory_variables({})['chat_history']
-            }
+# While the user types, the follow-up question is phrased in the background on the assumption the answer is accepted
+speculative_cache = SpeculativeCache(max_workers=1)
+# Accepted turns use that phrasing only if it is already done, never waiting for it; INTERVIEW_SPECULATIVE_PREFETCH=false
+# saves the extra call per turn and keeps the template
+SPECULATIVE_PREFETCH = os.getenv('INTERVIEW_SPECULATIVE_PREFETCH', 'true').lower() == 'true'
 
-            if DEBUG:
-                logging.debug(f"Inputs for conversation chain: {inputs}")
-
-            # Invoke the conversation chain
-            output = conversation_chain.invoke(inputs)
-
-            # Extract the content from the AIMessage
-            if isinstance(output, AIMessage):
-                response = output.content.strip()
-            else:
-                response = str(output).strip()
+transition_prompt = ChatPromptTemplate(
+    messages=[
+        SystemMessagePromptTemplate.from_template(
+            "You are a helpful assistant interviewing a user. The user has just answered the previous question. "
+            "Thank them briefly without repeating their answer, use their name when known, and ask the next question: {question}\n"
+            "Reply with what you say only."
+        ),
+        MessagesPlaceholder(variable_name="chat_history")
+    ]
+)
 
+transition_chain = transition_prompt | model
+
+def prefetch_next_question(response):
+    """Start phrasing the question after the current one, keyed by the index it assumes."""
+    question = next_question()
+    if question is None or question not in conversation_state["questions"]:
+        return
+    index = conversation_state["questions"].index(question) + 1
+    if index >= len(conversation_state["questions"]):
+        return
+    # Snapshot the inputs now; memory changes once the user answers
+    inputs = {
+        "question": conversation_state["questions"][index],
+        "chat_history": memory.load_memory_variables({})['chat_history'] + [AIMessage(content=response)]
+    }
+    speculative_cache.prefetch(session_id, (index, "accepted"), lambda: transition_chain.invoke(inputs).content.strip())
+
+def local_assessment(user_input, question, pending_answer):
+    """Settle the turn without the LLM when the answer or confirmation validates locally; None otherwise."""
+    if pending_answer:
+        confirmed = is_confirmation(user_input)
+        if confirmed is None:
+            return None
+        if not confirmed:
+            return TurnAssessment(verdict="not confirmed", next_utterance=f"I apologize for the confusion. Let's try that again. {question}")
+        verdict, answer = "confirmed", pending_answer
+    else:
+        validation = validator_registry.validate(question, user_input)
+        if validation.status != ACCEPT:
+            return None
+        verdict, answer = "go ahead", str(validation.value)
+    index = conversation_state["questions"].index(question) + 1 if question in conversation_state["questions"] else len(conversation_state["questions"])
+    if index >= len(conversation_state["questions"]):
+        # The closing summary is left to the LLM
+        return None
+    return TurnAssessment(verdict=verdict, answer=answer,
+                          next_utterance=speculated_utterance(question) or f"{get_random_acknowledgement()}. {conversation_state['questions'][index]}")
+
+def speculated_utterance(question):
+    """The prefetched phrasing of the question after `question`, if it is already done."""
+    if question not in conversation_state["questions"]:
+        return None
+    return speculative_cache.take(session_id, (conversation_state["questions"].index(question) + 1, "accepted"), timeout=0)
+
+def legacy_turn(user_input):
+    """Evaluate and confirm the response with separate chains; False if the user paused."""
+    validation = validator_registry.validate(next_question(), user_input)
+    if validation.certain:
+        evaluation_result = 'go ahead' if validation.status == ACCEPT else 'need validation'
+    else:
+        # Evaluate the user's response with the LLM
+        evaluation_input = {
+            "input": user_input,
+            "chat_history": memory.load_memory_variables({})['chat_history']
+        }
+
+        if DEBUG:
+            logging.debug(f"Inputs for evaluation chain: {evaluation_input}")
+
+        evaluation_output = evaluation_chain.invoke(evaluation_input)
+
+        # Interpret the evaluation output
+        if isinstance(evaluation_output, AIMessage):
+            evaluation_result = evaluation_output.content.strip().lower()
+        else:
+            evaluation_result = str(evaluation_output).strip().lower()
+
+    if DEBUG:
+        logging.debug(f"Evaluation result: {evaluation_result}")
+
+    if evaluation_result == 'go ahead':
+        # Save answer and continue
+        current_question_index = len(conversation_state["answers"])
+        if current_question_index < len(conversation_state["questions"]):
+            current_question = conversation_state["questions"][current_question_index]
+            conversation_state["answers"][current_question] = user_input
             if DEBUG:
-                logging.debug(f"Response from conversation chain: {response}")
-
-            print(response)
-            user_input = input("Your response (type 'pause' to save and exit): ")
-
-            if user_input.lower() == 'pause':
-                if DEBUG:
-                    logging.debug("User chose to pause the conversation.")
-                print("Conversation paused. Your progress has been saved.")
-                save_conversation_state(conversation_state)
-                break
-
-            validate_user_input(user_input)
-
-            # Save the user's response in the conversation history
-            memory.save_context({"input": user_input}, {"output": response})
-
-            # Evaluate the user's response with the LLM
-            evaluation_input = {
-                "input": user_input,
+                logging.debug(f"Answer saved for question '{current_question}': {user_input}")
+            print(get_random_acknowledgement() + ". Let's move on.")
+    elif evaluation_result == 'need validation':
+        # Use the confirmation chain to generate a natural confirmation question
+        confirmation_input = {
+            "input": user_input,
+            "chat_history": memory.load_memory_variables({})['chat_history']
+        }
+
+        if DEBUG:
+            logging.debug(f"Inputs for confirmation chain: {confirmation_input}")
+
+        confirmation_output = confirmation_chain.invoke(confirmation_input)
+
+        # Extract the confirmation question from the output
+        if isinstance(confirmation_output, AIMessage):
+            confirmation_question = confirmation_output.content.strip()
+        else:
+            confirmation_question = str(confirmation_output).strip()
+
+        print(confirmation_question)
+        user_confirmation = input("Your response (type 'pause' to save and exit): ")
+
+        if user_confirmation.lower() == 'pause':
+            if DEBUG:
+                logging.debug("User chose to pause the conversation.")
+            print("Conversation paused. Your progress has been saved.")
+            save_conversation_state(conversation_state)
+            return False
+
+        confirmed = is_confirmation(user_confirmation)
+        if confirmed is not None:
+            confirmation_evaluation_result = 'confirmed' if confirmed else 'not confirmed'
+        else:
+            # Evaluate the user's confirmation with the LLM
+            confirmation_evaluation_input = {
+                "input": user_confirmation,
                 "chat_history": memory.load_memory_variables({})['chat_history']
             }
 
             if DEBUG:
-                logging.debug(f"Inputs for evaluation chain: {evaluation_input}")
+                logging.debug(f"Inputs for confirmation evaluation chain: {confirmation_evaluation_input}")
 
-            evaluation_output = evaluation_chain.invoke(evaluation_input)
+            confirmation_evaluation_output = confirmation_evaluation_chain.invoke(confirmation_evaluation_input)
 
-            # Interpret the evaluation output
-            if isinstance(evaluation_output, AIMessage):
-                evaluation_result = evaluation_output.content.strip().lower()
+            # Interpret the confirmation evaluation output
+            if isinstance(confirmation_evaluation_output, AIMessage):
+                confirmation_evaluation_result = confirmation_evaluation_output.content.strip().lower()
             else:
-                evaluation_result = str(evaluation_output).strip().lower()
+                confirmation_evaluation_result = str(confirmation_evaluation_output).strip().lower()
 
-            if DEBUG:
-                logging.debug(f"Evaluation result: {evaluation_result}")
-
-            if evaluation_result == 'go ahead':
-                # Save answer and continue
-                current_question_index = len(conversation_state["answers"])
-                if current_question_index < len(conversation_state["questions"]):
-                    current_question = conversation_state["questions"][current_question_index]
-                    conversation_state["answers"][current_question] = user_input
-                    if DEBUG:
-                        logging.debug(f"Answer saved for question '{current_question}': {user_input}")
-                    print(get_random_acknowledgement() + ". Let's move on.")
-            elif evaluation_result == 'need validation':
-                # Use the confirmation chain to generate a natural confirmation question
-                confirmation_input = {
-                    "input": user_input,
+        if DEBUG:
+            logging.debug(f"Confirmation evaluation result: {confirmation_evaluation_result}")
+
+        if confirmation_evaluation_result == 'confirmed':
+            # Save answer and continue
+            current_question_index = len(conversation_state["answers"])
+            if current_question_index < len(conversation_state["questions"]):
+                current_question = conversation_state["questions"][current_question_index]
+                conversation_state["answers"][current_question] = user_input
+                if DEBUG:
+                    logging.debug(f"Answer saved for question '{current_question}': {user_input}")
+                print(get_random_acknowledgement() + ". Let's proceed.")
+        else:
+            print("I apologize for the confusion. Let's try that again.")
+            return True
+    return True
+
+def next_question():
+    """The first question without an answer, or None when all are answered."""
+    index = len(conversation_state["answers"])
+    if index < len(conversation_state["questions"]):
+        return conversation_state["questions"][index]
+    return None
+
+def ask_questions():
+    """Main function to manage the conversation."""
+    next_utterance = None
+    pending_answer = None
+    while True:
+        try:
+            if next_utterance is None:
+                # Prepare inputs with the current state of questions and answers
+                inputs = {
+                    "input": "Please continue the conversation.",
+                    "questions": "\n".join(conversation_state["questions"]),
                     "chat_history": memory.load_memory_variables({})['chat_history']
                 }
 
                 if DEBUG:
-                    logging.debug(f"Inputs for confirmation chain: {confirmation_input}")
+                    logging.debug(f"Inputs for conversation chain: {inputs}")
 
-                confirmation_output = confirmation_chain.invoke(confirmation_input)
+                # Invoke the conversation chain
+                output = conversation_chain.invoke(inputs)
 
-                # Extract the confirmation question from the output
-                if isinstance(confirmation_output, AIMessage):
-                    confirmation_question = confirmation_output.content.strip()
+                # Extract the content from the AIMessage
+                if isinstance(output, AIMessage):
+                    response = output.content.strip()
                 else:
-                    confirmation_question = str(confirmation_output).strip()
+                    response = str(output).strip()
 
-                print(confirmation_question)
-                user_confirmation = input("Your response (type 'pause' to save and exit): ")
-
-                if user_confirmation.lower() == 'pause':
-                    if DEBUG:
-                        logging.debug("User chose to pause the conversation.")
-                    print("Conversation paused. Your progress has been saved.")
-                    save_conversation_state(conversation_state)
-                    return
+                if DEBUG:
+                    logging.debug(f"Response from conversation chain: {response}")
+            else:
+                # The structured assessment already wrote what to say next
+                response, next_utterance = next_utterance, None
 
-                # Evaluate the user's confirmation with the LLM
-                confirmation_evaluation_input = {
-                    "input": user_confirmation,
-                    "chat_history": memory.load_memory_variables({})['chat_history']
-                }
+            print(response)
+            if SPECULATIVE_PREFETCH:
+                prefetch_next_question(response)
+            user_input = input("Your response (type 'pause' to save and exit): ")
 
+            if user_input.lower() == 'pause':
                 if DEBUG:
-                    logging.debug(f"Inputs for confirmation evaluation chain: {confirmation_evaluation_input}")
+                    logging.debug("User chose to pause the conversation.")
+                print("Conversation paused. Your progress has been saved.")
+                save_conversation_state(conversation_state)
+                break
 
-                confirmation_evaluation_output = confirmation_evaluation_chain.invoke(confirmation_evaluation_input)
+            validate_user_input(user_input)
 
-                # Interpret the confirmation evaluation output
-                if isinstance(confirmation_evaluation_output, AIMessage):
-                    confirmation_evaluation_result = confirmation_evaluation_output.content.strip().lower()
-                else:
-                    confirmation_evaluation_result = str(confirmation_evaluation_output).strip().lower()
+            # Save the question in the conversation history; the response follows once it has been assessed
+            memory.save_context({"input": ""}, {"output": response})
 
+            assessment = local_assessment(user_input, next_question(), pending_answer)
+            if assessment is None and STRUCTURED_OUTPUT:
+                assessment = assess_turn(user_input, next_question(), pending_answer)
+                if assessment is not None and assessment.verdict in ('go ahead', 'confirmed'):
+                    # Accepted by the LLM: the transition phrased while the user typed matches this outcome
+                    assessment.next_utterance = speculated_utterance(next_question()) or assessment.next_utterance
+            memory.save_context({"input": user_input}, {"output": ""})
+
+            if assessment is None:
+                pending_answer = None
+                if not legacy_turn(user_input):
+                    return
+            else:
                 if DEBUG:
-                    logging.debug(f"Confirmation evaluation result: {confirmation_evaluation_result}")
-
-                if confirmation_evaluation_result == 'confirmed':
-                    # Save answer and continue
-                    current_question_index = len(conversation_state["answers"])
-                    if current_question_index < len(conversation_state["questions"]):
-                        current_question = conversation_state["questions"][current_question_index]
-                        conversation_state["answers"][current_question] = user_input
-                        if DEBUG:
-                            logging.debug(f"Answer saved for question '{current_question}': {user_input}")
-                        print(get_random_acknowledgement() + ". Let's proceed.")
-                else:
-                    print("I apologize for the confusion. Let's try that again.")
-                    continue
+                    logging.debug(f"Structured assessment: {assessment}")
+                question = next_question()
+                if question and assessment.verdict == 'go ahead':
+                    conversation_state["answers"][question] = assessment.answer
+                elif question and assessment.verdict == 'confirmed' and (pending_answer or assessment.answer):
+                    conversation_state["answers"][question] = pending_answer or assessment.answer
+                pending_answer = assessment.answer if assessment.awaiting_confirmation else None
+                next_utterance = assessment.next_utterance
+
+            # Any speculation not used by an accepted answer assumed the wrong outcome
+            speculative_cache.discard(session_id)
 
             # Save the updated state after each interaction
             save_conversation_state(conversation_state)
@@ -1,5 +1,5 @@
 import os
-import json
+import sys
 import logging
 from dotenv import load_dotenv
 import random
@@ -16,15 +16,18 @@ DEBUG = False
 
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, SystemMessagePromptTemplate, HumanMessagePromptTemplate
-from langchain.memory import ConversationBufferMemory
 from langchain_core.messages import HumanMessage, AIMessage
 
+# Shared modules live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from conversation_store import get_conversation_store
+from interview_memory import InterviewMemory
+from answer_validators import ACCEPT, ValidatorRegistry
+from speculative import SpeculativeCache
+
 # Initialize the model
 model = ChatOpenAI(model="gpt-4o-mini")
 
-# Define memory to track conversation history
-memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-
 # List of questions to ask
 questions = [
     "What is your name?",
@@ -34,59 +37,53 @@ questions = [
     "What is the mission of your company?"
 ]
 
-# Path for saving and loading conversation state
-conversation_state_file = "conversation_state.json"
+# Typed answers per question, checked locally before asking the LLM
+validator_registry = ValidatorRegistry(questions)
+
+# Conversation state lives in a shared store, keyed per session
+conversation_store = get_conversation_store(os.getenv('CONVERSATION_STORE_PATH', 'conversation_state.db'))
+session_id = os.getenv('INTERVIEW_SESSION_ID', 'default')
 
 def load_conversation_state():
-    """Load conversation state from a file."""
-    try:
-        if os.path.exists(conversation_state_file):
-            with open(conversation_state_file, 'r') as file:
-                if DEBUG:
-                    logging.debug("Loading conversation state from file.")
-                state = json.load(file)
-                if "current_question_index" not in state:
-                    state["current_question_index"] = 0
-                return state
-    except json.JSONDecodeError:
-        logging.error("Failed to load conversation state. Starting a new conversation.")
-    return {"questions": questions, "answers": {}, "current_question_index": 0}
+    """Load the conversation state of this session."""
+    if DEBUG:
+        logging.debug(f"Loading conversation state for session {session_id}.")
+    return conversation_store.load(session_id, questions)
 
 def save_conversation_state(state):
-    """Save conversation state to a file."""
-    try:
-        with open(conversation_state_file, 'w') as file:
-            if DEBUG:
-                logging.debug("Saving conversation state to file.")
-            json.dump(state, file)
-    except IOError:
-        logging.error("Failed to save conversation state.")
+    """Record what changed in the session's state since it was last saved."""
+    if DEBUG:
+        logging.debug(f"Saving conversation state for session {session_id}.")
+    conversation_store.save(session_id, state)
 
 # Load existing conversation state or initialize a new one
 conversation_state = load_conversation_state()
 
-# Define the prompt template
+# Answers, a rolling summary and a bounded window of recent messages keep the prompt size flat
+memory = InterviewMemory(model, answers=conversation_state["answers"])
+
+# Define the prompt template; memory supplies the answers, summary and recent messages once, after the instructions
 conversation_prompt = ChatPromptTemplate(
     messages=[
         SystemMessagePromptTemplate.from_template(
             "You are a helpful assistant having a conversation with a user. Your goal is to collect information based on the provided list of questions.\n\n"
             "Instructions:\n"
-            "1. Greet the user and start asking the questions one by one.\n"
-            "2. After each question, analyze the user's response to determine if it answers the question satisfactorily.\n"
-            "3. If the response does not answer the question, rephrase the question or ask for clarification.\n"
-            "4. If the response answers the question, save the answer and move on to the next question.\n"
-            "5. If all questions have been answered, provide a summary of the user's responses and ask the user to validate it. If the user is happy with the results, they should type 'finish' to end the conversation.\n"
-            "6. Be concise and professional in your communication. Use the user's name when addressing them.\n\n"
-            "Questions to ask:\n{questions}\n\n"
-            "Conversation history:\n{chat_history}\n\n"
-            "User: {input}\n"
-            "Assistant:"
+            "1. Analyze the conversation history to determine which questions have been answered satisfactorily.\n"
+            "2. If there are unanswered questions, ask the next question in a natural way, building upon the previous conversation.\n"
+            "3. If the user's response does not directly answer the question, rephrase the question or ask for clarification. Only do this once per question to avoid annoying the user.\n"
+            "4. If the user provides a satisfactory answer, save the answer and move on to the next question.\n"
+            "5. If all questions have been answered, provide a summary of the user's responses and ask if everything is correct and end the program by typing 'finish' or if something needs to be changed.\n"
+            "6. If the user agrees with the summary and nothing needs to change, ask them to type finish.\n"
+            "7. Be concise and professional in your communication. Use the user's name when addressing them.\n\n"
+            "Questions to ask:\n{questions}"
         ),
         MessagesPlaceholder(variable_name="chat_history"),
         HumanMessagePromptTemplate.from_template("{input}")
     ]
 )
 
+conversation_chain = conversation_prompt | model
+
 def initialize_conversation():
     """Initialize the conversation with the list of questions."""
     initial_prompt = f"Hello! I'm here to collect some information from you about you and your company.\nIf you type 'pause', you will save and exit the program, if you type 'finish' you will save and end the conversation. I'll be asking you the following questions:\n\n{chr(10).join(questions)}\n\nLet's get started!\n\nCan you please tell me your name?"
@@ -95,45 +92,85 @@ def initialize_conversation():
 
 def generate_response(user_input):
     """Generate a response based on the conversation history and user input."""
+    # The input is passed separately, so it is added to memory only after the response
     inputs = {
         "input": user_input,
         "questions": "\n".join(questions),
         "chat_history": memory.load_memory_variables({})['chat_history']
     }
 
-    prompt = (
-        "You are a helpful assistant having a conversation with a user. Your goal is to collect information based on the provided list of questions.\n\n"
-        "Instructions:\n"
-        "1. Analyze the conversation history to determine which questions have been answered satisfactorily.\n"
-        "2. If there are unanswered questions, ask the next question in a natural way, building upon the previous conversation.\n"
-        "3. If the user's response does not directly answer the question, rephrase the question or ask for clarification. Only do this once per question to avoid annoying the user.\n"
-        "4. If the user provides a satisfactory answer, save the answer and move on to the next question.\n"
-        "5. If all questions have been answered, provide a summary of the user's responses and ask if everything is correct and end the program by typing 'finish' or if something needs to be changed.\n"
-        "6. If the user agrees with the summary and nothing needs to change, ask them to type finish.\n"
-        "7. Be concise and professional in your communication. Use the user's name when addressing them.\n\n"
-        "Questions to ask:\n{questions}\n\n"
-        "Conversation history:\n{chat_history}\n\n"
-        "User: {input}\n"
-        "Assistant:"
-    )
-
     if DEBUG:
         logging.debug(f"Inputs for conversation prompt: {inputs}")
 
-    # Updated call to use invoke method
-    response = model.invoke(prompt.format(**inputs))
+    response = conversation_chain.invoke(inputs)
 
     if DEBUG:
         logging.debug(f"Generated response: {response.content}")
 
     return response.content
 
+def get_random_acknowledgement():
+    """Get a random acknowledgement."""
+    acknowledgements = ["I see", "Okay", "Alright", "Understood"]
+    return random.choice(acknowledgements)
+
+# The question index is only known while every turn went through the local path
+questions_in_sync = True
+
+# While the user types, the follow-up question is phrased in the background on the assumption the answer is accepted
+speculative_cache = SpeculativeCache(max_workers=1)
+# Accepted turns use that phrasing only if it is already done, never waiting for it; INTERVIEW_SPECULATIVE_PREFETCH=false
+# saves the extra call per turn and keeps the template
+SPECULATIVE_PREFETCH = os.getenv('INTERVIEW_SPECULATIVE_PREFETCH', 'true').lower() == 'true'
+
+transition_prompt = ChatPromptTemplate(
+    messages=[
+        SystemMessagePromptTemplate.from_template(
+            "You are a helpful assistant interviewing a user. The user has just answered the previous question. "
+            "Thank them briefly without repeating their answer, use their name when known, and ask the next question: {question}\n"
+            "Reply with what you say only."
+        ),
+        MessagesPlaceholder(variable_name="chat_history")
+    ]
+)
+
+transition_chain = transition_prompt | model
+
+def prefetch_next_question():
+    """Start phrasing the question after the current one, keyed by the index it assumes."""
+    index = conversation_state["current_question_index"] + 1
+    if not questions_in_sync or index >= len(questions):
+        return
+    # Snapshot the inputs now; memory changes once the user answers
+    inputs = {"question": questions[index], "chat_history": memory.load_memory_variables({})['chat_history']}
+    speculative_cache.prefetch(session_id, (index, "accepted"), lambda: transition_chain.invoke(inputs).content.strip())
+
+def local_response(user_input):
+    """Record a clear-cut answer to the current question and ask the next one without the LLM; None otherwise."""
+    global questions_in_sync
+    index = conversation_state["current_question_index"]
+    if not questions_in_sync or index >= len(questions) - 1:
+        # Last question: the LLM writes the closing summary
+        return None
+    validation = validator_registry.validate(questions[index], user_input)
+    if validation.status != ACCEPT:
+        # From here on the LLM decides which question comes next
+        questions_in_sync = False
+        speculative_cache.discard(session_id)
+        return None
+    conversation_state["answers"][questions[index]] = str(validation.value)
+    conversation_state["current_question_index"] = index + 1
+    speculated = speculative_cache.take(session_id, (index + 1, "accepted"), timeout=0)
+    return speculated or f"{get_random_acknowledgement()}. {questions[index + 1]}"
+
 def ask_questions():
     """Main function to manage the conversation."""
     initialize_conversation()
 
 
     while True:
+        if SPECULATIVE_PREFETCH:
+            prefetch_next_question()
         user_input = input("Your response: ")
 
         if user_input.lower() == 'pause':
@@ -146,9 +183,8 @@ def ask_questions():
         if user_input.lower() == 'finish':
             if DEBUG:
                 logging.debug("User chose to end the conversation.")
-            memory.save_context({"input": user_input}, {"output": ""})
             response = generate_response(user_input)
-            memory.save_context({"input": ""}, {"output": response})
+            memory.save_context({"input": user_input}, {"output": response})
             print(response)
             print("\nThank you for the conversation! Here is a summary of your responses:")
             for question in questions:
@@ -156,10 +192,8 @@ def ask_questions():
                 print(f"{question}: {answer}")
             break
 
-        memory.save_context({"input": user_input}, {"output": ""})
-        response = generate_response(user_input)
-
-        memory.save_context({"input": ""}, {"output": response})
+        response = local_response(user_input) or generate_response(user_input)
+        memory.save_context({"input": user_input}, {"output": response})
         print(response)
 
         save_conversation_state(conversation_state)
@@ -1,12 +1,16 @@
 import logging
 from langchain.prompts import ChatPromptTemplate, PromptTemplate
-from langchain.memory import ConversationBufferMemory
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 import os
+import sys
 from dotenv import load_dotenv
 
+# Shared modules live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from interview_memory import InterviewMemory
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,8 +25,8 @@ logger.info("Initializing the OpenAI LLM.")
 llm = ChatOpenAI(api_key=openai_api_key, model="gpt-3.5-turbo") 
 logger.info("LLM initialized.")
 
-# Set up the conversation memory
-memory = ConversationBufferMemory()
+# Set up the conversation memory: answers, a rolling summary and a bounded window of recent messages
+memory = InterviewMemory(llm, return_messages=False)
 
 # Define the initial prompt template
 initial_prompt = "Goedemorgen, vandaag gaan we wat informatie verzamelen. Mag ik beginnen met uw naam?"
@@ -79,7 +83,7 @@ while True:
     if index == 0:
         user_name = user_input
     else:
-        user_name = memory.load_memory_variables().get("user_name", "gebruiker")
+        user_name = memory.answers.get("Wat is uw naam?", "gebruiker")
 
     # Get the next question
     next_question = get_next_question(index)
@@ -109,7 +113,8 @@ while True:
     print(f"Chatbot: {response}")
 
     # Update memory
-    memory.save_context({"previous_question": previous_question, "user_input": user_input})
+    memory.set_answer(previous_question, user_input)
+    memory.save_context({"input": user_input}, {"output": response})
 
     # Store the current user input and question for the next iteration
     previous_user_input = user_input
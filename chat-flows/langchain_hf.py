@@ -1,8 +1,12 @@
 import logging
-from transformers import AutoModelForCausalLM, AutoTokenizer
 import os
+import sys
 from dotenv import load_dotenv
 
+# Shared modules live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from local_inference import load_local_generator, options_from_env
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,11 +16,11 @@ load_dotenv()
 openai_api_key = os.getenv('OPENAI_API_KEY')
 logger.info("Loaded environment variables.")
 
-# Initialize the tokenizer and model for Dutch
-logger.info("Initializing the tokenizer and model for Dutch.")
-tokenizer = AutoTokenizer.from_pretrained("GroNLP/bert-base-dutch-cased")
-model = AutoModelForCausalLM.from_pretrained("GroNLP/bert-base-dutch-cased")
-logger.info("Tokenizer and model initialized.")
+# The Dutch model is loaded once, in this process or in the inference server at LOCAL_INFERENCE_URL
+logger.info("Initializing the local generator for Dutch.")
+generator = load_local_generator()
+generation_options = options_from_env()
+logger.info("Local generator initialized.")
 
 # Define the initial prompt
 initial_prompt = "Goedemorgen, vandaag gaan we wat informatie verzamelen. Mag ik beginnen met uw naam?"
@@ -37,11 +41,9 @@ def get_next_question(index):
         return "Dank u voor uw antwoorden. Het gesprek is nu ten einde."
 
 # Function to generate a conversational response
-def generate_response(model, tokenizer, prompt_text):
+def generate_response(generator, prompt_text):
     logger.info(f"Generating response for prompt: {prompt_text}")
-    inputs = tokenizer(prompt_text, return_tensors="pt", truncation=True, max_length=1024)
-    outputs = model.generate(inputs["input_ids"], max_new_tokens=150, num_beams=5, early_stopping=True)
-    response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    response = generator.generate(prompt_text, generation_options)
     logger.info(f"Generated response: {response}")
     return response
 
@@ -81,7 +83,7 @@ while True:
     
     logger.info(f"Prompt text for LLM: {prompt_text}")
     # Generate a conversational response
-    response = generate_response(model, tokenizer, prompt_text)
+    response = generate_response(generator, prompt_text)
 
     # Output the response
     print(f"Chatbot: {response}")
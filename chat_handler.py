@@ -1,33 +1,185 @@
+import html
+import json
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds; the read timeout applies between streamed chunks
+REQUEST_TIMEOUT = (3.05, 60)
+
+# Only the latest exchanges are kept and rendered; older ones are paged in from the backend
+PAGE_SIZE = 10
+MAX_CACHED_TURNS = 50
+
+@st.cache_resource
+def get_http_session():
+    """Shared keep-alive session with retries for connection errors and overload responses.
+
+    Read timeouts are not retried: the backend may still be answering, and a repeated /ask would call
+    the model again and store the turn twice.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def render_message(question, answer):
+    """HTML for one exchange, rendered once and reused on every rerun."""
+    return (
+        f'<div class="message user"><b>You:</b> {html.escape(question)}</div>'
+        f'<div class="message bot"><b>AI:</b> {html.escape(answer)}</div>'
+    )
 
 def init_session_state():
     if "history" not in st.session_state:
         st.session_state.history = []
+    if "history_html" not in st.session_state:
+        st.session_state.history_html = []
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = None
+    if "visible_turns" not in st.session_state:
+        reset_history_view()
 
-def display_chat_history():
-    st.markdown('<div class="chat-box">', unsafe_allow_html=True)
-    for item in st.session_state.history:
-        st.markdown(f'<div class="message user"><b>You:</b> {item["question"]}</div>', unsafe_allow_html=True)
-        st.markdown(f'<div class="message bot"><b>AI:</b> {item["answer"]}</div>', unsafe_allow_html=True)
-    st.markdown('</div>', unsafe_allow_html=True)
+def reset_history_view():
+    st.session_state.visible_turns = PAGE_SIZE
+    st.session_state.older_html = []
+    st.session_state.older_before = None
+    st.session_state.older_exhausted = False
 
-def handle_user_input(backend_url):
+def oldest_known_turn():
+    if st.session_state.older_before is not None:
+        return st.session_state.older_before
+    if st.session_state.history:
+        return st.session_state.history[0].get("turn")
+    return None
+
+def load_older_turns(backend_url):
+    """Fetch the page of exchanges before the oldest one on screen from the backend."""
+    before = oldest_known_turn()
+    if not st.session_state.session_id or not before:
+        st.session_state.older_exhausted = True
+        return
+    response = get_http_session().get(
+        f"{backend_url}/sessions/{st.session_state.session_id}",
+        params={"before": before, "limit": 2 * PAGE_SIZE},
+        timeout=REQUEST_TIMEOUT,
+    )
+    response.raise_for_status()
+    turns = response.json().get("turns", [])
+    if not turns:
+        st.session_state.older_exhausted = True
+        return
+    # Pair each question with the answer that follows it
+    page, question = [], None
+    for turn in turns:
+        if turn["role"] == "user":
+            question = turn["content"]
+        elif question is not None:
+            page.append(render_message(question, turn["content"]))
+            question = None
+    st.session_state.older_html = page + st.session_state.older_html
+    st.session_state.older_before = turns[0]["seq"]
+    st.session_state.older_exhausted = turns[0]["seq"] == 0
+
+def display_chat_history(backend_url):
+    """Render the latest exchanges as one element and return a placeholder for the message in progress."""
+    history_html = st.session_state.history_html
+    hidden = len(history_html) > st.session_state.visible_turns
+    may_have_older = not st.session_state.older_exhausted and bool(oldest_known_turn())
+    if (hidden or may_have_older) and st.button("Show older messages"):
+        if hidden:
+            st.session_state.visible_turns += PAGE_SIZE
+        else:
+            try:
+                load_older_turns(backend_url)
+            except (requests.RequestException, ValueError) as e:
+                st.error(f"Error: Unable to load older messages. {e}")
+    visible = st.session_state.older_html + history_html[-st.session_state.visible_turns:]
+    st.markdown('<div class="chat-box">' + "".join(visible) + '</div>', unsafe_allow_html=True)
+    return st.empty()
+
+def stream_answer(backend_url, question, placeholder):
+    """Post the question to the streaming endpoint and render the answer as it arrives."""
+    answer = ""
+    with get_http_session().post(
+        f"{backend_url}/ask/stream",
+        json={"question": question, "session_id": st.session_state.session_id},
+        stream=True,
+        timeout=REQUEST_TIMEOUT,
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "extract":
+                answer = event["content"] + "\n\n"
+            elif event["type"] == "token":
+                answer += event["content"]
+            elif event["type"] == "done":
+                st.session_state.session_id = event.get("session_id")
+                st.session_state.last_turn = event.get("turn")
+            elif event["type"] == "error":
+                raise RuntimeError(event.get("error"))
+            placeholder.markdown(render_message(question, answer), unsafe_allow_html=True)
+    return answer.strip()
+
+def handle_user_input(backend_url, placeholder):
     with st.form(key='my_form', clear_on_submit=True):
         user_input = st.text_area("Your message:", key='input', height=70)
         submit_button = st.form_submit_button(label='Send')
 
     if submit_button and user_input:
-        with st.spinner("Getting response..."):
-            response = requests.post(f"{backend_url}/ask", json={"question": user_input})
-            if response.status_code == 200:
-                answer = response.json().get("response")
-                st.session_state.history.append({"question": user_input, "answer": answer})
-                st.experimental_rerun()  # Rerun to update the chat history
-            else:
-                st.error("Error: Unable to get response from the server.")
+        try:
+            with st.spinner("Getting response..."):
+                answer = stream_answer(backend_url, user_input, placeholder)
+        except (requests.RequestException, RuntimeError, ValueError) as e:
+            st.error(f"Error: Unable to get response from the server. {e}")
+            return
+        # The answer is already on screen; record it without rerunning the script
+        st.session_state.history.append({"question": user_input, "answer": answer, "turn": st.session_state.get("last_turn")})
+        st.session_state.history_html.append(render_message(user_input, answer))
+        # Keep the client-side history bounded; older turns stay available from the backend
+        if len(st.session_state.history) > MAX_CACHED_TURNS:
+            del st.session_state.history[:-MAX_CACHED_TURNS]
+            del st.session_state.history_html[:-MAX_CACHED_TURNS]
+
+def export_transcript(backend_url):
+    """Sidebar export of the transcript, fetched from the backend on demand."""
+    if not st.session_state.session_id:
+        return
+    if st.sidebar.button("Export Transcript"):
+        try:
+            response = get_http_session().get(
+                f"{backend_url}/sessions/{st.session_state.session_id}/export", timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            st.session_state.transcript = response.text
+            omitted = int(response.headers.get("X-Transcript-Omitted-Turns", 0))
+            if omitted:
+                st.sidebar.warning(f"The first {omitted} turns are no longer stored and are not in the transcript.")
+        except requests.RequestException as e:
+            st.sidebar.error(f"Error: Unable to export the transcript. {e}")
+    if st.session_state.get("transcript"):
+        st.sidebar.download_button("Download transcript", st.session_state.transcript,
+                                   file_name="transcript.md", mime="text/markdown")
 
 def clear_chat_history():
     if st.sidebar.button("Clear History"):
         st.session_state.history = []
+        st.session_state.history_html = []
+        st.session_state.session_id = None  # Start a new conversation on the backend
+        st.session_state.transcript = None
+        reset_history_view()
         st.experimental_rerun()  # Rerun to clear the chat history
@@ -0,0 +1,188 @@
+# chunking.py
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger(__name__)
+
+# Small retrieval units; the surrounding section is added back at prompt time
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+MAX_PARENT_CHARS = 4000
+
+# Clause headings ("6.1.2 Information security risk assessment"), Annex A controls
+# ("A.5.1 Policies for information security") and annex titles ("Annex A (normative) ...")
+HEADING_PATTERN = re.compile(
+    r"^(?P<number>Annex\s+[A-Z]|[A-Z]\.\d{1,2}(?:\.\d{1,2}){0,3}|\d{1,2}(?:\.\d{1,2}){0,3})\.?"
+    r"(?:\s+(?P<title>[A-Z(][^\n]{1,150}))?$"
+)
+LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-•*–—]|[a-z]\)|\(?[ivx]+\)|\d{1,2}[.)])\s+")
+TABLE_ROW_PATTERN = re.compile(r"\t|\||\S {2,}\S")
+
+_fallback_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=["\n\n", "\n", ". ", " ", ""]
+)
+
+
+def parse_heading(line: str) -> Optional[Tuple[str, str]]:
+    """Return (number, title) if the line is a clause, control or annex heading."""
+    line = line.strip()
+    if len(line) > 160:
+        return None
+    match = HEADING_PATTERN.match(line)
+    if not match:
+        return None
+    number = re.sub(r"\s+", " ", match.group("number"))
+    title = (match.group("title") or "").strip()
+    # Bare numbers are page numbers, not headings; annexes may have no title on the same line
+    if not title and not number.startswith("Annex"):
+        return None
+    # Sentences ending in a period are body text that happens to start with a number
+    if title.endswith(".") and len(title.split()) > 8:
+        return None
+    return number, title
+
+
+def heading_depth(number: str) -> int:
+    """Depth of a heading in the document tree; annex controls sit below their annex."""
+    if number.startswith("Annex"):
+        return 1
+    depth = number.count(".") + 1
+    if re.match(r"^[A-Z]\.", number):
+        depth += 1
+    return depth
+
+
+def _block_kind(line: str) -> str:
+    if LIST_ITEM_PATTERN.match(line):
+        return "list"
+    if TABLE_ROW_PATTERN.search(line.strip()):
+        return "table"
+    return "text"
+
+
+def split_blocks(text: str) -> List[str]:
+    """Split section text into paragraphs, keeping list and table runs together."""
+    blocks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        lines = [line for line in paragraph.split("\n") if line.strip()]
+        current, current_kind = [], None
+        for line in lines:
+            kind = _block_kind(line)
+            # List continuation lines and table rows stay in the block they belong to
+            if current and (kind == current_kind or (current_kind == "list" and kind == "text")):
+                current.append(line)
+                continue
+            if current:
+                blocks.append("\n".join(current))
+            current, current_kind = [line], kind
+        if current:
+            blocks.append("\n".join(current))
+    return blocks
+
+
+def pack_blocks(blocks: List[str], chunk_size: int = CHUNK_SIZE) -> List[str]:
+    """Greedily pack structural blocks into chunks of at most chunk_size characters."""
+    chunks, current = [], ""
+    for block in blocks:
+        if len(block) > chunk_size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(_fallback_splitter.split_text(block))
+            continue
+        candidate = f"{current}\n\n{block}" if current else block
+        if len(candidate) > chunk_size:
+            chunks.append(current)
+            current = block
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_sections(text: str) -> List[Dict]:
+    """Split document text into sections delimited by clause/annex headings."""
+    sections = []
+    stack: List[Tuple[int, str, str]] = []
+    current = {"number": "", "title": "", "path": "", "start": 0, "lines": []}
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        heading = parse_heading(line)
+        if heading:
+            # Headings directly followed by a subheading only contribute to the section path
+            if "".join(current["lines"][1 if current["number"] else 0:]).strip():
+                sections.append(current)
+            number, title = heading
+            depth = heading_depth(number)
+            stack = [entry for entry in stack if entry[0] < depth]
+            stack.append((depth, number, title))
+            current = {
+                "number": number,
+                "title": title,
+                "path": " > ".join(entry[1] for entry in stack),
+                "start": offset,
+                "lines": [line],
+            }
+        else:
+            current["lines"].append(line)
+        offset += len(line)
+    if "".join(current["lines"][1 if current["number"] else 0:]).strip():
+        sections.append(current)
+    for section in sections:
+        section["text"] = "".join(section.pop("lines"))
+    return sections
+
+
+def split_documents(documents: List[Document], chunk_size: int = CHUNK_SIZE) -> Tuple[List[Document], Dict[str, Document]]:
+    """Split documents into small section-aware chunks plus their parent sections."""
+    chunks: List[Document] = []
+    parents: Dict[str, Document] = {}
+    for document in documents:
+        for section in split_sections(document.page_content):
+            parent_id = f"p{len(parents)}"
+            metadata = dict(document.metadata)
+            metadata.update({
+                "parent_id": parent_id,
+                "section_path": section["path"],
+                "section_title": section["title"],
+            })
+            parents[parent_id] = Document(page_content=section["text"], metadata=dict(metadata, start_index=section["start"]))
+            search_from = 0
+            for text in pack_blocks(split_blocks(section["text"]), chunk_size):
+                position = section["text"].find(text[:50], search_from)
+                if position >= 0:
+                    search_from = position + 1
+                chunks.append(Document(
+                    page_content=text,
+                    metadata=dict(metadata, start_index=section["start"] + max(position, 0), parent_offset=max(position, 0)),
+                ))
+    logger.info(f"Split {len(documents)} documents into {len(chunks)} chunks across {len(parents)} sections")
+    return chunks, parents
+
+
+def expand_to_parents(documents: List[Document], parents: Dict[str, Document], max_chars: int = MAX_PARENT_CHARS) -> List[Document]:
+    """Replace retrieved chunks by their parent section, deduplicated and capped at max_chars."""
+    expanded, seen = [], set()
+    for document in documents:
+        parent_id = document.metadata.get("parent_id")
+        parent = parents.get(parent_id) if parent_id else None
+        if parent is None:
+            expanded.append(document)
+            continue
+        if parent_id in seen:
+            continue
+        seen.add(parent_id)
+        text = parent.page_content
+        if len(text) > max_chars:
+            # Keep a window around the matching chunk instead of the whole section
+            offset = document.metadata.get("parent_offset", 0)
+            start = max(0, min(offset - (max_chars - len(document.page_content)) // 2, len(text) - max_chars))
+            text = text[start:start + max_chars]
+        metadata = dict(document.metadata, section_path=parent.metadata.get("section_path", ""))
+        expanded.append(Document(page_content=text, metadata=metadata))
+    return expanded
+
@@ -0,0 +1,137 @@
+# circuit_breaker.py
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+from cachetools import TTLCache
+from langchain.schema import AIMessage
+
+from rate_limiter import RETRYABLE_ERRORS, RateLimitTimeout
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Failures that say something about the provider's health (bad requests do not)
+PROVIDER_ERRORS = RETRYABLE_ERRORS + (RateLimitTimeout, TimeoutError)
+
+
+class CircuitOpenError(Exception):
+    """The circuit is open and the call was not attempted."""
+
+
+class CircuitBreaker:
+    """Trip after too many failed or slow calls in a sliding window; probe again after a cool-down."""
+    def __init__(self, name: str, window_size: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 15.0, open_seconds: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self.window = deque(maxlen=window_size)
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.lock = threading.Lock()
+
+    def _transition(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit '{self.name}' {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self.half_open_calls = 0
+        elif state == CLOSED:
+            self.window.clear()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == OPEN:
+                return False
+            if self.state == HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    return False
+                self.half_open_calls += 1
+            return True
+
+    def record(self, ok: bool, duration: float):
+        # Slow successes count against the provider as well
+        failed = not ok or duration > self.slow_call_seconds
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self._transition(OPEN if failed else CLOSED)
+                return
+            self.window.append(failed)
+            if len(self.window) >= self.min_calls and sum(self.window) / len(self.window) >= self.failure_rate:
+                self._transition(OPEN)
+
+    def release_probe(self):
+        """Give back a half-open probe slot whose call said nothing about the provider; state and window are untouched."""
+        with self.lock:
+            if self.state == HALF_OPEN and self.half_open_calls > 0:
+                self.half_open_calls -= 1
+
+    def call(self, fn: Callable):
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit '{self.name}' is open")
+        start = time.monotonic()
+        try:
+            result = fn()
+        except PROVIDER_ERRORS:
+            self.record(False, time.monotonic() - start)
+            raise
+        except Exception:
+            # Caller errors (bad request, content filter) don't count; just release a half-open probe
+            self.release_probe()
+            raise
+        self.record(True, time.monotonic() - start)
+        return result
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\W+", " ", question).strip().lower()
+
+
+class FallbackRouter:
+    """Try each (name, call, breaker) route in order; serve a cached answer when all are down."""
+    def __init__(self, routes: List[Tuple[str, Callable, CircuitBreaker]], cache_size: int = 1000, cache_ttl: int = 3600):
+        self.routes = routes
+        self.answer_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.lock = threading.Lock()
+
+    def invoke(self, messages, cache_key: Optional[str] = None, skip: Tuple[str, ...] = (), **options):
+        """Return (response, route name); options (model, max_tokens) are passed to each route.
+
+        Routes named in `skip` (e.g. one the caller has just tried) are left out.
+        """
+        key = normalize_question(cache_key) if cache_key else None
+        last_error = None
+        for name, call, breaker in self.routes:
+            if name in skip:
+                continue
+            try:
+                response = breaker.call(lambda: call(messages, **options))
+            except CircuitOpenError as e:
+                last_error = e
+                continue
+            except PROVIDER_ERRORS as e:
+                logger.warning(f"Route '{name}' failed, trying next: {e}")
+                last_error = e
+                continue
+            if key is not None and getattr(response, "content", None):
+                with self.lock:
+                    self.answer_cache[key] = response.content
+            return response, name
+        with self.lock:
+            cached = self.answer_cache.get(key) if key is not None else None
+        if cached is not None:
+            logger.warning("All model routes unavailable; serving cached answer")
+            return AIMessage(content=cached), "cache"
+        raise last_error or CircuitOpenError("No model route available")
@@ -0,0 +1,156 @@
+# clause_index.py
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+from typing import Dict, List, Optional
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+# File layout: header, open-addressing slot table, then JSON records.
+# Each slot is (key hash, record offset, record length); a zero hash marks an empty slot.
+MAGIC = b"CIX1"
+HEADER = struct.Struct("<4sII")  # magic, slot count, record count
+SLOT = struct.Struct("<QII")
+
+
+def _hash(key: str) -> int:
+    # Never zero, so zero can mark empty slots
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+def normalize_title(title: str) -> str:
+    return re.sub(r"\W+", " ", title).strip().lower()
+
+
+def number_key(number: str) -> str:
+    return f"n:{number.strip().strip('.').upper()}"
+
+
+def title_key(title: str) -> str:
+    return f"t:{normalize_title(title)}"
+
+
+def build_records(parents: Dict[str, Document], chunks: List[Document], chunk_ids: List[str]) -> List[Dict]:
+    """One record per clause/control: offsets, parent section and the ids of its chunks."""
+    ids_by_parent: Dict[str, List[str]] = {}
+    for chunk, chunk_id in zip(chunks, chunk_ids):
+        ids_by_parent.setdefault(chunk.metadata.get("parent_id"), []).append(chunk_id)
+    return build_records_by_parent(parents, ids_by_parent)
+
+
+def build_records_by_parent(parents: Dict[str, Document], ids_by_parent: Dict[str, List[str]]) -> List[Dict]:
+    """Same records from the chunk ids already grouped per parent section."""
+    records: Dict[str, Dict] = {}
+    for parent_id, parent in parents.items():
+        section_path = parent.metadata.get("section_path") or ""
+        if not section_path:
+            continue
+        number = section_path.split(" > ")[-1]
+        start = parent.metadata.get("start_index", 0)
+        record = {
+            "number": number,
+            "title": parent.metadata.get("section_title", ""),
+            "section_path": section_path,
+            "start": start,
+            "end": start + len(parent.page_content),
+            "parent_id": parent_id,
+            "chunk_ids": ids_by_parent.get(parent_id, []),
+        }
+        # A clause can appear twice (e.g. table of contents); keep the longest occurrence
+        existing = records.get(number)
+        if existing is None or record["end"] - record["start"] > existing["end"] - existing["start"]:
+            records[number] = record
+    return list(records.values())
+
+
+def write_clause_index(records: List[Dict], path: str):
+    """Write records under their number and title keys; the file is replaced atomically."""
+    entries = []
+    for record in records:
+        entries.append((number_key(record["number"]), record))
+        if record.get("title"):
+            entries.append((title_key(record["title"]), record))
+
+    # Load factor <= 0.5 keeps probe sequences short
+    slot_count = max(8, 2 * len(entries))
+    slots = [(0, 0, 0)] * slot_count
+    data = bytearray()
+    data_start = HEADER.size + slot_count * SLOT.size
+    for key, record in entries:
+        key_hash = _hash(key)
+        index = key_hash % slot_count
+        while slots[index][0] != 0:
+            if slots[index][0] == key_hash:
+                break  # duplicate title; first one wins
+            index = (index + 1) % slot_count
+        if slots[index][0] == key_hash:
+            continue
+        record_bytes = json.dumps({"key": key, "record": record}, separators=(",", ":")).encode("utf-8")
+        slots[index] = (key_hash, data_start + len(data), len(record_bytes))
+        data.extend(record_bytes)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, slot_count, len(records)))
+        for slot in slots:
+            file.write(SLOT.pack(*slot))
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote clause index with {len(records)} clauses to {path}")
+
+
+class ClauseIndex:
+    """Read-only, memory-mapped clause/control lookup table with O(1) lookups."""
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slot_count, self.record_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a clause index")
+
+    def _get(self, key: str) -> Optional[Dict]:
+        key_hash = _hash(key)
+        index = key_hash % self.slot_count
+        for _ in range(self.slot_count):
+            slot_hash, offset, length = SLOT.unpack_from(self.map, HEADER.size + index * SLOT.size)
+            if slot_hash == 0:
+                return None
+            if slot_hash == key_hash:
+                entry = json.loads(self.map[offset:offset + length])
+                if entry["key"] == key:
+                    return entry["record"]
+            index = (index + 1) % self.slot_count
+        return None
+
+    def lookup(self, number: str) -> Optional[Dict]:
+        """Record for a clause or control number such as "6.1.2" or "A.5.1"."""
+        return self._get(number_key(number))
+
+    def lookup_title(self, title: str) -> Optional[Dict]:
+        """Record for an exact heading title, ignoring case and punctuation."""
+        return self._get(title_key(title))
+
+    def close(self):
+        self.map.close()
+
+
+def load_clause_index(path: str) -> Optional[ClauseIndex]:
+    """Open the clause index if it has been built, else None."""
+    if not os.path.exists(path):
+        logger.info(f"No clause index at {path}; direct clause lookups disabled")
+        return None
+    try:
+        index = ClauseIndex(path)
+        logger.info(f"Loaded clause index with {index.record_count} clauses from {path}")
+        return index
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to load clause index: {e}")
+        return None
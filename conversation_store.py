@@ -0,0 +1,204 @@
+# conversation_store.py
+import atexit
+import copy
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def new_state(questions: List[str]) -> Dict:
+    return {"questions": list(questions), "answers": {}, "current_question_index": 0, "chat_history": []}
+
+
+def apply_event(state: Dict, kind: str, payload: Dict):
+    """Fold one logged event into a conversation state."""
+    if kind == "answer":
+        state["answers"][payload["question"]] = payload["answer"]
+    elif kind == "index":
+        state["current_question_index"] = payload["current_question_index"]
+    elif kind == "message":
+        state["chat_history"].append({"role": payload["role"], "content": payload["content"]})
+    elif kind == "questions":
+        state["questions"] = payload["questions"]
+    elif kind == "reset":
+        state.update(new_state(state["questions"]))
+
+
+def diff_events(old: Dict, new: Dict) -> List[tuple]:
+    """Events that turn state `old` into state `new`; history is only ever appended to."""
+    events = []
+    if new.get("questions") != old.get("questions"):
+        events.append(("questions", {"questions": new.get("questions", [])}))
+    old_history, new_history = old.get("chat_history", []), new.get("chat_history", [])
+    if new_history[:len(old_history)] != old_history or set(old.get("answers", {})) - set(new.get("answers", {})):
+        # History was rewritten or answers removed: start over from a reset marker
+        events.append(("reset", {}))
+        old_history, old_answers, old_index = [], {}, 0
+    else:
+        old_answers, old_index = old.get("answers", {}), old.get("current_question_index", 0)
+    for question, answer in new.get("answers", {}).items():
+        if old_answers.get(question) != answer:
+            events.append(("answer", {"question": question, "answer": answer}))
+    if new.get("current_question_index", 0) != old_index:
+        events.append(("index", {"current_question_index": new.get("current_question_index", 0)}))
+    for message in new_history[len(old_history):]:
+        events.append(("message", {"role": message["role"], "content": message["content"]}))
+    return events
+
+
+class ConversationStore:
+    """Per-session interview state as an append-only event log in sqlite (WAL, fsync on commit).
+
+    Reads are served from an in-memory cache; writes are buffered and committed in batches,
+    at most `flush_interval` seconds after they were made, and on exit.
+    """
+    def __init__(self, path: str = "conversation_state.db", cache_size: int = 1000,
+                 flush_interval: float = 1.0, max_pending: int = 256):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.cache = LRUCache(maxsize=cache_size)
+        self.pending: List[tuple] = []
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # FULL makes every commit durable (fsync), not just crash-consistent
+            self.conn.execute("PRAGMA synchronous=FULL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS events (session_id TEXT NOT NULL, seq INTEGER NOT NULL, kind TEXT NOT NULL, "
+                "payload TEXT NOT NULL, ts REAL NOT NULL, PRIMARY KEY (session_id, seq))"
+            )
+        # Bounded like the state cache; an evicted session's next number is looked up again
+        self.next_seq = LRUCache(maxsize=cache_size)
+        self.stop = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_loop, name="conversation-store-flush", daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def _last_seq(self, session_id: str) -> int:
+        if session_id not in self.next_seq:
+            row = self.conn.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM events WHERE session_id = ?", (session_id,)).fetchone()
+            # Buffered events are not in the table yet
+            buffered = [seq + 1 for pending_session, seq, _, _, _ in self.pending if pending_session == session_id]
+            self.next_seq[session_id] = max([row[0]] + buffered)
+        return self.next_seq[session_id]
+
+    def load(self, session_id: str, questions: List[str]) -> Dict:
+        """Return a copy of the session's state, replaying its event log on a cache miss."""
+        with self.lock:
+            state = self.cache.get(session_id)
+            if state is None:
+                state = new_state(questions)
+                rows = self.conn.execute("SELECT kind, payload FROM events WHERE session_id = ? ORDER BY seq", (session_id,))
+                for kind, payload in rows:
+                    apply_event(state, kind, json.loads(payload))
+                for pending_session, _, kind, payload, _ in self.pending:
+                    if pending_session == session_id:
+                        apply_event(state, kind, json.loads(payload))
+                self.cache[session_id] = state
+            return copy.deepcopy(state)
+
+    def save(self, session_id: str, state: Dict):
+        """Record the changes between the cached state and `state` as new events."""
+        with self.lock:
+            cached = self.cache.get(session_id)
+            if cached is None:
+                cached = self.load(session_id, state.get("questions", []))
+            events = diff_events(cached, state)
+            if not events:
+                return
+            self.cache[session_id] = copy.deepcopy(state)
+            self._append(session_id, events)
+
+    def append_message(self, session_id: str, role: str, content: str, questions: List[str]):
+        """Append one chat message as a single event, without copying or diffing the whole state."""
+        with self.lock:
+            if session_id not in self.cache:
+                self.load(session_id, questions)
+            message = {"role": role, "content": content}
+            self.cache[session_id]["chat_history"].append(dict(message))
+            self._append(session_id, [("message", message)])
+
+    def _append(self, session_id: str, events: List[tuple]):
+        now = time.time()
+        seq = self._last_seq(session_id)
+        for kind, payload in events:
+            self.pending.append((session_id, seq, kind, json.dumps(payload), now))
+            seq += 1
+        self.next_seq[session_id] = seq
+        if len(self.pending) >= self.max_pending:
+            self.flush()
+
+    def delete(self, session_id: str):
+        with self.lock:
+            self.flush()
+            with self.conn:
+                self.conn.execute("DELETE FROM events WHERE session_id = ?", (session_id,))
+            self.cache.pop(session_id, None)
+            self.next_seq.pop(session_id, None)
+
+    def _insert(self, events: List[tuple]):
+        with self.conn:
+            self.conn.executemany("INSERT INTO events (session_id, seq, kind, payload, ts) VALUES (?, ?, ?, ?, ?)", events)
+
+    def _renumber(self, session_id: str, events: List[tuple]) -> List[tuple]:
+        """Move events after those another writer (process) logged for the same session."""
+        self.next_seq.pop(session_id, None)
+        seq = self._last_seq(session_id)
+        events = [(session_id, seq + offset, kind, payload, ts) for offset, (_, _, kind, payload, ts) in enumerate(events)]
+        self.next_seq[session_id] = seq + len(events)
+        # The cached state lacks the other writer's events; replay the log on next load
+        self.cache.pop(session_id, None)
+        return events
+
+    def flush(self):
+        """Commit buffered events, one transaction per session so a conflict in one cannot hold up the rest."""
+        with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, []
+            sessions: Dict[str, List[tuple]] = {}
+            for event in pending:
+                sessions.setdefault(event[0], []).append(event)
+            failed = []
+            for session_id, events in sessions.items():
+                try:
+                    try:
+                        self._insert(events)
+                    except sqlite3.IntegrityError:
+                        logger.warning(f"Session {session_id} was written concurrently; appending after the other writer")
+                        events = self._renumber(session_id, events)
+                        self._insert(events)
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to save conversation state of session {session_id}: {e}")
+                    failed.extend(events)
+            self.pending = failed + self.pending
+
+    def _flush_loop(self):
+        while not self.stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        if self.stop.is_set():
+            return
+        self.stop.set()
+        self.flush()
+        self.conn.close()
+
+
+_stores: Dict[str, ConversationStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_conversation_store(path: str = "conversation_state.db") -> ConversationStore:
+    """One store per database file per process."""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ConversationStore(path)
+        return _stores[path]
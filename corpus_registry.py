@@ -0,0 +1,328 @@
+# corpus_registry.py
+import glob
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from azure.core.exceptions import ResourceNotFoundError
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.indexes.models import SearchIndex, SimpleField, SearchFieldDataType, SearchableField
+from cachetools import LRUCache
+from langchain.schema import Document
+
+from azure_retriever import AzureSearchRetriever
+from clause_index import load_clause_index
+from initialization import ingest_documents, load_parents, clear_document_records, corpus_data_path, documents_dir, DEFAULT_CORPUS
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownCorpusError(KeyError):
+    """The requested corpus is not in the registry."""
+
+
+class CorpusUnavailableError(RuntimeError):
+    """The corpus is managed elsewhere (blue/green versions) and no version is being served yet."""
+
+
+def create_index_schema(index_name: str) -> SearchIndex:
+    """Index schema with searchable fields and vector field properties."""
+    return SearchIndex(
+        name=index_name,
+        fields=[
+            SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+            SearchableField(name="content", type=SearchFieldDataType.String, searchable=True),
+            SimpleField(name="embedding", type=SearchFieldDataType.String),
+            SimpleField(name="parent_id", type=SearchFieldDataType.String),
+            SimpleField(name="section_path", type=SearchFieldDataType.String),
+            # Document key and content hash of the chunk's source version
+            SimpleField(name="version", type=SearchFieldDataType.String, filterable=True),
+            # Ingestion metadata for filters applied before scoring, and facet counts
+            SimpleField(name="document", type=SearchFieldDataType.String, filterable=True, facetable=True),
+            SimpleField(name="page", type=SearchFieldDataType.Int32, filterable=True, facetable=True, sortable=True),
+            SimpleField(name="section", type=SearchFieldDataType.String, filterable=True, facetable=True),
+            SimpleField(name="language", type=SearchFieldDataType.String, filterable=True, facetable=True),
+            SimpleField(name="date", type=SearchFieldDataType.DateTimeOffset, filterable=True, facetable=True, sortable=True),
+        ]
+    )
+
+
+@dataclass
+class CorpusConfig:
+    name: str
+    index_name: str
+    # Ingestion manifest: PDF paths or glob patterns
+    documents: List[str] = field(default_factory=list)
+    clause_index_path: str = ""
+    parents_path: str = ""
+    # Retriever settings; top_k overrides the model router's per-class value
+    top_k: Optional[int] = None
+    rerank: bool = True
+    description: str = ""
+
+    def __post_init__(self):
+        self.clause_index_path = self.clause_index_path or corpus_data_path(self.name, "clause_index.bin")
+        self.parents_path = self.parents_path or corpus_data_path(self.name, "parents.json")
+
+    @property
+    def documents_dir(self) -> str:
+        return documents_dir(self.parents_path)
+
+    @classmethod
+    def from_dict(cls, name: str, data: Dict) -> "CorpusConfig":
+        if not data.get("index_name"):
+            raise ValueError(f"Corpus {name} has no index_name")
+        known = {key: data[key] for key in ("documents", "clause_index_path", "parents_path", "top_k", "rerank", "description") if key in data}
+        return cls(name=name, index_name=data["index_name"], **known)
+
+    def manifest_paths(self) -> List[str]:
+        """The manifest's files, with glob patterns expanded."""
+        paths = []
+        for entry in self.documents:
+            matches = sorted(glob.glob(entry)) if glob.has_magic(entry) else [entry]
+            paths.extend(path for path in matches if path not in paths)
+        return paths
+
+
+def load_corpus_configs(path: str, default: Optional[CorpusConfig] = None) -> Dict[str, CorpusConfig]:
+    """Corpora from a JSON file mapping names to settings; `default` is used unless the file overrides it."""
+    configs = {default.name: default} if default else {}
+    if not path or not os.path.exists(path):
+        logger.info(f"No corpus registry at {path}; serving the default corpus only")
+        return configs
+    with open(path, encoding="utf-8") as file:
+        entries = json.load(file)
+    for name, data in entries.items():
+        configs[name] = CorpusConfig.from_dict(name, data)
+    logger.info(f"Loaded {len(entries)} corpora from {path}")
+    return configs
+
+
+def published_scope(parents: Dict[str, Document]) -> Optional[str]:
+    """Filter limiting search to the document versions whose parent sections are published.
+
+    Chunks of a version still uploading, or of one replaced but not yet deleted, stay out of results.
+    Parent ids are "<document key>-<hash>-p<n>"; ids without a version (older indexes) leave search unscoped.
+    """
+    versions = {parent_id.rsplit("-", 1)[0] for parent_id in parents if "-" in parent_id}
+    if not versions:
+        return None
+    return f"search.in(version, '{','.join(sorted(versions))}', ',')"
+
+
+class Corpus:
+    """A loaded corpus: its pooled search client, clause index and parent sections.
+
+    Requests hold a corpus between `CorpusRegistry.acquire` and `release`; one evicted while in use
+    is closed when its last request releases it.
+    """
+    def __init__(self, config: CorpusConfig, search_client: SearchClient, clause_index=None,
+                 parents: Optional[Dict[str, Document]] = None, partial: bool = False, shared_records=None):
+        self.config = config
+        self.search_client = search_client
+        self.clause_index = clause_index
+        self.parents = parents if parents is not None else {}
+        # Served without its ingestion data: the published parents do not describe the whole index
+        self.partial = partial
+        # index_versions.SharedRecords when other replicas serve the same index and follow its document changes
+        self.shared_records = shared_records
+        self.scope = None if partial else published_scope(self.parents)
+        self.users = 0
+        self.retired = False
+        self.lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def retriever(self) -> AzureSearchRetriever:
+        return AzureSearchRetriever(search_client=self.search_client, clause_index=self.clause_index, scope=self.scope)
+
+    def reload(self):
+        """Pick up the parent sections and clause index republished after an ingestion.
+
+        The previous clause index is left to the garbage collector, as requests may still be reading it.
+        """
+        parents = load_parents(self.config.parents_path)
+        self.scope = None if self.partial else published_scope(parents)
+        self.parents = parents
+        self.clause_index = load_clause_index(self.config.clause_index_path)
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            idle = self.retired and self.users == 0
+        if idle:
+            self.close()
+
+    def retire(self):
+        with self.lock:
+            self.retired = True
+            idle = self.users == 0
+        if idle:
+            self.close()
+
+    def close(self):
+        logger.info(f"Closing corpus {self.name}")
+        self.search_client.close()
+        if self.clause_index:
+            self.clause_index.close()
+
+
+class _CorpusCache(LRUCache):
+    def popitem(self):
+        name, corpus = super().popitem()
+        logger.info(f"Evicting least recently used corpus {name}")
+        corpus.retire()
+        return name, corpus
+
+
+class CorpusRegistry:
+    """Named corpora, loaded on first use and evicted least recently used beyond `max_loaded`.
+
+    All search clients share one credential; pinned corpora (the default one) are never evicted.
+    A corpus whose index does not exist yet is created when first loaded, and its manifest queued on the
+    ingestion workers; requests get CorpusUnavailableError until those jobs have run.
+    """
+    def __init__(self, configs: Dict[str, CorpusConfig], endpoint: str, credential, index_client: SearchIndexClient,
+                 max_loaded: int = 4, pytesseract_available: bool = False, embedder=None):
+        self.configs = dict(configs)
+        self.endpoint = endpoint
+        self.credential = credential
+        self.index_client = index_client
+        self.pytesseract_available = pytesseract_available
+        self.embedder = embedder
+        self.pinned: Dict[str, Corpus] = {}
+        self.loaded = _CorpusCache(maxsize=max_loaded)
+        self.lock = threading.Lock()
+        # One lock per corpus so a slow cold load does not block requests to other corpora
+        self.load_locks: Dict[str, threading.Lock] = {}
+        # Changes to a corpus's document records and their republishing are serialized per corpus
+        self.publish_locks: Dict[str, threading.Lock] = {}
+        # Corpora that are only served once pinned, never loaded on demand
+        self.managed = set()
+        # ingestion_jobs.IngestionWorkers that fill new indexes; without them the manifest is ingested in the request
+        self.workers = None
+        # Ingestion jobs of each corpus whose index is being filled from its manifest
+        self.preparing: Dict[str, List[str]] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.configs
+
+    def manage(self, name: str):
+        """Serve `name` only once pinned, e.g. by an IndexVersionManager."""
+        with self.lock:
+            self.managed.add(name)
+
+    def pin(self, corpus: Corpus):
+        """Register an already loaded corpus that stays in memory, replacing the one pinned under its name."""
+        with self.lock:
+            previous = self.pinned.get(corpus.name)
+            self.configs[corpus.name] = corpus.config
+            self.pinned[corpus.name] = corpus
+        if previous is not None and previous is not corpus:
+            # Closed once the requests still using it are done
+            previous.retire()
+
+    def publish_lock(self, name: str) -> threading.Lock:
+        with self.lock:
+            return self.publish_locks.setdefault(name, threading.Lock())
+
+    def reload(self, name: str):
+        """Refresh the corpus if it is in memory; a cold one reads the new files when it is next loaded."""
+        with self.lock:
+            corpus = self.pinned.get(name) or self.loaded.get(name)
+        if corpus is not None:
+            corpus.reload()
+
+    def describe(self) -> List[Dict]:
+        with self.lock:
+            in_memory = set(self.pinned) | set(self.loaded.keys())
+        return [{"name": name, "index_name": config.index_name, "description": config.description, "loaded": name in in_memory}
+                for name, config in self.configs.items()]
+
+    def _lookup(self, name: str) -> Optional[Corpus]:
+        """The loaded corpus, marked in use, or None."""
+        with self.lock:
+            corpus = self.pinned.get(name) or self.loaded.get(name)
+            if corpus is not None:
+                with corpus.lock:
+                    corpus.users += 1
+            return corpus
+
+    def acquire(self, name: Optional[str] = None, for_ingestion: bool = False) -> Corpus:
+        """The named corpus, loading it if needed; call `release()` on it when the request is done.
+
+        Ingestion workers pass `for_ingestion` to get a corpus whose index is still being filled.
+        """
+        name = name or DEFAULT_CORPUS
+        config = self.configs.get(name)
+        if config is None:
+            raise UnknownCorpusError(name)
+        corpus = self._lookup(name)
+        if corpus is None:
+            if name in self.managed:
+                raise CorpusUnavailableError(name)
+            with self.lock:
+                load_lock = self.load_locks.setdefault(name, threading.Lock())
+            with load_lock:
+                corpus = self._lookup(name)
+                if corpus is None:
+                    corpus = self._load(config)
+                    with self.lock:
+                        corpus.users += 1
+                        self.loaded[name] = corpus
+        if not for_ingestion and self._preparing(name):
+            corpus.release()
+            raise CorpusUnavailableError(name)
+        return corpus
+
+    def _preparing(self, name: str) -> bool:
+        with self.lock:
+            job_ids = self.preparing.get(name)
+        if not job_ids:
+            return False
+        if self.workers.pending(job_ids):
+            return True
+        with self.lock:
+            self.preparing.pop(name, None)
+        logger.info(f"Corpus {name} is ready")
+        return False
+
+    @contextmanager
+    def using(self, name: Optional[str] = None, for_ingestion: bool = False):
+        corpus = self.acquire(name, for_ingestion)
+        try:
+            yield corpus
+        finally:
+            corpus.release()
+
+    def _load(self, config: CorpusConfig) -> Corpus:
+        logger.info(f"Loading corpus {config.name} (index {config.index_name})")
+        search_client = SearchClient(endpoint=self.endpoint, index_name=config.index_name, credential=self.credential)
+        parents = None
+        try:
+            self.index_client.get_index(config.index_name)
+        except ResourceNotFoundError:
+            logger.info(f"Index {config.index_name} does not exist; creating it")
+            self.index_client.create_index(create_index_schema(config.index_name))
+        if search_client.get_document_count() == 0 and config.documents and config.name not in self.preparing:
+            if self.workers is not None:
+                # OCR can take minutes: fill the index in the background instead of the request thread
+                logger.info(f"Index {config.index_name} is empty; queueing the manifest of corpus {config.name}")
+                clear_document_records(config.documents_dir)
+                jobs = [self.workers.enqueue(config.name, os.path.abspath(path)) for path in config.manifest_paths()]
+                with self.lock:
+                    self.preparing[config.name] = [job["id"] for job in jobs]
+            else:
+                logger.info(f"Index {config.index_name} is empty; ingesting the manifest of corpus {config.name}")
+                parents = {}
+                ingest_documents(config.manifest_paths(), search_client, self.pytesseract_available, parents,
+                                 config.clause_index_path, config.parents_path, self.embedder)
+        if parents is None:
+            parents = load_parents(config.parents_path)
+        return Corpus(config, search_client, load_clause_index(config.clause_index_path), parents)
@@ -0,0 +1,75 @@
+# document_metadata.py
+import bisect
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from langchain.schema import Document
+from langchain_community.document_loaders import UnstructuredPDFLoader
+
+logger = logging.getLogger(__name__)
+
+# Check if langdetect is available
+try:
+    from langdetect import detect, LangDetectException
+    langdetect_available = True
+except ImportError:
+    langdetect_available = False
+
+PAGE_SEPARATOR = "\n\n"
+
+# Function words of the languages we ingest, for when langdetect is not installed
+STOPWORDS = {
+    "en": {"the", "and", "of", "to", "is", "in", "that", "for", "with", "shall", "be", "are", "this", "by"},
+    "nl": {"de", "het", "een", "en", "van", "is", "dat", "voor", "met", "op", "zijn", "niet", "wordt", "moet"},
+}
+
+
+def detect_language(text: str) -> Optional[str]:
+    """ISO 639-1 code of the text's language, or None when it cannot be told."""
+    sample = text[:5000]
+    if not sample.strip():
+        return None
+    if langdetect_available:
+        try:
+            return detect(sample)
+        except LangDetectException:
+            return None
+    words = re.findall(r"\w+", sample.lower())
+    counts = {language: sum(word in stopwords for word in words) for language, stopwords in STOPWORDS.items()}
+    language, count = max(counts.items(), key=lambda item: item[1])
+    return language if count else None
+
+
+def load_pdf_document(path: str, strategy: str) -> Tuple[Document, List[int]]:
+    """The PDF as one document (so sections can cross pages) plus the text offset where each page starts."""
+    pages = UnstructuredPDFLoader(file_path=path, strategy=strategy, mode="paged").load()
+    texts, page_starts, offset = [], [], 0
+    for page in pages:
+        page_starts.append(offset)
+        texts.append(page.page_content)
+        offset += len(page.page_content) + len(PAGE_SEPARATOR)
+    text = PAGE_SEPARATOR.join(texts)
+    metadata = {
+        "source": path,
+        "document": os.path.basename(path),
+        "language": detect_language(text),
+        "date": datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc).isoformat(),
+    }
+    return Document(page_content=text, metadata=metadata), page_starts
+
+
+def chunk_metadata(chunk: Document, page_starts: Dict[str, List[int]]) -> Dict:
+    """Filterable fields of a chunk: document, page (1-based), top-level section, language and date."""
+    metadata = chunk.metadata
+    starts = page_starts.get(metadata.get("source"))
+    page = bisect.bisect_right(starts, metadata.get("start_index", 0)) if starts else None
+    section_path = metadata.get("section_path") or ""
+    return {
+        "document": metadata.get("document"),
+        "page": page,
+        "section": section_path.split(" > ")[0] or None,
+        "language": metadata.get("language"),
+        "date": metadata.get("date"),
+    }
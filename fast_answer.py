@@ -0,0 +1,72 @@
+# fast_answer.py
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+# "clause 6.1.2", "clause 6.1", "6.1.2", "A.5.1", "control A.8.24", "clause 9"; without a keyword a
+# numbered clause needs three levels, so decimals such as "gpt 3.5" are not taken for clauses
+IDENTIFIER_PATTERN = re.compile(
+    r"\b(?:clause|control|artikel|maatregel|paragraaf)\s+([A-Z]?\.?\d{1,2}(?:\.\d{1,2}){0,3})\b"
+    r"|\b([A-Z]\.\d{1,2}(?:\.\d{1,2}){0,3}|\d{1,2}(?:\.\d{1,2}){2,3})\b",
+    re.IGNORECASE,
+)
+
+MAX_EXTRACT_CHARS = 3000
+
+
+@dataclass
+class FastAnswer:
+    text: str
+    identifier: str
+    citations: List[Dict] = field(default_factory=list)
+
+
+def extract_identifiers(question: str) -> List[str]:
+    """Clause and control identifiers mentioned in the question, normalized ("a.5.1" -> "A.5.1")."""
+    identifiers = []
+    for match in IDENTIFIER_PATTERN.finditer(question):
+        identifier = (match.group(1) or match.group(2)).strip(".").upper()
+        if identifier not in identifiers:
+            identifiers.append(identifier)
+    return identifiers
+
+
+def section_number(document: Document) -> str:
+    section_path = document.metadata.get("section_path") or ""
+    return section_path.split(" > ")[-1].strip().upper()
+
+
+def find_extract(question: str, documents: List[Document], parents: Dict[str, Document],
+                 max_chars: int = MAX_EXTRACT_CHARS) -> Optional[FastAnswer]:
+    """Return the clause text when exactly one referenced clause is found among the retrieved chunks."""
+    identifiers = extract_identifiers(question)
+    # Several references usually mean a comparison; leave those to the LLM
+    if len(identifiers) != 1:
+        return None
+    identifier = identifiers[0]
+    matches = [doc for doc in documents if section_number(doc) == identifier]
+    if not matches:
+        return None
+
+    parent_id = matches[0].metadata.get("parent_id")
+    parent = parents.get(parent_id) if parent_id else None
+    if parent is not None and len(parent.page_content) <= max_chars:
+        text = parent.page_content.strip()
+    else:
+        # Without the parent section, stitch the matching chunks together in document order
+        matches = sorted(matches, key=lambda doc: doc.metadata.get("start_index") or 0)
+        text = "\n\n".join(doc.page_content.strip() for doc in matches)[:max_chars]
+
+    metadata = parent.metadata if parent is not None else matches[0].metadata
+    citations = [{
+        "section": identifier,
+        "section_path": metadata.get("section_path"),
+        "title": metadata.get("section_title"),
+        "chunk_ids": [doc.metadata.get("id") for doc in matches],
+    }]
+    logger.info(f"Fast path answered clause {identifier} from {len(matches)} chunks")
+    return FastAnswer(text=text, identifier=identifier, citations=citations)
@@ -0,0 +1,155 @@
+# folder_watcher.py
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from initialization import document_key, file_hash, load_document_records
+from ingestion_jobs import IngestionWorkers, INGEST, DELETE
+from corpus_registry import CorpusConfig
+
+logger = logging.getLogger(__name__)
+
+# Check if watchdog (inotify on Linux) is available
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    watchdog_available = True
+except ImportError:
+    watchdog_available = False
+
+
+def is_pdf(path: str) -> bool:
+    return path.lower().endswith(".pdf")
+
+
+class FolderWatcher:
+    """Keep a corpus in sync with the PDFs in one folder (not its subfolders).
+
+    Changes are noticed through inotify when watchdog is installed, else by polling, and acted on once
+    a file has been quiet for `debounce` seconds: new or changed files are queued for ingestion, files
+    whose content hash matches the indexed version are skipped, and deleted files are queued for removal.
+    The ingestion workers swap each document version in atomically. After the corpus switches to another
+    index version, `resync` compares the folder against that version's records.
+    """
+    def __init__(self, folder: str, corpus: CorpusConfig, workers: IngestionWorkers, debounce: float = 5.0,
+                 poll_interval: float = 10.0, use_inotify: bool = True):
+        self.folder = os.path.abspath(folder)
+        self.corpus = corpus
+        self.workers = workers
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and watchdog_available
+        self.pending: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.observer = None
+        self.snapshot: Dict[str, Tuple[float, int]] = {}
+        self.running = False
+
+    def resync(self, corpus: Optional[CorpusConfig] = None):
+        """Queue every file that differs from the indexed records, e.g. after the corpus moved to another index."""
+        self.corpus = corpus or self.corpus
+        indexed = {os.path.abspath(record["path"]) for record in self._records().values()}
+        self.snapshot = self._scan()
+        for path in set(self.snapshot) | indexed:
+            self.notify(path, at=0.0)
+
+    def start(self):
+        # Catch up on changes made while nothing was watching
+        self.resync()
+        if self.use_inotify:
+            try:
+                self.observer = Observer()
+                self.observer.schedule(_Handler(self), self.folder, recursive=False)
+                self.observer.start()
+            except OSError as e:
+                # e.g. the inotify watch limit is reached, or the folder is on a network share
+                logger.warning(f"inotify unavailable for {self.folder}, polling instead: {e}")
+                self.observer = None
+        mode = "inotify" if self.observer else f"polling every {self.poll_interval:.0f}s"
+        threading.Thread(target=self._loop, name="folder-watcher", daemon=True).start()
+        self.running = True
+        logger.info(f"Watching {self.folder} for corpus {self.corpus.name} ({mode}, debounce {self.debounce:.0f}s)")
+
+    def notify(self, path: str, at: Optional[float] = None):
+        path = os.path.abspath(path)
+        if os.path.dirname(path) != self.folder or not is_pdf(path):
+            return
+        with self.lock:
+            self.pending[path] = time.monotonic() if at is None else at
+
+    def _scan(self) -> Dict[str, Tuple[float, int]]:
+        snapshot = {}
+        try:
+            entries = list(os.scandir(self.folder))
+        except OSError as e:
+            logger.error(f"Cannot list {self.folder}: {e}")
+            return self.snapshot
+        for entry in entries:
+            if entry.is_file() and is_pdf(entry.name):
+                stat = entry.stat()
+                snapshot[os.path.abspath(entry.path)] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def _poll(self):
+        snapshot = self._scan()
+        for path in set(snapshot) | set(self.snapshot):
+            if snapshot.get(path) != self.snapshot.get(path):
+                self.notify(path)
+        self.snapshot = snapshot
+
+    def _records(self) -> Dict[str, Dict]:
+        return {record["key"]: record for record in load_document_records(self.corpus.documents_dir)}
+
+    def _loop(self):
+        last_poll = time.monotonic()
+        while True:
+            time.sleep(1.0)
+            if self.observer is None and time.monotonic() - last_poll >= self.poll_interval:
+                self._poll()
+                last_poll = time.monotonic()
+            now = time.monotonic()
+            with self.lock:
+                due = [path for path, changed in self.pending.items() if now - changed >= self.debounce]
+                for path in due:
+                    del self.pending[path]
+            if due:
+                try:
+                    self._sync(due)
+                except Exception as e:
+                    logger.error(f"Folder sync of {len(due)} files failed: {e}")
+
+    def _sync(self, paths):
+        records = self._records()
+        for path in paths:
+            record = records.get(document_key(path))
+            if not os.path.exists(path):
+                if record is not None and not self.workers.store.is_queued(self.corpus.name, path, DELETE):
+                    self.workers.enqueue(self.corpus.name, path, DELETE)
+                continue
+            try:
+                content_hash = file_hash(path)
+            except OSError as e:
+                # Still being written or moved away; the next event brings it back
+                logger.warning(f"Cannot read {path}: {e}")
+                continue
+            # Queued jobs read the file when they start, so one is enough
+            if (record is not None and record["hash"] == content_hash) or self.workers.store.is_queued(self.corpus.name, path, INGEST):
+                continue
+            self.workers.enqueue(self.corpus.name, path, INGEST)
+
+
+if watchdog_available:
+    class _Handler(FileSystemEventHandler):
+        def __init__(self, watcher: FolderWatcher):
+            self.watcher = watcher
+
+        def on_any_event(self, event):
+            # Opened/closed events come from our own reads as well; they never change content
+            if event.is_directory or event.event_type not in ("created", "modified", "deleted", "moved"):
+                return
+            self.watcher.notify(event.src_path)
+            # Moves and renames also change the destination
+            if getattr(event, "dest_path", None):
+                self.watcher.notify(event.dest_path)
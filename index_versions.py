@@ -0,0 +1,432 @@
+# index_versions.py
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional
+from azure.core.exceptions import ResourceNotFoundError
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.indexes.models import SearchIndex, SimpleField, SearchFieldDataType
+
+from chunking import CHUNK_SIZE
+from clause_index import load_clause_index
+from corpus_registry import Corpus, CorpusConfig, CorpusRegistry, create_index_schema, published_scope
+from initialization import (file_hash, document_key, ingest_document, publish_corpus, upload_records, delete_chunks,
+                            load_document_record, load_document_records, write_document_record, remove_document,
+                            record_chunk_ids, load_parents, corpus_data_path, UPLOAD_BATCH_SIZE)
+
+logger = logging.getLogger(__name__)
+
+LIVE = "live"
+
+
+def version_name(base: str, paths: List[str]) -> str:
+    """Index name for the given sources: the base name plus a hash of the files, schema and chunking."""
+    digest = hashlib.sha256()
+    schema = create_index_schema(base)
+    digest.update(",".join(f"{field.name}:{field.type}" for field in schema.fields).encode("utf-8"))
+    digest.update(str(CHUNK_SIZE).encode("utf-8"))
+    for path in sorted(paths, key=os.path.abspath):
+        digest.update(os.path.abspath(path).encode("utf-8"))
+        digest.update(file_hash(path).encode("utf-8"))
+    return f"{base.lower()}-v{digest.hexdigest()[:10]}"
+
+
+class IndexPointer:
+    """Which index version is live, kept in a one-document-per-key index on the search service itself.
+
+    Every replica reads the same pointer; replacing its document is atomic. Build leases live here too,
+    so replicas that start together build a version once.
+    """
+    def __init__(self, index_client: SearchIndexClient, endpoint: str, credential, base: str):
+        self.index_client = index_client
+        self.name = f"{base.lower()}-pointer"
+        self.client = SearchClient(endpoint=endpoint, index_name=self.name, credential=credential)
+
+    def ensure(self):
+        try:
+            self.index_client.get_index(self.name)
+        except ResourceNotFoundError:
+            self.index_client.create_index(SearchIndex(name=self.name, fields=[
+                SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+                SimpleField(name="index_name", type=SearchFieldDataType.String),
+                SimpleField(name="previous", type=SearchFieldDataType.String),
+                SimpleField(name="owner", type=SearchFieldDataType.String),
+                SimpleField(name="updated", type=SearchFieldDataType.Double),
+            ]))
+
+    def _get(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.get_document(key=key)
+        except ResourceNotFoundError:
+            return None
+
+    def live(self) -> Optional[dict]:
+        return self._get(LIVE)
+
+    def switch(self, index_name: str, previous: Optional[str]):
+        self.client.upload_documents(documents=[{"id": LIVE, "index_name": index_name, "previous": previous,
+                                                 "owner": None, "updated": time.time()}])
+
+    def lease(self, version: str, owner: str, lease_seconds: float) -> bool:
+        """Take or renew the build lease of a version; False while another replica holds a fresh one."""
+        key = f"build-{version}"
+        current = self._get(key)
+        if current and current["owner"] != owner and time.time() - current["updated"] < lease_seconds:
+            return False
+        self.client.upload_documents(documents=[{"id": key, "index_name": version, "owner": owner, "updated": time.time()}])
+        # Last writer wins: make sure that was us
+        time.sleep(1.0)
+        current = self._get(key)
+        return current is not None and current["owner"] == owner
+
+    def building(self, lease_seconds: float) -> List[str]:
+        """Versions with a fresh build lease."""
+        results = self.client.search(search_text="*", select=["id", "index_name", "updated"])
+        return [result["index_name"] for result in results
+                if result["id"].startswith("build-") and time.time() - result["updated"] < lease_seconds]
+
+    def release(self, version: str):
+        self.client.delete_documents(documents=[{"id": f"build-{version}"}])
+
+
+class SharedRecords:
+    """Document records of every index version, kept on the search service next to the indexes.
+
+    Replicas serving a version rebuild its parent sections, clause index and search scope from these
+    records instead of parsing the sources again, and follow each other's incremental ingests through them.
+    """
+    def __init__(self, index_client: SearchIndexClient, endpoint: str, credential, base: str, pointer: IndexPointer):
+        self.index_client = index_client
+        self.name = f"{base.lower()}-records"
+        self.client = SearchClient(endpoint=endpoint, index_name=self.name, credential=credential)
+        self.pointer = pointer
+
+    def ensure(self):
+        try:
+            self.index_client.get_index(self.name)
+        except ResourceNotFoundError:
+            self.index_client.create_index(SearchIndex(name=self.name, fields=[
+                SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+                SimpleField(name="index_name", type=SearchFieldDataType.String, filterable=True),
+                SimpleField(name="key", type=SearchFieldDataType.String),
+                SimpleField(name="ingested_at", type=SearchFieldDataType.Double),
+                # The record as compressed JSON; parent sections make it large
+                SimpleField(name="record", type=SearchFieldDataType.String),
+            ]))
+
+    @staticmethod
+    def _id(version: str, key: str) -> str:
+        return f"{version}--{key}"
+
+    def _document(self, version: str, record: Dict) -> Dict:
+        payload = base64.b64encode(zlib.compress(json.dumps(record).encode("utf-8"))).decode("ascii")
+        return {"id": self._id(version, record["key"]), "index_name": version, "key": record["key"],
+                "ingested_at": record["ingested_at"], "record": payload}
+
+    def list(self, version: str) -> Dict[str, float]:
+        """Document keys of a version with the time each was last ingested."""
+        results = self.client.search(search_text="*", filter=f"index_name eq '{version}'", select=["key", "ingested_at"])
+        return {result["key"]: result["ingested_at"] for result in results}
+
+    def get(self, version: str, key: str) -> Optional[Dict]:
+        try:
+            document = self.client.get_document(key=self._id(version, key))
+        except ResourceNotFoundError:
+            return None
+        return json.loads(zlib.decompress(base64.b64decode(document["record"])))
+
+    def push(self, version: str, directory: str, key: str):
+        """Share the local record of a document, or its removal."""
+        record = load_document_record(directory, key)
+        if record is None:
+            self.client.delete_documents(documents=[{"id": self._id(version, key)}])
+        else:
+            self.client.upload_documents(documents=[self._document(version, record)])
+
+    def is_live(self, version: str) -> bool:
+        """Whether the pointer still serves `version`; changes pushed while it does are carried into the next one."""
+        live = self.pointer.live()
+        return live is None or live["index_name"] == version
+
+    def push_all(self, version: str, directory: str):
+        """Make the shared records of a version match the local ones."""
+        records = load_document_records(directory)
+        removed = set(self.list(version)) - {record["key"] for record in records}
+        if removed:
+            self.client.delete_documents(documents=[{"id": self._id(version, key)} for key in removed])
+        for start in range(0, len(records), UPLOAD_BATCH_SIZE):
+            self.client.upload_documents(documents=[self._document(version, record)
+                                                    for record in records[start:start + UPLOAD_BATCH_SIZE]])
+
+    def download(self, version: str, directory: str) -> int:
+        """Write a version's records to `directory`; returns how many there were."""
+        keys = self.list(version)
+        for key in keys:
+            record = self.get(version, key)
+            if record is not None:
+                write_document_record(directory, record)
+        return len(keys)
+
+    def delete_version(self, version: str):
+        ids = [{"id": self._id(version, key)} for key in self.list(version)]
+        for start in range(0, len(ids), UPLOAD_BATCH_SIZE):
+            self.client.delete_documents(documents=ids[start:start + UPLOAD_BATCH_SIZE])
+
+
+class IndexVersionManager:
+    """Blue/green index versions for one corpus.
+
+    The live version (read through the pointer) is served while the version for the current sources is
+    built in the background under a lease, smoke-tested, and switched to through the pointer; versions
+    other than the live and previous one are deleted. A new version is built from the manifest plus the
+    documents added to the live version since (uploads, watched folders).
+
+    Document records are shared through SharedRecords; each replica derives its clause index, parent
+    sections and search scope from them in its own data directory per version, and polls for changes
+    made by the other replicas along with pointer switches.
+    """
+    def __init__(self, config: CorpusConfig, registry: CorpusRegistry, index_client: SearchIndexClient, endpoint: str,
+                 credential, pytesseract_available: bool = False, embedder=None, lease_seconds: float = 900.0,
+                 poll_interval: float = 30.0, smoke_queries: Optional[List[str]] = None,
+                 on_switch: Optional[Callable[[Corpus], None]] = None):
+        self.config = config
+        self.registry = registry
+        self.index_client = index_client
+        self.endpoint = endpoint
+        self.credential = credential
+        self.pytesseract_available = pytesseract_available
+        self.embedder = embedder
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.smoke_queries = smoke_queries or []
+        self.on_switch = on_switch
+        self.pointer = IndexPointer(index_client, endpoint, credential, config.index_name)
+        self.records = SharedRecords(index_client, endpoint, credential, config.index_name, self.pointer)
+        self.owner = uuid.uuid4().hex
+        self.serving: Optional[str] = None
+        self.lock = threading.Lock()
+        self.builder: Optional[threading.Thread] = None
+        # Versions whose build failed are not retried until the next start
+        self.failed = set()
+
+    def version_config(self, version: str) -> CorpusConfig:
+        return replace(self.config, index_name=version,
+                       clause_index_path=corpus_data_path(self.config.name, os.path.join(version, "clause_index.bin")),
+                       parents_path=corpus_data_path(self.config.name, os.path.join(version, "parents.json")))
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"index-versions-{self.config.name}", daemon=True).start()
+
+    def _run(self):
+        paths, target = None, None
+        while True:
+            try:
+                self.pointer.ensure()
+                self.records.ensure()
+                live = self.pointer.live()
+                if live and live["index_name"] != self.serving:
+                    self.activate(live["index_name"])
+                self.sync_records()
+                if target is None:
+                    # Hashes the sources; a missing file is retried on the next poll while the live version is served
+                    paths = self.config.manifest_paths()
+                    target = version_name(self.config.index_name, paths)
+                # Built on its own thread, so this loop keeps following the other replicas during parsing and OCR
+                building = self.builder is not None and self.builder.is_alive()
+                if not building and (not live or live["index_name"] != target) and target not in self.failed:
+                    self.builder = threading.Thread(target=self._build, args=(target, paths, live),
+                                                    name=f"index-build-{self.config.name}", daemon=True)
+                    self.builder.start()
+            except Exception as e:
+                logger.error(f"Index version maintenance for {self.config.name} failed: {e}")
+            time.sleep(self.poll_interval)
+
+    def _build(self, version: str, paths: List[str], live: Optional[dict]):
+        try:
+            self.build(version, paths, live)
+        except Exception as e:
+            logger.error(f"Building index {version} for corpus {self.config.name} failed: {e}")
+
+    def activate(self, version: str):
+        """Serve a version, deriving its local data from the shared document records when needed."""
+        with self.lock:
+            # The builder and the polling loop can both notice a switch
+            if version != self.serving:
+                self._activate(version)
+
+    def _activate(self, version: str):
+        config = self.version_config(version)
+        partial = False
+        if not os.path.exists(config.parents_path):
+            if self.records.download(version, config.documents_dir):
+                publish_corpus(config.documents_dir, config.parents_path, config.clause_index_path)
+            else:
+                # Built by a release without shared records: serve its chunks without context expansion
+                logger.warning(f"No document records for index {version}; serving it without parent sections or clause index")
+                partial = True
+        corpus = Corpus(config, SearchClient(endpoint=self.endpoint, index_name=version, credential=self.credential),
+                        None if partial else load_clause_index(config.clause_index_path),
+                        None if partial else load_parents(config.parents_path), partial=partial,
+                        shared_records=None if partial else self.records)
+        self.registry.pin(corpus)
+        previous, self.serving = self.serving, version
+        logger.info(f"Serving corpus {self.config.name} from index {version}")
+        self.remove_local_data(keep={version, previous})
+        if self.on_switch:
+            self.on_switch(corpus)
+
+    def sync_records(self):
+        """Apply the document changes other replicas made to the served version, and republish it."""
+        corpus = self.registry.pinned.get(self.config.name)
+        if corpus is None or corpus.partial:
+            return
+        config = corpus.config
+        with self.registry.publish_lock(self.config.name):
+            shared = self.records.list(config.index_name)
+            local = {record["key"]: record for record in load_document_records(config.documents_dir)}
+            changed = False
+            for key in set(local) - set(shared):
+                remove_document(config.documents_dir, key)
+                changed = True
+            for key, ingested_at in shared.items():
+                if key not in local or local[key].get("ingested_at") != ingested_at:
+                    record = self.records.get(config.index_name, key)
+                    if record is not None:
+                        write_document_record(config.documents_dir, record)
+                        changed = True
+            if changed:
+                publish_corpus(config.documents_dir, config.parents_path, config.clause_index_path)
+                self.registry.reload(self.config.name)
+                logger.info(f"Corpus {self.config.name} picked up document changes from other replicas")
+
+    def carry_over(self, live_version: str, config: CorpusConfig, search_client: SearchClient, paths: List[str],
+                   carried: Dict[str, float], version: str) -> List[str]:
+        """Bring documents of the live version that are not in the manifest into the new version.
+
+        Their sources are ingested again when this replica has them, else their chunks are copied as they
+        are. `carried` maps the keys done so far to their live ingestion time, so calls repeated while the
+        live version changes only redo what changed. Returns the keys this call added, replaced or removed.
+        """
+        changed = []
+        manifest_keys = {document_key(path) for path in paths}
+        live = self.records.list(live_version)
+        live_client = SearchClient(endpoint=self.endpoint, index_name=live_version, credential=self.credential)
+        try:
+            for key, ingested_at in live.items():
+                if key in manifest_keys or carried.get(key) == ingested_at:
+                    continue
+                record = self.records.get(live_version, key)
+                if record is None:
+                    continue
+                if os.path.isfile(record["path"]):
+                    ingest_document(record["path"], search_client, self.pytesseract_available, config.documents_dir, self.embedder)
+                else:
+                    logger.warning(f"{record['path']} is not on this replica; copying its chunks from {live_version} as they are")
+                    chunk_ids = record_chunk_ids(record)
+                    stale = set(remove_document(config.documents_dir, key)) - set(chunk_ids)
+                    upload_records(search_client, [live_client.get_document(key=chunk_id) for chunk_id in chunk_ids])
+                    write_document_record(config.documents_dir, record)
+                    delete_chunks(search_client, list(stale))
+                carried[key] = ingested_at
+                changed.append(key)
+                self.pointer.lease(version, self.owner, self.lease_seconds)
+            # Removed from the live version since they were carried over
+            for key in [key for key in carried if key not in live]:
+                delete_chunks(search_client, remove_document(config.documents_dir, key))
+                del carried[key]
+                changed.append(key)
+        finally:
+            live_client.close()
+        return changed
+
+    def build(self, version: str, paths: List[str], live: Optional[dict]):
+        if not self.pointer.lease(version, self.owner, self.lease_seconds):
+            logger.info(f"Index {version} is being built by another replica")
+            return
+        config = self.version_config(version)
+        live_version = live["index_name"] if live else None
+        carried: Dict[str, float] = {}
+        try:
+            logger.info(f"Building index {version} for corpus {self.config.name} in the background")
+            # A leftover of an interrupted build is started over
+            try:
+                self.index_client.delete_index(version)
+            except ResourceNotFoundError:
+                pass
+            self.records.delete_version(version)
+            shutil.rmtree(os.path.dirname(config.parents_path), ignore_errors=True)
+            self.index_client.create_index(create_index_schema(version))
+            search_client = SearchClient(endpoint=self.endpoint, index_name=version, credential=self.credential)
+            for path in paths:
+                ingest_document(path, search_client, self.pytesseract_available, config.documents_dir, self.embedder)
+                self.pointer.lease(version, self.owner, self.lease_seconds)
+            if live_version:
+                self.carry_over(live_version, config, search_client, paths, carried, version)
+            parents = publish_corpus(config.documents_dir, config.parents_path, config.clause_index_path)
+            chunk_count = sum(len(record_chunk_ids(record)) for record in load_document_records(config.documents_dir))
+            self.validate(search_client, parents, chunk_count)
+            self.records.push_all(version, config.documents_dir)
+            self.pointer.switch(version, live_version)
+            logger.info(f"Switched corpus {self.config.name} to index {version} ({chunk_count} chunks)")
+            self.activate(version)
+            if live_version:
+                # Documents ingested into the old version while this one was built. Ingestion checks the pointer
+                # after pushing, so a change pushed to the old version after this point is redone on this one.
+                with self.registry.publish_lock(self.config.name):
+                    changed = self.carry_over(live_version, config, search_client, paths, carried, version)
+                    for key in changed:
+                        # Only these keys: other replicas may already be ingesting into this version
+                        self.records.push(version, config.documents_dir, key)
+                    publish_corpus(config.documents_dir, config.parents_path, config.clause_index_path)
+                    self.registry.reload(self.config.name)
+        except Exception:
+            self.failed.add(version)
+            raise
+        finally:
+            self.pointer.release(version)
+        self.collect_garbage(keep={version, live_version})
+
+    def validate(self, search_client: SearchClient, parents, chunk_count: int, timeout: float = 120.0):
+        """Smoke-test a built version before it goes live; raises RuntimeError when it fails."""
+        deadline = time.monotonic() + timeout
+        # Uploaded documents become searchable after a short indexing delay
+        while search_client.get_document_count() < chunk_count:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Only {search_client.get_document_count()} of {chunk_count} chunks are searchable")
+            time.sleep(2.0)
+        queries = self.smoke_queries or [parent.metadata["section_title"] for parent in parents.values()
+                                         if parent.metadata.get("section_title")][:3]
+        scope = published_scope(parents)
+        for query in queries:
+            if not list(search_client.search(search_text=query, filter=scope, top=1)):
+                raise RuntimeError(f"Smoke query returned nothing: {query}")
+        logger.info(f"Index passed {len(queries)} smoke queries")
+
+    def remove_local_data(self, keep):
+        """Drop this replica's data directories of versions it no longer serves."""
+        root = corpus_data_path(self.config.name, "")
+        prefix = f"{self.config.index_name.lower()}-v"
+        if os.path.isdir(root):
+            for name in os.listdir(root):
+                if name.startswith(prefix) and name not in keep:
+                    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    def collect_garbage(self, keep):
+        """Delete versions other than `keep` and those still being built, with their local data."""
+        prefix = f"{self.config.index_name.lower()}-v"
+        keep = set(keep) | set(self.pointer.building(self.lease_seconds))
+        for name in self.index_client.list_index_names():
+            if name.startswith(prefix) and name not in keep:
+                logger.info(f"Deleting old index version {name}")
+                self.index_client.delete_index(name)
+                self.records.delete_version(name)
+                shutil.rmtree(os.path.dirname(self.version_config(name).parents_path), ignore_errors=True)
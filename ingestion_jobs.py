@@ -0,0 +1,325 @@
+# ingestion_jobs.py
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from corpus_registry import CorpusUnavailableError
+from initialization import (parse_document, split_document, embed_document, upload_records, commit_document, remove_document,
+                            delete_chunks, publish_corpus, load_document_record, record_chunk_ids, document_key, DEFAULT_CORPUS)
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["parse", "split", "embed", "upload"]
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+# A job adds or replaces its document, or removes it from the corpus
+INGEST, DELETE = "ingest", "delete"
+
+INGEST_DB_PATH = os.getenv('INGEST_DB_PATH', 'ingestion_jobs.db')
+# Stage outputs of running jobs, so a restarted worker resumes after the last finished stage
+INGEST_CHECKPOINT_DIR = os.getenv('INGEST_CHECKPOINT_DIR', 'ingestion_checkpoints')
+# A failed job waits this many seconds before its retry, doubling per attempt up to the maximum
+INGEST_RETRY_DELAY = float(os.getenv('INGEST_RETRY_DELAY', 30))
+INGEST_MAX_RETRY_DELAY = float(os.getenv('INGEST_MAX_RETRY_DELAY', 600))
+
+
+class JobStore:
+    """Ingestion jobs in sqlite (WAL, fsync on commit), shared by the backend and the CLI."""
+    def __init__(self, path: str = INGEST_DB_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=FULL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, corpus TEXT NOT NULL, path TEXT NOT NULL, "
+                "status TEXT NOT NULL, stage TEXT, progress TEXT NOT NULL, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created REAL NOT NULL, started REAL, finished REAL, action TEXT NOT NULL DEFAULT 'ingest', not_before REAL)"
+            )
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+            if "action" not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN action TEXT NOT NULL DEFAULT 'ingest'")
+            if "not_before" not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+
+    @staticmethod
+    def _row_to_job(row) -> Dict:
+        keys = ("id", "corpus", "path", "status", "stage", "progress", "error", "attempts", "created", "started", "finished", "action",
+                "not_before")
+        job = dict(zip(keys, row))
+        job["progress"] = json.loads(job["progress"])
+        return job
+
+    def enqueue(self, corpus: str, path: str, action: str = INGEST) -> Dict:
+        job_id = uuid.uuid4().hex
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO jobs (id, corpus, path, status, progress, created, action) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (job_id, corpus, path, QUEUED, json.dumps({}), time.time(), action))
+        logger.info(f"Queued {action} of {path} for corpus {corpus} as job {job_id}")
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        query, args = "SELECT * FROM jobs", ()
+        if status:
+            query, args = query + " WHERE status = ?", (status,)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY created DESC LIMIT ?", args + (limit,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def is_queued(self, corpus: str, path: str, action: str = INGEST) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM jobs WHERE corpus = ? AND path = ? AND action = ? AND status = ? LIMIT 1",
+                                    (corpus, path, action, QUEUED)).fetchone()
+        return row is not None
+
+    def claim(self) -> Optional[Dict]:
+        """Mark the oldest due queued job running and return it.
+
+        Other processes may share the database, so the select and update run in one write transaction,
+        and a job another process claimed first is not returned.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT id FROM jobs WHERE status = ? AND (not_before IS NULL OR not_before <= ?) "
+                                    "ORDER BY created LIMIT 1", (QUEUED, now)).fetchone()
+            if row is None:
+                return None
+            claimed = self.conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, started = COALESCE(started, ?), "
+                                        "error = NULL WHERE id = ? AND status = ?", (RUNNING, now, row[0], QUEUED)).rowcount
+            if claimed == 0:
+                return None
+        return self.get(row[0])
+
+    def update(self, job_id: str, **fields):
+        if "progress" in fields:
+            fields["progress"] = json.dumps(fields["progress"])
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self.lock, self.conn:
+            self.conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", tuple(fields.values()) + (job_id,))
+
+    def recover(self) -> int:
+        """Requeue jobs left running by a process that stopped; they resume from their checkpoints."""
+        with self.lock, self.conn:
+            count = self.conn.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING)).rowcount
+        if count:
+            logger.info(f"Requeued {count} interrupted ingestion jobs")
+        return count
+
+    def stats(self, window: float = 3600.0) -> Dict:
+        """Jobs per status, and chunk throughput of the jobs finished within `window` seconds."""
+        with self.lock:
+            counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            rows = self.conn.execute("SELECT progress, started, finished FROM jobs WHERE status = ? AND finished >= ?",
+                                     (DONE, time.time() - window)).fetchall()
+        chunks = sum(json.loads(progress).get("upload", {}).get("total", 0) for progress, _, _ in rows)
+        busy = sum(finished - started for _, started, finished in rows if started and finished)
+        return {
+            "jobs": {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)},
+            "finished_in_window": len(rows),
+            "window_seconds": window,
+            "chunks_per_second": round(chunks / busy, 2) if busy else None,
+        }
+
+
+class IngestionWorkers:
+    """Worker threads that take jobs from the store and run them through parse, split, embed and upload.
+
+    Each finished stage is checkpointed to disk and upload progress is recorded per batch, so an
+    interrupted job resumes where it stopped. A finished document is published to its corpus
+    (parent sections and clause index) and the serving copy reloaded, without a restart.
+    """
+    def __init__(self, store: JobStore, registry, pytesseract_available: bool = False, workers: int = 2,
+                 checkpoint_dir: str = INGEST_CHECKPOINT_DIR, poll_interval: float = 2.0, max_attempts: int = 3,
+                 retry_delay: float = INGEST_RETRY_DELAY, max_retry_delay: float = INGEST_MAX_RETRY_DELAY,
+                 embedder: Optional[Callable[[List[str]], List[List[float]]]] = None):
+        self.store = store
+        self.registry = registry
+        self.pytesseract_available = pytesseract_available
+        self.workers = workers
+        self.checkpoint_dir = checkpoint_dir
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.embedder = embedder
+        self.wakeup = threading.Event()
+        self.threads: List[threading.Thread] = []
+
+    def start(self):
+        self.store.recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"ingestion-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Started {self.workers} ingestion workers")
+
+    def enqueue(self, corpus: str, path: str, action: str = INGEST) -> Dict:
+        job = self.store.enqueue(corpus, path, action)
+        self.wakeup.set()
+        return job
+
+    def pending(self, job_ids: List[str]) -> int:
+        """How many of the jobs are still queued or running."""
+        jobs = (self.store.get(job_id) for job_id in job_ids)
+        return sum(1 for job in jobs if job is not None and job["status"] in (QUEUED, RUNNING))
+
+    def _loop(self):
+        while True:
+            job = self.store.claim()
+            if job is None:
+                # Jobs queued by the CLI are noticed on the next poll
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+            try:
+                self.process(job)
+            except CorpusUnavailableError:
+                # No index version is served yet; wait for one without using up an attempt
+                self.store.update(job["id"], status=QUEUED, attempts=job["attempts"] - 1, not_before=time.time() + self.poll_interval)
+            except Exception as e:
+                status = QUEUED if job["attempts"] < self.max_attempts else FAILED
+                logger.error(f"Ingestion job {job['id']} ({job['path']}) failed at stage {job.get('stage')}: {e}")
+                # Back off so a transient outage does not use up the attempts within seconds
+                delay = min(self.retry_delay * 2 ** (job["attempts"] - 1), self.max_retry_delay)
+                self.store.update(job["id"], status=status, error=str(e), finished=time.time() if status == FAILED else None,
+                                  not_before=time.time() + delay if status == QUEUED else None)
+                if status == FAILED:
+                    shutil.rmtree(os.path.join(self.checkpoint_dir, job["id"]), ignore_errors=True)
+
+    def _checkpoint(self, job_id: str, stage: str, produce: Callable[[], Dict]) -> Dict:
+        path = os.path.join(self.checkpoint_dir, job_id, f"{stage}.json")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                return json.load(file)
+        output = produce()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(output, file)
+        os.replace(tmp_path, path)
+        return output
+
+    def _publish(self, corpus, job: Dict, change: Callable[[], List[str]]) -> Optional[List[str]]:
+        """Apply `change` to the corpus's document records and republish it as one swap.
+
+        Returns the chunk ids to delete, or None when a later job already changed the document.
+        """
+        with self.registry.publish_lock(corpus.name):
+            key = document_key(job["path"])
+            record = load_document_record(corpus.config.documents_dir, key)
+            if record is not None and record.get("queued_at", 0) > job["created"]:
+                return None
+            stale = change()
+            if corpus.shared_records is not None:
+                # Other replicas serving this index version pick the change up from the shared records
+                corpus.shared_records.push(corpus.config.index_name, corpus.config.documents_dir, key)
+            publish_corpus(corpus.config.documents_dir, corpus.config.parents_path, corpus.config.clause_index_path)
+            self.registry.reload(corpus.name)
+            if corpus.shared_records is not None and not corpus.shared_records.is_live(corpus.config.index_name):
+                # Switched before this replica noticed: the new version may have been seeded without this
+                # change, so the job is redone once the new version is served here
+                delete_chunks(corpus.search_client, stale)
+                raise CorpusUnavailableError(corpus.name)
+        return stale
+
+    def _finish(self, job_id: str):
+        self.store.update(job_id, status=DONE, stage=None, finished=time.time())
+        shutil.rmtree(os.path.join(self.checkpoint_dir, job_id), ignore_errors=True)
+
+    def process(self, job: Dict):
+        job_id, progress = job["id"], job["progress"]
+        if job["action"] == DELETE:
+            with self.registry.using(job["corpus"], for_ingestion=True) as corpus:
+                key = document_key(job["path"])
+                stale = self._publish(corpus, job, lambda: remove_document(corpus.config.documents_dir, key)) or []
+                delete_chunks(corpus.search_client, stale)
+            self._finish(job_id)
+            logger.info(f"Removed {job['path']} from corpus {job['corpus']}: {len(stale)} chunks deleted")
+            return
+
+        def stage(name: str, **values):
+            progress.setdefault(name, {}).update(values)
+            job["stage"] = name
+            self.store.update(job_id, stage=name, progress=progress)
+
+        def timed(name: str, produce: Callable[[], Dict]) -> Dict:
+            if progress.get(name, {}).get("seconds") is not None:
+                return self._checkpoint(job_id, name, produce)
+            stage(name)
+            start = time.monotonic()
+            output = self._checkpoint(job_id, name, produce)
+            stage(name, seconds=round(time.monotonic() - start, 2))
+            return output
+
+        with self.registry.using(job["corpus"], for_ingestion=True) as corpus:
+            parsed = timed("parse", lambda: parse_document(job["path"], self.pytesseract_available))
+            split = timed("split", lambda: split_document(parsed))
+            total = len(split["records"])
+            embedded = split if self.embedder is None else timed("embed", lambda: embed_document(
+                split, self.embedder, on_progress=lambda done: stage("embed", done=done, total=total)))
+
+            # Upload resumes from the last batch the index acknowledged, unless that was another index version
+            index_name = corpus.config.index_name
+            uploaded = progress.get("upload", {}).get("done", 0) if progress.get("upload", {}).get("index", index_name) == index_name else 0
+            stage("upload", done=uploaded, total=total, index=index_name)
+            start = time.monotonic()
+            upload_records(corpus.search_client, embedded["records"], start=uploaded,
+                           on_progress=lambda done: stage("upload", done=done))
+            stage("upload", seconds=round(time.monotonic() - start, 2) + progress["upload"].get("seconds", 0))
+
+            stale = self._publish(corpus, job, lambda: commit_document(corpus.config.documents_dir, embedded, queued_at=job["created"]))
+            if stale is None:
+                # Superseded by a later job: drop what this one uploaded, unless it is the version being served
+                current = load_document_record(corpus.config.documents_dir, embedded["key"])
+                serving = set(record_chunk_ids(current)) if current else set()
+                stale = [record["id"] for record in embedded["records"] if record["id"] not in serving]
+                logger.info(f"Job {job_id} was superseded by a later change to {job['path']}")
+            # Chunks of the replaced version go only once the new version is being served
+            delete_chunks(corpus.search_client, stale)
+
+        self._finish(job_id)
+        logger.info(f"Ingested {job['path']} into corpus {job['corpus']}: {total} chunks, {len(stale)} replaced")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue PDFs for ingestion by the backend's workers, or show job status.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    enqueue = subparsers.add_parser("enqueue", help="queue files for ingestion")
+    enqueue.add_argument("paths", nargs="+")
+    enqueue.add_argument("--corpus", default=DEFAULT_CORPUS)
+    status = subparsers.add_parser("status", help="show one job, or recent jobs and throughput")
+    status.add_argument("job_id", nargs="?")
+    args = parser.parse_args()
+
+    store = JobStore()
+    if args.command == "enqueue":
+        for path in args.paths:
+            if not os.path.isfile(path):
+                parser.error(f"{path} is not a file")
+        jobs = [store.enqueue(args.corpus, os.path.abspath(path)) for path in args.paths]
+        print(json.dumps(jobs, indent=2))
+    elif args.job_id:
+        job = store.get(args.job_id)
+        if job is None:
+            parser.error(f"No job {args.job_id}")
+        print(json.dumps(job, indent=2))
+    else:
+        print(json.dumps({"stats": store.stats(), "jobs": store.list(limit=20)}, indent=2))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
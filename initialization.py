@@ -1,111 +1,242 @@
 import logging
+import os
 from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient
 from langchain.schema import Document
-from langchain_community.document_loaders import UnstructuredPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from cachetools import TTLCache
+from langchain_openai import ChatOpenAI
+import hashlib
 import json
+import re
 import time
+from typing import Callable, Dict, List, Optional
 
-logger = logging.getLogger(__name__)
+from chunking import split_documents
+from clause_index import build_records_by_parent, write_clause_index
+from document_metadata import load_pdf_document, chunk_metadata
 
-# Initialize the cache for storing chunks
-chunks_cache = TTLCache(maxsize=100, ttl=300)
-
-def load_chunks(search_client: SearchClient, local_path: str, pytesseract_available: bool):
-    """Load chunks from cache or Azure Cognitive Search."""
-    if 'chunks' in chunks_cache:
-        logger.info("Loading chunks from cache...")
-        return chunks_cache['chunks']
-
-    chunks = []
-    try:
-        results = search_client.search(search_text="*", select=["id", "content", "embedding"])
-        chunks = [Document(page_content=result["content"], metadata={"id": result["id"], "embedding": result["embedding"]}) for result in results]
-        logger.info(f"Loaded {len(chunks)} chunks from Azure Cognitive Search")
-    except Exception as e:
-        logger.error(f"Error loading chunks from Azure Cognitive Search: {e}")
-        raise
-
-    chunks_cache['chunks'] = chunks
-    return chunks
-
-def load_chunks_from_pdf(local_path: str, search_client: SearchClient, pytesseract_available: bool):
-    """Load chunks from a PDF file."""
-    if not local_path:
-        raise FileNotFoundError("PDF file not found.")
+logger = logging.getLogger(__name__)
 
+UPLOAD_BATCH_SIZE = 100
+EMBED_BATCH_SIZE = 64
+
+DEFAULT_CORPUS = os.getenv('DEFAULT_CORPUS', 'default')
+# Parent sections and ingestion records of each corpus live under this directory
+CORPUS_DATA_DIR = os.getenv('CORPUS_DATA_DIR', 'corpora')
+
+def _write_json(payload, path: str):
+    """Write JSON through a temporary file so readers never see a partial file."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(payload, file)
+    os.replace(tmp_path, path)
+
+def serialize_parents(parents: Dict[str, Document]) -> Dict[str, Dict]:
+    return {parent_id: {"page_content": parent.page_content, "metadata": parent.metadata} for parent_id, parent in parents.items()}
+
+def deserialize_parents(payload: Dict[str, Dict]) -> Dict[str, Document]:
+    return {parent_id: Document(page_content=item["page_content"], metadata=item["metadata"]) for parent_id, item in payload.items()}
+
+def write_parents(parents: Dict[str, Document], path: str):
+    """Persist parent sections so a corpus loaded later can expand its chunks without re-ingesting."""
+    _write_json(serialize_parents(parents), path)
+
+def load_parents(path: str) -> Dict[str, Document]:
+    """Parent sections written at ingestion, or an empty dict when there are none."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as file:
+        return deserialize_parents(json.load(file))
+
+def corpus_data_path(corpus: str, filename: str) -> str:
+    return os.path.join(CORPUS_DATA_DIR, corpus, filename)
+
+def documents_dir(parents_path: str) -> str:
+    """Per-document ingestion records live next to the corpus's parent sections."""
+    return os.path.join(os.path.dirname(parents_path), "documents")
+
+def document_key(path: str) -> str:
+    """Index-safe key of a source file: its name plus a short hash of its full path."""
+    name = re.sub(r"[^A-Za-z0-9_\-]", "_", os.path.splitext(os.path.basename(path))[0])[:40]
+    return f"{name}-{hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]}"
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Ingestion of one document runs in stages (parse, split, embed, upload); each stage's output is
+# JSON-serializable so ingestion_jobs can checkpoint it.
+
+def parse_document(path: str, pytesseract_available: bool) -> Dict:
+    """Parse stage: the PDF's text, metadata and page offsets."""
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"PDF file not found: {path}")
+    content_hash = file_hash(path)
     strategy = "ocr_only" if pytesseract_available else "hi_res"
-    loader = UnstructuredPDFLoader(file_path=local_path, strategy=strategy)
-    data = loader.load()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=7500, chunk_overlap=100)
-    chunks = text_splitter.split_documents(data)
+    document, page_starts = load_pdf_document(path, strategy)
+    return {"path": path, "hash": content_hash, "page_content": document.page_content,
+            "metadata": document.metadata, "page_starts": page_starts}
+
+def split_document(parsed: Dict) -> Dict:
+    """Split stage: chunk records for the index plus the document's parent sections.
+
+    Chunk and parent ids carry the document key and content hash, so a new version of a document
+    never overwrites the chunks of the version being served.
+    """
+    document = Document(page_content=parsed["page_content"], metadata=parsed["metadata"])
+    chunks, parents = split_documents([document])
+    prefix = f"{document_key(parsed['path'])}-{parsed['hash'][:8]}"
+    page_starts = {parsed["path"]: parsed["page_starts"]}
+    records, chunk_ids = [], {}
     for i, chunk in enumerate(chunks):
-        embedding = chunk.metadata.get("embedding", [])
-        doc = {
-            "id": str(i),  # Ensure each document has a unique ID
+        parent_id = f"{prefix}-{chunk.metadata['parent_id']}"
+        chunk_id = f"{prefix}-{i}"
+        chunk_ids.setdefault(parent_id, []).append(chunk_id)
+        records.append({
+            "id": chunk_id,
             "content": chunk.page_content,
-            "embedding": json.dumps(embedding)  # Ensure embedding is a string
-        }
-        search_client.upload_documents(documents=[doc])
-    logger.info(f"Uploaded {len(chunks)} chunks from PDF to Azure Cognitive Search")
-    return chunks
-
-def initialize_system(openai_api_key, search_index_name, index_client, index_schema, search_client, local_path, pytesseract_available):
-    """Initialize the system components."""
-    retries = 3
-    for attempt in range(retries):
-        try:
-            logger.info(f"Initialization attempt {attempt + 1}...")
-
-            # Delete the existing index if it exists
-            try:
-                logger.info("Deleting existing index if it exists...")
-                index_client.delete_index(search_index_name)
-                logger.info(f"Deleted existing index: {search_index_name}")
-            except Exception as e:
-                logger.warning(f"No existing index to delete or error in deletion: {e}")
-
-            # Create the index
-            logger.info("Creating new index...")
-            index_client.create_index(index_schema)
-            logger.info("Index created successfully")
-
-            logger.info("Initializing OpenAI embeddings...")
-            embedding_function = OpenAIEmbeddings(model="text-embedding-ada-002", api_key=openai_api_key)
-            logger.info("OpenAI embeddings initialized")
-
-            logger.info("Loading chunks from Azure Cognitive Search...")
-            chunks = load_chunks(search_client, local_path, pytesseract_available)
-
-            if not chunks:
-                logger.info("No chunks found in Azure Cognitive Search, loading from PDF...")
-                chunks = load_chunks_from_pdf(local_path, search_client, pytesseract_available)
-
-            logger.info("Loading LLM model...")
-            llm = ChatOpenAI(api_key=openai_api_key, model="gpt-3.5-turbo")
-            logger.info("LLM model loaded")
-
-            logger.info("Setting up query prompt...")
-            QUERY_PROMPT = ChatPromptTemplate.from_template(
-                """You are an AI language model assistant. Your task is to answer customer questions as best as you can with information that you can find in the added data in the vector database.
-                You always remain polite and if you can't find it in the vector database, you indicate that.
-                The original question: {question}
-                Context: {context}"""
-            )
-            logger.info("Query prompt set up")
-
-            sequence = QUERY_PROMPT | llm
-            logger.info("Sequence initialized successfully")
-            return sequence
-        except Exception as e:
-            logger.error(f"Initialization error on attempt {attempt + 1}: {e}")
-            if attempt < retries - 1:
-                logger.info("Retrying...")
-                time.sleep(5)
-            else:
-                logger.error("Failed to initialize after multiple attempts")
-                raise
+            "embedding": json.dumps(chunk.metadata.get("embedding", [])),  # Ensure embedding is a string
+            "parent_id": parent_id,
+            "section_path": chunk.metadata["section_path"],
+            # Retrieval is scoped to published versions, so a version is invisible until it is complete
+            "version": prefix,
+            # Filterable and facetable metadata
+            **chunk_metadata(chunk, page_starts),
+        })
+    return {
+        "key": document_key(parsed["path"]),
+        "path": parsed["path"],
+        "hash": parsed["hash"],
+        "records": records,
+        "parents": {f"{prefix}-{parent_id}": item for parent_id, item in serialize_parents(parents).items()},
+        "chunk_ids": chunk_ids,
+    }
+
+def embed_document(split: Dict, embedder: Optional[Callable[[List[str]], List[List[float]]]] = None,
+                   batch_size: int = EMBED_BATCH_SIZE, on_progress: Optional[Callable[[int], None]] = None) -> Dict:
+    """Embed stage: fill the chunks' embedding field; a no-op without an embedder."""
+    if embedder is None:
+        return split
+    records = split["records"]
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        for record, vector in zip(batch, embedder([record["content"] for record in batch])):
+            record["embedding"] = json.dumps(vector)
+        if on_progress:
+            on_progress(start + len(batch))
+    return split
+
+def upload_records(search_client: SearchClient, records: List[Dict], start: int = 0,
+                   on_progress: Optional[Callable[[int], None]] = None):
+    """Upload stage: send chunk records in batches, from `start` when resuming."""
+    for offset in range(start, len(records), UPLOAD_BATCH_SIZE):
+        search_client.upload_documents(documents=records[offset:offset + UPLOAD_BATCH_SIZE])
+        if on_progress:
+            on_progress(min(offset + UPLOAD_BATCH_SIZE, len(records)))
+
+def load_document_record(directory: str, key: str) -> Optional[Dict]:
+    path = os.path.join(directory, f"{key}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+def load_document_records(directory: str) -> List[Dict]:
+    if not os.path.isdir(directory):
+        return []
+    records = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as file:
+                records.append(json.load(file))
+    return records
+
+def write_document_record(directory: str, record: Dict):
+    _write_json(record, os.path.join(directory, f"{record['key']}.json"))
+
+def clear_document_records(directory: str):
+    """Forget the documents recorded for an index, e.g. because the index is new."""
+    for record in load_document_records(directory):
+        os.remove(os.path.join(directory, f"{record['key']}.json"))
+
+def record_chunk_ids(record: Dict) -> List[str]:
+    return [chunk_id for ids in record["chunk_ids"].values() for chunk_id in ids]
+
+def commit_document(directory: str, split: Dict, queued_at: Optional[float] = None) -> List[str]:
+    """Record an uploaded document version; returns the chunk ids of the version it replaces."""
+    previous = load_document_record(directory, split["key"])
+    record = {key: split[key] for key in ("key", "path", "hash", "parents", "chunk_ids")}
+    record["ingested_at"] = time.time()
+    record["queued_at"] = queued_at or record["ingested_at"]
+    write_document_record(directory, record)
+    if previous is None:
+        return []
+    current = set(record_chunk_ids(split))
+    return [chunk_id for chunk_id in record_chunk_ids(previous) if chunk_id not in current]
+
+def remove_document(directory: str, key: str) -> List[str]:
+    """Drop a document's record; returns its chunk ids, to delete once the corpus is republished without it."""
+    record = load_document_record(directory, key)
+    if record is None:
+        return []
+    os.remove(os.path.join(directory, f"{key}.json"))
+    return record_chunk_ids(record)
+
+def delete_chunks(search_client: SearchClient, chunk_ids: List[str]):
+    for start in range(0, len(chunk_ids), UPLOAD_BATCH_SIZE):
+        search_client.delete_documents(documents=[{"id": chunk_id} for chunk_id in chunk_ids[start:start + UPLOAD_BATCH_SIZE]])
+
+def publish_corpus(directory: str, parents_path: str, clause_index_path: str) -> Dict[str, Document]:
+    """Merge the document records into the corpus's parent sections and clause index; both are replaced atomically."""
+    parents: Dict[str, Document] = {}
+    ids_by_parent: Dict[str, List[str]] = {}
+    for record in load_document_records(directory):
+        parents.update(deserialize_parents(record["parents"]))
+        ids_by_parent.update(record["chunk_ids"])
+    if os.path.dirname(clause_index_path):
+        os.makedirs(os.path.dirname(clause_index_path), exist_ok=True)
+    write_clause_index(build_records_by_parent(parents, ids_by_parent), clause_index_path)
+    write_parents(parents, parents_path)
+    return parents
+
+def ingest_document(path: str, search_client: SearchClient, pytesseract_available: bool, directory: str,
+                    embedder: Optional[Callable[[List[str]], List[List[float]]]] = None) -> int:
+    """Run all stages for one PDF and record it; returns the number of chunks uploaded."""
+    split = embed_document(split_document(parse_document(path, pytesseract_available)), embedder)
+    upload_records(search_client, split["records"])
+    delete_chunks(search_client, commit_document(directory, split))
+    return len(split["records"])
+
+def ingest_documents(paths: List[str], search_client: SearchClient, pytesseract_available: bool, parents: Dict[str, Document],
+                     clause_index_path: str, parents_path: str, embedder: Optional[Callable[[List[str]], List[List[float]]]] = None):
+    """Build a fresh index from PDFs; fills `parents` and writes the clause index."""
+    if not paths:
+        raise FileNotFoundError("PDF file not found.")
+
+    directory = documents_dir(parents_path)
+    clear_document_records(directory)
+    chunk_count = sum(ingest_document(path, search_client, pytesseract_available, directory, embedder) for path in paths)
+    published = publish_corpus(directory, parents_path, clause_index_path)
+    parents.clear()
+    parents.update(published)
+    logger.info(f"Uploaded {chunk_count} chunks from {len(paths)} PDF(s) to Azure Cognitive Search")
+    return chunk_count
+
+def initialize_system(openai_api_key, base_url=None, model="gpt-3.5-turbo"):
+    """Initialize the system components; `base_url` points the model at a local OpenAI-compatible server.
+
+    The default corpus index is built and switched to in the background by index_versions.IndexVersionManager,
+    so startup no longer deletes or recreates it.
+    """
+    logger.info("Loading LLM model...")
+    # Retries are scheduled by rate_limiter.call_with_retries, not the client
+    llm = ChatOpenAI(api_key=openai_api_key, base_url=base_url, model=model, max_retries=0, timeout=20)
+    logger.info("LLM model loaded")
+
+    # Prompts are assembled per request by prompt_builder.PromptBuilder
+    sequence = llm
+    logger.info("Sequence initialized successfully")
+    return sequence
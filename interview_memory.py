@@ -0,0 +1,111 @@
+# interview_memory.py
+import logging
+import time
+from typing import Dict, List, Optional
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+logger = logging.getLogger(__name__)
+
+INTERVIEW_SUMMARY_PROMPT = ChatPromptTemplate.from_template(
+    """Update the running summary of an intake interview with the new messages.
+    Keep the user's name, facts they gave and anything still to be clarified; drop greetings and small talk.
+    Use at most five sentences and reply with the summary only.
+    Existing summary: {summary}
+    New messages:
+    {messages}"""
+)
+
+
+def format_messages(messages: List[BaseMessage]) -> str:
+    return "\n".join(f"{'User' if isinstance(message, HumanMessage) else 'Assistant'}: {message.content}" for message in messages)
+
+
+class InterviewMemory:
+    """Prompt memory for the interview flows with a roughly constant size per turn.
+
+    The prompt gets the collected answers, a rolling summary of older messages and a window of
+    recent messages, each exactly once. Drop-in for ConversationBufferMemory's save_context and
+    load_memory_variables.
+    """
+    def __init__(self, llm=None, answers: Optional[Dict[str, str]] = None, window_messages: int = 8,
+                 summarize_batch: int = 4, memory_key: str = "chat_history", return_messages: bool = True):
+        self.chain = INTERVIEW_SUMMARY_PROMPT | llm if llm is not None else None
+        # Shared with the caller's conversation state so answers recorded there show up here
+        self.answers = answers if answers is not None else {}
+        self.summary = ""
+        self.messages: List[BaseMessage] = []
+        self.window_messages = window_messages
+        self.summarize_batch = summarize_batch
+        self.memory_key = memory_key
+        self.return_messages = return_messages
+        # After a failed summary call the next one waits, doubling up to five minutes
+        self.retry_at = 0.0
+        self.retry_delay = 0.0
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def save_context(self, inputs: Dict[str, str], outputs: Dict[str, str]):
+        user_input = inputs.get("input") or next(iter(inputs.values()), "")
+        output = outputs.get("output") or next(iter(outputs.values()), "")
+        if user_input:
+            self.messages.append(HumanMessage(content=user_input))
+        if output:
+            self.messages.append(AIMessage(content=output))
+        # Summarize in batches so the summary call runs every few turns rather than every turn
+        if len(self.messages) >= self.window_messages + self.summarize_batch:
+            self.compact()
+
+    def set_answer(self, question: str, answer: str):
+        self.answers[question] = answer
+
+    def compact(self):
+        """Fold the messages that fell out of the window into the rolling summary."""
+        old, recent = self.messages[:-self.window_messages], self.messages[-self.window_messages:]
+        if not old:
+            return
+        if self.chain is not None:
+            if time.monotonic() < self.retry_at:
+                self._cap()
+                return
+            try:
+                output = self.chain.invoke({"summary": self.summary or "(none)", "messages": format_messages(old)})
+                self.summary = output.content.strip() if hasattr(output, 'content') else str(output).strip()
+                self.retry_delay = 0.0
+            except Exception as e:
+                # Keep a longer window rather than losing the messages, but not an ever-growing one
+                logger.error(f"Interview summary failed: {e}")
+                self.retry_delay = min(max(2 * self.retry_delay, 10.0), 300.0)
+                self.retry_at = time.monotonic() + self.retry_delay
+                self._cap()
+                return
+        self.messages = recent
+
+    def _cap(self):
+        """Drop the oldest unsummarized messages beyond twice the window."""
+        limit = 2 * self.window_messages
+        if len(self.messages) > limit:
+            del self.messages[:len(self.messages) - limit]
+
+    def context(self) -> str:
+        """Answers table and summary as one block of text."""
+        parts = []
+        if self.answers:
+            parts.append("Answers collected so far:\n" + "\n".join(f"- {question} {answer}" for question, answer in self.answers.items()))
+        if self.summary:
+            parts.append(f"Summary of earlier conversation: {self.summary}")
+        return "\n\n".join(parts)
+
+    def load_memory_variables(self, inputs: Optional[Dict] = None) -> Dict:
+        context = self.context()
+        if self.return_messages:
+            history = ([SystemMessage(content=context)] if context else []) + list(self.messages)
+        else:
+            history = "\n\n".join(part for part in (context, format_messages(self.messages)) if part)
+        return {self.memory_key: history}
+
+    def clear(self):
+        self.summary = ""
+        self.messages = []
@@ -0,0 +1,261 @@
+# local_inference.py
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Check if torch and transformers are available
+try:
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    transformers_available = True
+except ImportError:
+    transformers_available = False
+
+DEFAULT_MODEL = "GroNLP/bert-base-dutch-cased"
+
+
+@dataclass(frozen=True)
+class GenerationOptions:
+    max_new_tokens: int = 150
+    do_sample: bool = False
+    temperature: float = 0.7
+    top_p: float = 0.9
+    num_beams: int = 1
+
+    def batch_key(self) -> Tuple:
+        """Requests with the same decode settings can share a generate() call; max_new_tokens may differ."""
+        return (self.do_sample, self.temperature, self.top_p, self.num_beams)
+
+    def generate_kwargs(self) -> Dict:
+        kwargs = {"do_sample": self.do_sample, "num_beams": self.num_beams}
+        if self.do_sample:
+            kwargs.update(temperature=self.temperature, top_p=self.top_p)
+        if self.num_beams > 1:
+            kwargs["early_stopping"] = True
+        return kwargs
+
+
+def options_from_env() -> GenerationOptions:
+    """LOCAL_MODEL_DECODE=greedy|sample|beam picks the default decode strategy."""
+    decode = os.getenv('LOCAL_MODEL_DECODE', 'greedy').lower()
+    max_new_tokens = int(os.getenv('LOCAL_MODEL_MAX_NEW_TOKENS', 150))
+    if decode == 'sample':
+        return GenerationOptions(max_new_tokens=max_new_tokens, do_sample=True,
+                                 temperature=float(os.getenv('LOCAL_MODEL_TEMPERATURE', 0.7)),
+                                 top_p=float(os.getenv('LOCAL_MODEL_TOP_P', 0.9)))
+    if decode == 'beam':
+        return GenerationOptions(max_new_tokens=max_new_tokens, num_beams=int(os.getenv('LOCAL_MODEL_NUM_BEAMS', 4)))
+    return GenerationOptions(max_new_tokens=max_new_tokens)
+
+
+# Upper bounds for options sent to the server; one request's settings are applied to its whole batch
+MAX_NEW_TOKENS_LIMIT = int(os.getenv('LOCAL_MODEL_MAX_NEW_TOKENS_LIMIT', 512))
+MAX_NUM_BEAMS = int(os.getenv('LOCAL_MODEL_MAX_NUM_BEAMS', 8))
+
+
+def options_from_request(data: Dict) -> GenerationOptions:
+    """Coerce and clamp the options in a request body; ValueError names the first bad field."""
+    defaults = GenerationOptions()
+
+    def number(key, cast, low, high):
+        value = data.get(key, getattr(defaults, key))
+        if isinstance(value, bool):
+            raise ValueError(f"{key} must be a number")
+        try:
+            value = cast(value)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"{key} must be a number")
+        if cast is float and value != value:
+            raise ValueError(f"{key} must be a number")
+        return min(max(value, low), high)
+
+    do_sample = data.get('do_sample', defaults.do_sample)
+    if isinstance(do_sample, str) and do_sample.lower() in ('true', 'false'):
+        do_sample = do_sample.lower() == 'true'
+    if not isinstance(do_sample, bool):
+        raise ValueError("do_sample must be a boolean")
+    return GenerationOptions(max_new_tokens=number('max_new_tokens', int, 1, MAX_NEW_TOKENS_LIMIT),
+                             do_sample=do_sample,
+                             temperature=number('temperature', float, 0.01, 2.0),
+                             top_p=number('top_p', float, 0.01, 1.0),
+                             num_beams=number('num_beams', int, 1, MAX_NUM_BEAMS))
+
+
+class LocalModel:
+    """A causal LM loaded once and served to concurrent callers through dynamic batching.
+
+    Requests are collected for up to `max_wait_ms` (or until `max_batch_size` are waiting) and
+    generated together, so concurrent users share one forward pass per step on CPU.
+    """
+    def __init__(self, model_name: str = DEFAULT_MODEL, quantize: bool = False, torch_threads: Optional[int] = None,
+                 max_batch_size: int = 8, max_wait_ms: float = 20.0, max_input_tokens: int = 1024):
+        if not transformers_available:
+            raise ImportError("torch and transformers are required for local inference")
+        if torch_threads:
+            torch.set_num_threads(torch_threads)
+        start = time.perf_counter()
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        # Left padding keeps every prompt flush against its generated tokens
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token or self.tokenizer.unk_token
+        model = AutoModelForCausalLM.from_pretrained(model_name)
+        model.eval()
+        if quantize:
+            # Dynamic int8 quantization of the linear layers: smaller and faster on CPU
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_input_tokens = max_input_tokens
+        self.requests: "queue.Queue[Tuple[str, GenerationOptions, Future]]" = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="local-inference", daemon=True)
+        self.worker.start()
+        logger.info(f"Local model {model_name} loaded in {time.perf_counter() - start:.1f}s "
+                    f"(quantized={quantize}, threads={torch.get_num_threads()}, batch={max_batch_size})")
+
+    def submit(self, prompt: str, options: Optional[GenerationOptions] = None) -> Future:
+        future = Future()
+        self.requests.put((prompt, options or GenerationOptions(), future))
+        return future
+
+    def generate(self, prompt: str, options: Optional[GenerationOptions] = None, timeout: Optional[float] = None) -> str:
+        """Generate a completion for one prompt; blocks until its batch has run."""
+        return self.submit(prompt, options).result(timeout=timeout)
+
+    def _collect(self) -> List[Tuple[str, GenerationOptions, Future]]:
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            groups: Dict[Tuple, List[Tuple[str, GenerationOptions, Future]]] = {}
+            for request in batch:
+                # Cancelled while queued: skip it
+                if request[2].set_running_or_notify_cancel():
+                    groups.setdefault(request[1].batch_key(), []).append(request)
+            for group in groups.values():
+                try:
+                    outputs = self._generate_batch([prompt for prompt, _, _ in group], [options for _, options, _ in group])
+                except Exception as e:
+                    logger.error(f"Local generation failed for a batch of {len(group)}: {e}")
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+                for (_, _, future), output in zip(group, outputs):
+                    future.set_result(output)
+
+    def _generate_batch(self, prompts: List[str], options: List[GenerationOptions]) -> List[str]:
+        start = time.perf_counter()
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True, truncation=True, max_length=self.max_input_tokens)
+        max_new_tokens = max(option.max_new_tokens for option in options)
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **options[0].generate_kwargs(),
+            )
+        prompt_length = inputs["input_ids"].shape[1]
+        # Only the new tokens, each cut to its own request's limit
+        texts = [
+            self.tokenizer.decode(output[prompt_length:prompt_length + option.max_new_tokens], skip_special_tokens=True).strip()
+            for output, option in zip(outputs, options)
+        ]
+        logger.info(f"Generated batch of {len(prompts)} in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return texts
+
+
+_models: Dict[str, LocalModel] = {}
+_models_lock = threading.Lock()
+
+
+def get_local_model(model_name: Optional[str] = None) -> LocalModel:
+    """Load the model once per process, configured from LOCAL_MODEL_* settings."""
+    model_name = model_name or os.getenv('LOCAL_MODEL_NAME', DEFAULT_MODEL)
+    with _models_lock:
+        if model_name not in _models:
+            torch_threads = os.getenv('LOCAL_MODEL_THREADS')
+            _models[model_name] = LocalModel(
+                model_name,
+                quantize=os.getenv('LOCAL_MODEL_QUANTIZE', 'false').lower() == 'true',
+                torch_threads=int(torch_threads) if torch_threads else None,
+                max_batch_size=int(os.getenv('LOCAL_MODEL_BATCH_SIZE', 8)),
+                max_wait_ms=float(os.getenv('LOCAL_MODEL_MAX_WAIT_MS', 20)),
+            )
+        return _models[model_name]
+
+
+class LocalInferenceClient:
+    """Same generate() interface, backed by a local inference server over HTTP."""
+    def __init__(self, url: str, timeout: float = 120.0):
+        import requests
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def generate(self, prompt: str, options: Optional[GenerationOptions] = None, timeout: Optional[float] = None) -> str:
+        payload = dict(asdict(options or GenerationOptions()), prompt=prompt)
+        response = self.session.post(f"{self.url}/generate", json=payload, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()["text"]
+
+
+def load_local_generator():
+    """HTTP client when LOCAL_INFERENCE_URL is set, else the model loaded in this process."""
+    url = os.getenv('LOCAL_INFERENCE_URL')
+    if url:
+        logger.info(f"Using local inference server at {url}")
+        return LocalInferenceClient(url)
+    return get_local_model()
+
+
+def create_app(model: LocalModel):
+    from flask import Flask, jsonify, request
+
+    app = Flask(__name__)
+
+    @app.route('/generate', methods=['POST'])
+    def generate():
+        data = request.get_json(silent=True) or {}
+        prompt = data.get('prompt')
+        if not prompt or not isinstance(prompt, str):
+            return jsonify({"error": "No prompt provided"}), 400
+        try:
+            options = options_from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        start = time.perf_counter()
+        text = model.generate(prompt, options)
+        return jsonify({"text": text, "model": model.model_name, "latency_ms": round((time.perf_counter() - start) * 1000)})
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({"status": "ok", "model": model.model_name, "queued": model.requests.qsize()})
+
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    app = create_app(get_local_model())
+    # Threaded so concurrent requests reach the batcher together
+    app.run(host=os.getenv('LOCAL_MODEL_HOST', '127.0.0.1'), port=int(os.getenv('LOCAL_MODEL_PORT', 5003)), threaded=True)
@@ -0,0 +1,99 @@
+# model_router.py
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LOOKUP, CLAUSE, REASONING = "lookup", "clause", "reasoning"
+
+# A clause keyword, an annex control ("A.5.1") or a numbered clause of three levels or more ("6.1.2");
+# bare decimals ("gpt 3.5", "version 2.0") are not references
+CLAUSE_PATTERN = re.compile(
+    r"\b(?:clause|control|annex|bijlage|artikel)\b|\b[A-Z]\.\d{1,2}(?:\.\d{1,2}){0,3}\b|\b\d{1,2}(?:\.\d{1,2}){2,3}\b",
+    re.IGNORECASE,
+)
+REASONING_PATTERN = re.compile(
+    r"\b(compare|difference|differences|versus|vs|why|how should|how do we|how can we|explain|implications?|"
+    r"trade-?offs?|step by step|plan|vergelijk|verschil|waarom|hoe moeten|hoe kunnen|leg uit)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class RouteConfig:
+    model: str
+    top_k: int
+    max_prompt_tokens: int
+    max_completion_tokens: int
+
+
+@dataclass
+class RouteDecision:
+    question_class: str
+    config: RouteConfig
+    features: Dict
+
+
+def default_routes() -> Dict[str, RouteConfig]:
+    """Per-class configurations; the small model and budgets can be overridden from the environment."""
+    small_model = os.getenv('ROUTER_SMALL_MODEL', 'gpt-4o-mini')
+    large_model = os.getenv('ROUTER_LARGE_MODEL', 'gpt-3.5-turbo')
+    return {
+        LOOKUP: RouteConfig(small_model, top_k=3, max_prompt_tokens=3000, max_completion_tokens=300),
+        CLAUSE: RouteConfig(small_model, top_k=3, max_prompt_tokens=4000, max_completion_tokens=500),
+        REASONING: RouteConfig(large_model, top_k=5, max_prompt_tokens=12000, max_completion_tokens=1024),
+    }
+
+
+def question_features(question: str) -> Dict:
+    words = question.split()
+    return {
+        "words": len(words),
+        "question_marks": question.count("?"),
+        "clause_refs": len(CLAUSE_PATTERN.findall(question)),
+        "reasoning_terms": len(REASONING_PATTERN.findall(question)),
+        "conjunctions": len(re.findall(r"\b(and|or|en|of)\b", question, re.IGNORECASE)),
+    }
+
+
+def classify(features: Dict) -> str:
+    """Cheap rule-based classification into lookup, clause or reasoning."""
+    multi_part = features["question_marks"] > 1 or features["conjunctions"] >= 2
+    if features["reasoning_terms"] or multi_part or features["words"] > 30:
+        return REASONING
+    if features["clause_refs"]:
+        return CLAUSE
+    return LOOKUP
+
+
+class ModelRouter:
+    """Choose model, top-k and context budget per question class and log each decision."""
+    def __init__(self, routes: Optional[Dict[str, RouteConfig]] = None, log_path: Optional[str] = None):
+        self.routes = routes or default_routes()
+        self.log_path = log_path
+        self.lock = threading.Lock()
+
+    def route(self, question: str) -> RouteDecision:
+        features = question_features(question)
+        question_class = classify(features)
+        decision = RouteDecision(question_class, self.routes[question_class], features)
+        logger.info(f"Routed question as {question_class} to {decision.config.model} (top_k={decision.config.top_k})")
+        return decision
+
+    def record(self, question: str, decision: RouteDecision, **outcome):
+        """Append the decision and its outcome (latency, tokens, route) as one JSON line for offline tuning."""
+        if not self.log_path:
+            return
+        record = {"ts": time.time(), "question": question, "class": decision.question_class,
+                  "features": decision.features, "config": asdict(decision.config), **outcome}
+        try:
+            with self.lock, open(self.log_path, 'a') as file:
+                file.write(json.dumps(record) + "\n")
+        except IOError as e:
+            logger.error(f"Failed to write routing decision: {e}")
@@ -0,0 +1,103 @@
+# prompt_builder.py
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+from cachetools import LRUCache
+from langchain.schema import Document
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_INSTRUCTIONS = (
+    "You are an AI language model assistant. Your task is to answer customer questions as best as you can "
+    "with information that you can find in the added data in the vector database.\n"
+    "You always remain polite and if you can't find it in the vector database, you indicate that."
+)
+
+
+class PromptTooLargeError(ValueError):
+    """The question and history alone do not fit the prompt token budget."""
+
+
+# Chat formatting overhead per message (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def chunk_sort_key(document: Document):
+    """Deterministic order for context blocks: numeric chunk ids numerically, others lexically."""
+    chunk_id = str(document.metadata.get("parent_id") or document.metadata.get("id") or "")
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"(\d+)", chunk_id) if part]
+
+
+@dataclass
+class BuiltPrompt:
+    messages: List[BaseMessage]
+    estimated_tokens: int
+    documents: List[Document] = field(default_factory=list)
+    dropped_documents: int = 0
+
+
+class PromptBuilder:
+    """Assemble prompts with stable content first so providers can reuse the cached prefix.
+
+    Order: system instructions, context blocks sorted by chunk id, conversation history, question.
+    """
+    def __init__(self, instructions: str = SYSTEM_INSTRUCTIONS, model: str = "gpt-3.5-turbo",
+                 max_prompt_tokens: int = 12000, cache_size: int = 4096):
+        self.instructions = instructions
+        self.model = model
+        self.max_prompt_tokens = max_prompt_tokens
+        # Static part is counted once; context block counts are cached by chunk
+        self.instruction_tokens = count_tokens(instructions, model) + MESSAGE_OVERHEAD_TOKENS
+        self.block_tokens = LRUCache(maxsize=cache_size)
+
+    def format_block(self, document: Document) -> str:
+        chunk_id = document.metadata.get("parent_id") or document.metadata.get("id")
+        section_path = document.metadata.get("section_path")
+        label = " | ".join(str(part) for part in (chunk_id, section_path) if part)
+        return f"[{label}]\n{document.page_content}" if label else document.page_content
+
+    def _block_tokens(self, document: Document, block: str) -> int:
+        key = (document.metadata.get("parent_id") or document.metadata.get("id"), hash(block))
+        if key not in self.block_tokens:
+            self.block_tokens[key] = count_tokens(block, self.model)
+        return self.block_tokens[key]
+
+    def estimate(self, documents: List[Document], question: str, history: str = "") -> int:
+        """Estimate prompt tokens without building the messages."""
+        tokens = self.instruction_tokens + count_tokens(question, self.model) + MESSAGE_OVERHEAD_TOKENS
+        if history:
+            tokens += count_tokens(history, self.model) + MESSAGE_OVERHEAD_TOKENS
+        if documents:
+            tokens += MESSAGE_OVERHEAD_TOKENS + sum(self._block_tokens(doc, self.format_block(doc)) for doc in documents)
+        return tokens
+
+    def build(self, documents: List[Document], question: str, history: str = "", max_prompt_tokens: Optional[int] = None) -> BuiltPrompt:
+        """Build the messages, dropping the lowest-ranked context blocks when over budget.
+
+        `documents` are expected in retrieval rank order; the rank decides what is dropped,
+        the chunk id decides the order in the prompt.
+        """
+        budget = min(max_prompt_tokens or self.max_prompt_tokens, self.max_prompt_tokens)
+        kept = list(documents)
+        estimated = self.estimate(kept, question, history)
+        while kept and estimated > budget:
+            kept.pop()
+            estimated = self.estimate(kept, question, history)
+        if estimated > budget:
+            raise PromptTooLargeError(f"Prompt needs {estimated} tokens, over the budget of {budget}")
+        if len(kept) < len(documents):
+            logger.info(f"Dropped {len(documents) - len(kept)} context blocks to fit {budget} tokens")
+
+        ordered = sorted(kept, key=chunk_sort_key)
+        messages: List[BaseMessage] = [SystemMessage(content=self.instructions)]
+        if ordered:
+            messages.append(SystemMessage(content="Context:\n" + "\n\n".join(self.format_block(doc) for doc in ordered)))
+        if history:
+            messages.append(SystemMessage(content=f"Conversation so far:\n{history}"))
+        messages.append(HumanMessage(content=question))
+        return BuiltPrompt(messages=messages, estimated_tokens=estimated, documents=ordered,
+                           dropped_documents=len(documents) - len(kept))
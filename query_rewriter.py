@@ -0,0 +1,97 @@
+# query_rewriter.py
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Callable, List, Optional, Tuple
+from cachetools import TTLCache
+from langchain.prompts import ChatPromptTemplate
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+CONDENSE_PROMPT = ChatPromptTemplate.from_template(
+    """Given the conversation and a follow-up question, rephrase the follow-up question as a standalone question
+    in its original language. Keep clause and control numbers. Reply with the standalone question only.
+    Conversation: {history}
+    Follow-up question: {question}"""
+)
+
+# Words that point back to earlier turns (English and Dutch)
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|the same|above|previous|"
+    r"het|dit|dat|deze|die|ze|hun|hetzelfde|vorige|daarvan|ervan|hiervan)\b",
+    re.IGNORECASE,
+)
+CONTINUATION_PATTERN = re.compile(
+    r"^\s*(and|also|what about|how about|why|en|ook|wat dan met|hoe zit het met|waarom)\b",
+    re.IGNORECASE,
+)
+REFERENCE_PATTERN = re.compile(r"\b(?:clause|control|annex|A)?\s*[A-Z]?\d{1,2}(?:\.\d{1,2}){1,3}\b", re.IGNORECASE)
+
+
+def is_standalone(question: str, history: str) -> bool:
+    """Cheap check whether a question can be searched without the conversation."""
+    if not history:
+        return True
+    if CONTINUATION_PATTERN.search(question):
+        return False
+    if FOLLOW_UP_PATTERN.search(question):
+        return False
+    # Very short questions without an explicit reference usually lean on the previous turn
+    return len(question.split()) >= 5 or bool(REFERENCE_PATTERN.search(question))
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\W+", " ", text).strip().lower()
+
+
+class QueryRewriter:
+    """Turn follow-up questions into standalone search queries, caching per (session, turn)."""
+    def __init__(self, llm, cache_size: int = 2000, ttl: int = 3600, timeout: float = 5.0, max_workers: int = 8):
+        self.chain = CONDENSE_PROMPT | llm
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rewrite")
+
+    def condense(self, question: str, history: str, session_id: Optional[str] = None, turn: Optional[int] = None) -> str:
+        """Return the standalone form of the question, from cache when possible."""
+        key = (session_id, turn, question) if session_id is not None else None
+        if key is not None and key in self.cache:
+            return self.cache[key]
+        output = self.chain.invoke({"history": history, "question": question})
+        condensed = output.content.strip() if hasattr(output, 'content') else str(output).strip()
+        condensed = condensed or question
+        if key is not None:
+            self.cache[key] = condensed
+        return condensed
+
+    def retrieve(self, question: str, history: str, retrieve_fn: Callable[[str], List[Document]],
+                 session_id: Optional[str] = None, turn: Optional[int] = None) -> Tuple[List[Document], str]:
+        """Retrieve documents for the standalone form of the question.
+
+        Follow-ups are condensed in the rewrite pool while a speculative search on the raw question runs
+        on the calling thread, so hung rewrites cannot hold searches up; the speculative result is used
+        when the rewrite changes nothing, fails or does not finish within `timeout`.
+        """
+        if is_standalone(question, history):
+            return retrieve_fn(question), question
+
+        deadline = time.monotonic() + self.timeout
+        rewrite = self.executor.submit(self.condense, question, history, session_id, turn)
+        speculative = retrieve_fn(question)
+        try:
+            condensed = rewrite.result(timeout=max(0.0, deadline - time.monotonic()))
+        except TimeoutError:
+            # Still queued behind slow rewrites: drop it rather than add to the backlog
+            rewrite.cancel()
+            logger.warning("Question rewrite timed out, using raw question")
+            return speculative, question
+        except Exception as e:
+            logger.error(f"Question rewrite failed, using raw question: {e}")
+            return speculative, question
+
+        if _normalize(condensed) == _normalize(question):
+            return speculative, question
+        logger.info(f"Rewrote follow-up question to: {condensed}")
+        return retrieve_fn(condensed), condensed
@@ -0,0 +1,243 @@
+# rate_limiter.py
+import fcntl
+import heapq
+import itertools
+import logging
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+from typing import Callable, Optional
+import openai
+from langchain_core.runnables import RunnableLambda
+
+from token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying: quota, overload and transient network failures
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class RateLimitTimeout(Exception):
+    """The request could not be scheduled or retried before its deadline."""
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """In-process token bucket refilled continuously at rate units per second."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount: float) -> float:
+        """Take amount if available and return 0, otherwise return the seconds to wait."""
+        now = time.monotonic()
+        self._refill(now)
+        # Requests larger than the bucket are let through once it is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def drain(self, seconds: float):
+        """Push the bucket into debt so no one is admitted for roughly `seconds`."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket kept in a memory-mapped file so all workers on the host share one quota."""
+    _format = "dd"  # tokens, wall-clock timestamp of the last refill
+
+    def __init__(self, rate: float, capacity: float, path: str):
+        self.rate = rate
+        self.capacity = capacity
+        self.size = struct.calcsize(self._format)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < self.size:
+                os.ftruncate(self.fd, self.size)
+                self.map = mmap.mmap(self.fd, self.size)
+                self.map[:] = struct.pack(self._format, capacity, time.time())
+            else:
+                self.map = mmap.mmap(self.fd, self.size)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _locked(self, update: Callable[[float, float, float], tuple]):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            tokens, updated = struct.unpack(self._format, self.map[:self.size])
+            now = time.time()
+            tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+            tokens, result = update(tokens, now, self.rate)
+            self.map[:self.size] = struct.pack(self._format, tokens, now)
+            return result
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def try_take(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+
+        def update(tokens, now, rate):
+            if tokens >= amount:
+                return tokens - amount, 0.0
+            return tokens, (amount - tokens) / rate
+        return self._locked(update)
+
+    def drain(self, seconds: float):
+        self._locked(lambda tokens, now, rate: (min(tokens, 0.0) - seconds * rate, None))
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limiter with a priority queue of waiters.
+
+    Lower priority values are served first; equal priorities are served in deadline order.
+    The rate adapts: it is cut on 429s and creeps back to the configured quota on success.
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, shared_path: Optional[str] = None,
+                 min_rate_fraction: float = 0.2):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self.min_rate_fraction = min_rate_fraction
+        self.rate_fraction = 1.0
+        if shared_path:
+            self.requests = SharedTokenBucket(requests_per_minute / 60, requests_per_minute, f"{shared_path}.requests")
+            self.tokens = SharedTokenBucket(tokens_per_minute / 60, tokens_per_minute, f"{shared_path}.tokens")
+        else:
+            self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute)
+            self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.condition = threading.Condition()
+        self.waiters = []
+        self.counter = itertools.count()
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None):
+        """Block until the request fits both quotas; raise RateLimitTimeout past the deadline."""
+        entry = (priority, deadline if deadline is not None else float("inf"), next(self.counter))
+        with self.condition:
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    wait = None
+                    if self.waiters[0] == entry:
+                        wait = self._try_take(tokens)
+                        if wait == 0:
+                            return
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise RateLimitTimeout("Rate limit queue deadline exceeded", retry_after=wait or 1.0)
+                    timeout = min(x for x in (wait, remaining, 1.0) if x is not None)
+                    self.condition.wait(timeout)
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+
+    def _try_take(self, tokens: int) -> float:
+        wait = self.requests.try_take(1)
+        if wait:
+            return wait
+        wait = self.tokens.try_take(tokens)
+        if wait:
+            # Give the request slot back; the token quota is what we wait for
+            self.requests.try_take(-1)
+        return wait
+
+    def penalize(self, retry_after: float):
+        """React to a 429: pause everyone for retry_after seconds and lower the rate."""
+        with self.condition:
+            self.requests.drain(retry_after)
+            self.rate_fraction = max(self.min_rate_fraction, self.rate_fraction * 0.7)
+            self._apply_rate()
+        logger.warning(f"Rate limited by OpenAI; pausing {retry_after:.1f}s, rate at {self.rate_fraction:.0%} of quota")
+
+    def record_success(self):
+        if self.rate_fraction < 1.0:
+            with self.condition:
+                self.rate_fraction = min(1.0, self.rate_fraction + 0.05)
+                self._apply_rate()
+
+    def _apply_rate(self):
+        self.requests.rate = self.rpm * self.rate_fraction / 60
+        self.tokens.rate = self.tpm * self.rate_fraction / 60
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read Retry-After (or retry-after-ms) from an OpenAI error response."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def call_with_retries(fn: Callable, limiter: RateLimiter, tokens: int, priority: int = PRIORITY_INTERACTIVE,
+                      deadline: Optional[float] = None, max_retries: int = 4, base_delay: float = 0.5):
+    """Run fn once the limiter admits it, retrying transient errors with jittered backoff."""
+    for attempt in range(max_retries + 1):
+        limiter.acquire(tokens, priority=priority, deadline=deadline)
+        try:
+            result = fn()
+            limiter.record_success()
+            return result
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            retry_after = retry_after_seconds(e)
+            if isinstance(e, openai.RateLimitError):
+                limiter.penalize(retry_after or base_delay * 2 ** attempt)
+            # Full jitter, but never earlier than the server asked for
+            delay = max(retry_after or 0.0, random.uniform(0, base_delay * 2 ** attempt))
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise RateLimitTimeout(f"Deadline reached while retrying: {e}", retry_after=delay) from e
+            logger.info(f"{type(e).__name__} on attempt {attempt + 1}; retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def estimate_prompt_tokens(prompt) -> int:
+    """Token estimate for a prompt value, message list or string."""
+    if hasattr(prompt, "to_messages"):
+        prompt = prompt.to_messages()
+    if isinstance(prompt, list):
+        return sum(count_tokens(str(getattr(message, "content", message))) + 4 for message in prompt)
+    return count_tokens(str(prompt))
+
+
+def rate_limited(llm, limiter: RateLimiter, priority: int = PRIORITY_BACKGROUND, max_output_tokens: int = 512,
+                 timeout: float = 30.0):
+    """Wrap a chat model as a runnable whose calls go through the limiter."""
+    def invoke(prompt):
+        tokens = estimate_prompt_tokens(prompt) + max_output_tokens
+        return call_with_retries(lambda: llm.invoke(prompt), limiter, tokens, priority=priority,
+                                 deadline=time.monotonic() + timeout)
+    return RunnableLambda(invoke)
+
+
+def create_rate_limiter() -> RateLimiter:
+    """Create the limiter from OPENAI_RPM / OPENAI_TPM; RATE_LIMIT_SHARED_PATH shares it across workers."""
+    return RateLimiter(
+        requests_per_minute=int(os.getenv('OPENAI_RPM', 3500)),
+        tokens_per_minute=int(os.getenv('OPENAI_TPM', 90000)),
+        shared_path=os.getenv('RATE_LIMIT_SHARED_PATH'),
+    )
@@ -0,0 +1,84 @@
+# reranker.py
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+# Check if sentence-transformers is available
+try:
+    from sentence_transformers import CrossEncoder
+    cross_encoder_available = True
+except ImportError:
+    cross_encoder_available = False
+
+DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class CrossEncoderReranker:
+    """Rescore retrieved chunks against the question with a small cross-encoder on CPU."""
+    def __init__(self, model_name: str = DEFAULT_MODEL, candidates: int = 50, batch_size: int = 16,
+                 max_workers: int = 2, torch_threads: Optional[int] = None, max_length: int = 512):
+        if not cross_encoder_available:
+            raise ImportError("sentence-transformers is required for reranking")
+        if torch_threads:
+            import torch
+            torch.set_num_threads(torch_threads)
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.model_name = model_name
+        self.candidates = candidates
+        self.batch_size = batch_size
+        # Bounded pool: concurrent requests queue up instead of oversubscribing the CPU
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rerank")
+        logger.info(f"Cross-encoder {model_name} loaded (batch_size={batch_size}, workers={max_workers})")
+
+    def _score_batch(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        return [float(score) for score in self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+    def score(self, query: str, documents: List[Document]) -> List[float]:
+        """Score (query, chunk) pairs in batches spread over the worker pool."""
+        pairs = [(query, doc.page_content) for doc in documents]
+        batches = [pairs[i:i + self.batch_size] for i in range(0, len(pairs), self.batch_size)]
+        scores = []
+        for batch_scores in self.executor.map(self._score_batch, batches):
+            scores.extend(batch_scores)
+        return scores
+
+    def rerank(self, query: str, documents: List[Document], top_k: int = 5) -> List[Document]:
+        """Return the top_k documents by cross-encoder score, with scores and timing in metadata."""
+        if not documents:
+            return documents
+        start = time.perf_counter()
+        scores = self.score(query, documents)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        ranked = sorted(zip(documents, scores), key=lambda item: item[1], reverse=True)[:top_k]
+        reranked = []
+        for rank, (doc, score) in enumerate(ranked):
+            metadata = dict(doc.metadata, rerank_score=score, rerank_rank=rank, rerank_ms=round(elapsed_ms, 1),
+                            rerank_candidates=len(documents))
+            reranked.append(Document(page_content=doc.page_content, metadata=metadata))
+        logger.info(f"Reranked {len(documents)} candidates to {len(reranked)} in {elapsed_ms:.1f} ms")
+        return reranked
+
+
+def load_reranker() -> Optional[CrossEncoderReranker]:
+    """Create the reranker from environment settings, or None when disabled or unavailable."""
+    if os.getenv('RERANK_ENABLED', 'false').lower() not in ('1', 'true', 'yes'):
+        return None
+    if not cross_encoder_available:
+        logger.warning("RERANK_ENABLED is set but sentence-transformers is not installed; reranking disabled")
+        return None
+    try:
+        return CrossEncoderReranker(
+            model_name=os.getenv('RERANK_MODEL', DEFAULT_MODEL),
+            candidates=int(os.getenv('RERANK_CANDIDATES', 50)),
+            batch_size=int(os.getenv('RERANK_BATCH_SIZE', 16)),
+            max_workers=int(os.getenv('RERANK_WORKERS', 2)),
+            torch_threads=int(os.getenv('RERANK_TORCH_THREADS', 0)) or None,
+        )
+    except Exception as e:
+        logger.error(f"Failed to load reranker, continuing without it: {e}")
+        return None
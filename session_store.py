@@ -0,0 +1,262 @@
+# session_store.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List
+from cachetools import LRUCache
+from langchain.prompts import ChatPromptTemplate
+
+from token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Check if the redis client is available
+try:
+    import redis
+    redis_available = True
+except ImportError:
+    redis_available = False
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class InMemorySessionStore:
+    """Bounded session store; least recently used sessions are evicted first."""
+    def __init__(self, max_sessions: int = 1000, max_turns: int = 200):
+        self.sessions = LRUCache(maxsize=max_sessions)
+        self.max_turns = max_turns
+        self.lock = threading.Lock()
+
+    def _get(self, session_id: str) -> Dict:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = {"turns": [], "next_seq": 0, "summary": "", "summarized_upto": 0}
+            self.sessions[session_id] = session
+        return session
+
+    def exists(self, session_id: str) -> bool:
+        with self.lock:
+            return session_id in self.sessions
+
+    def turn_count(self, session_id: str) -> int:
+        with self.lock:
+            session = self.sessions.get(session_id)
+            return session["next_seq"] if session else 0
+
+    def append_turn(self, session_id: str, role: str, content: str) -> Dict:
+        with self.lock:
+            session = self._get(session_id)
+            turn = {"seq": session["next_seq"], "role": role, "content": content, "ts": time.time()}
+            session["next_seq"] += 1
+            session["turns"].append(turn)
+            # Only the in-memory copy is trimmed; compaction has normally summarized these turns
+            if len(session["turns"]) > self.max_turns:
+                del session["turns"][:len(session["turns"]) - self.max_turns]
+            return turn
+
+    def get_turns(self, session_id: str, since: int = 0) -> List[Dict]:
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return []
+            return [turn for turn in session["turns"] if turn["seq"] >= since]
+
+    def get_summary(self, session_id: str) -> Dict:
+        with self.lock:
+            session = self.sessions.get(session_id) or {}
+            return {"summary": session.get("summary", ""), "summarized_upto": session.get("summarized_upto", 0)}
+
+    def set_summary(self, session_id: str, summary: str, summarized_upto: int):
+        with self.lock:
+            session = self._get(session_id)
+            session["summary"] = summary
+            session["summarized_upto"] = summarized_upto
+
+    def delete(self, session_id: str):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+
+class SqliteSessionStore:
+    """Session store persisted in a sqlite database, shared by all workers on the host."""
+    def __init__(self, path: str = "sessions.db"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, summary TEXT NOT NULL DEFAULT '', "
+                "summarized_upto INTEGER NOT NULL DEFAULT 0, updated_at REAL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns (session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, "
+                "content TEXT NOT NULL, ts REAL NOT NULL, PRIMARY KEY (session_id, seq))"
+            )
+
+    def exists(self, session_id: str) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def turn_count(self, session_id: str) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM turns WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def append_turn(self, session_id: str, role: str, content: str) -> Dict:
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO sessions (id, updated_at) VALUES (?, ?)", (session_id, now))
+            self.conn.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+            seq = self.conn.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM turns WHERE session_id = ?", (session_id,)).fetchone()[0]
+            self.conn.execute("INSERT INTO turns (session_id, seq, role, content, ts) VALUES (?, ?, ?, ?, ?)",
+                              (session_id, seq, role, content, now))
+        return {"seq": seq, "role": role, "content": content, "ts": now}
+
+    def get_turns(self, session_id: str, since: int = 0) -> List[Dict]:
+        with self.lock:
+            rows = self.conn.execute("SELECT seq, role, content, ts FROM turns WHERE session_id = ? AND seq >= ? ORDER BY seq",
+                                     (session_id, since)).fetchall()
+        return [{"seq": seq, "role": role, "content": content, "ts": ts} for seq, role, content, ts in rows]
+
+    def get_summary(self, session_id: str) -> Dict:
+        with self.lock:
+            row = self.conn.execute("SELECT summary, summarized_upto FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return {"summary": "", "summarized_upto": 0}
+        return {"summary": row[0], "summarized_upto": row[1]}
+
+    def set_summary(self, session_id: str, summary: str, summarized_upto: int):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO sessions (id, updated_at) VALUES (?, ?)", (session_id, time.time()))
+            self.conn.execute("UPDATE sessions SET summary = ?, summarized_upto = ? WHERE id = ?",
+                              (summary, summarized_upto, session_id))
+
+    def delete(self, session_id: str):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+class RedisSessionStore:
+    """Session store on any Redis-compatible server; idle sessions expire after ttl seconds."""
+    def __init__(self, url: str = "redis://localhost:6379/0", ttl: int = 86400, prefix: str = "session"):
+        if not redis_available:
+            raise ImportError("redis is required for the Redis session store")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _keys(self, session_id: str):
+        return f"{self.prefix}:{session_id}:turns", f"{self.prefix}:{session_id}:meta"
+
+    def exists(self, session_id: str) -> bool:
+        return bool(self.client.exists(*self._keys(session_id)))
+
+    def turn_count(self, session_id: str) -> int:
+        _, meta_key = self._keys(session_id)
+        return int(self.client.hget(meta_key, "next_seq") or 0)
+
+    def append_turn(self, session_id: str, role: str, content: str) -> Dict:
+        turns_key, meta_key = self._keys(session_id)
+        seq = self.client.hincrby(meta_key, "next_seq", 1) - 1
+        turn = {"seq": seq, "role": role, "content": content, "ts": time.time()}
+        pipe = self.client.pipeline()
+        pipe.rpush(turns_key, json.dumps(turn))
+        pipe.expire(turns_key, self.ttl)
+        pipe.expire(meta_key, self.ttl)
+        pipe.execute()
+        return turn
+
+    def get_turns(self, session_id: str, since: int = 0) -> List[Dict]:
+        turns_key, _ = self._keys(session_id)
+        turns = [json.loads(item) for item in self.client.lrange(turns_key, 0, -1)]
+        return [turn for turn in turns if turn["seq"] >= since]
+
+    def get_summary(self, session_id: str) -> Dict:
+        _, meta_key = self._keys(session_id)
+        meta = self.client.hgetall(meta_key)
+        return {"summary": meta.get("summary", ""), "summarized_upto": int(meta.get("summarized_upto", 0))}
+
+    def set_summary(self, session_id: str, summary: str, summarized_upto: int):
+        _, meta_key = self._keys(session_id)
+        self.client.hset(meta_key, mapping={"summary": summary, "summarized_upto": summarized_upto})
+        self.client.expire(meta_key, self.ttl)
+
+    def delete(self, session_id: str):
+        self.client.delete(*self._keys(session_id))
+
+
+def create_session_store():
+    """Create the session store selected by SESSION_STORE (memory, sqlite or redis)."""
+    backend = os.getenv('SESSION_STORE', 'memory').lower()
+    if backend == 'sqlite':
+        return SqliteSessionStore(os.getenv('SESSION_STORE_PATH', 'sessions.db'))
+    if backend == 'redis':
+        return RedisSessionStore(os.getenv('SESSION_STORE_URL', 'redis://localhost:6379/0'),
+                                 ttl=int(os.getenv('SESSION_TTL', 86400)))
+    return InMemorySessionStore(max_sessions=int(os.getenv('SESSION_MAX_SESSIONS', 1000)),
+                                max_turns=int(os.getenv('SESSION_MAX_TURNS', 200)))
+
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_template(
+    """Summarize the conversation between a customer and an assistant about the documents in the vector database.
+    Keep names, clause numbers and facts the customer gave; drop small talk. Reply with the summary only.
+    Existing summary: {summary}
+    New turns:
+    {turns}"""
+)
+
+
+def format_turns(turns: List[Dict]) -> str:
+    return "\n".join(f"{'Customer' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}" for turn in turns)
+
+
+class HistoryCompactor:
+    """Keep the history sent to the LLM within a token budget by summarizing older turns."""
+    def __init__(self, store, llm, token_budget: int = 1000, keep_recent: int = 4):
+        self.store = store
+        self.chain = SUMMARY_PROMPT | llm if llm is not None else None
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+
+    def get_history(self, session_id: str) -> str:
+        """Return the rolling summary plus recent turns, compacting first if over budget."""
+        state = self.store.get_summary(session_id)
+        turns = self.store.get_turns(session_id, since=state["summarized_upto"])
+        history = self._render(state["summary"], turns)
+        if count_tokens(history) > self.token_budget and len(turns) > self.keep_recent:
+            state = self.compact(session_id, state, turns)
+            turns = [turn for turn in turns if turn["seq"] >= state["summarized_upto"]]
+            history = self._render(state["summary"], turns)
+        return history
+
+    def compact(self, session_id: str, state: Dict, turns: List[Dict]) -> Dict:
+        old_turns = turns[:-self.keep_recent]
+        summarized_upto = old_turns[-1]["seq"] + 1
+        if self.chain is None:
+            summary = state["summary"]
+        else:
+            try:
+                output = self.chain.invoke({"summary": state["summary"] or "(none)", "turns": format_turns(old_turns)})
+                summary = output.content.strip() if hasattr(output, 'content') else str(output).strip()
+            except Exception as e:
+                # Keep answering with a longer history rather than failing the request
+                logger.error(f"History compaction failed for session {session_id}: {e}")
+                return state
+        self.store.set_summary(session_id, summary, summarized_upto)
+        logger.info(f"Compacted {len(old_turns)} turns of session {session_id}")
+        return {"summary": summary, "summarized_upto": summarized_upto}
+
+    def _render(self, summary: str, turns: List[Dict]) -> str:
+        parts = []
+        if summary:
+            parts.append(f"Summary of earlier conversation: {summary}")
+        if turns:
+            parts.append(format_turns(turns))
+        return "\n".join(parts)
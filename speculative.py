@@ -0,0 +1,63 @@
+# speculative.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Hashable, Optional
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeCache:
+    """Replies generated while the user is still typing, one per session, keyed by the outcome they assume.
+
+    A speculation is only used when the turn ends with the outcome it was made for; otherwise it is discarded.
+    """
+    def __init__(self, max_workers: int = 4, max_sessions: int = 1000):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self.pending = LRUCache(maxsize=max_sessions)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, session_id: str, key: Hashable, fn: Callable[[], str]):
+        """Start fn() in the background, replacing any other speculation for the session."""
+        with self.lock:
+            entry = self.pending.get(session_id)
+            if entry is not None:
+                if entry[0] == key:
+                    return
+                entry[1].cancel()
+            self.pending[session_id] = (key, self.executor.submit(fn))
+
+    def take(self, session_id: str, key: Hashable, timeout: float = 0.0) -> Optional[str]:
+        """The speculated reply if it was made for `key` and is ready within `timeout`; consumes the entry."""
+        with self.lock:
+            entry = self.pending.pop(session_id, None)
+        if entry is None:
+            return None
+        speculated_key, future = entry
+        if speculated_key != key:
+            future.cancel()
+            self.misses += 1
+            logger.debug(f"Discarded speculation {speculated_key} for session {session_id}; outcome was {key}")
+            return None
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.misses += 1
+            logger.debug(f"Speculation {key} for session {session_id} not ready in time")
+            return None
+        except Exception as e:
+            self.misses += 1
+            logger.warning(f"Speculation {key} for session {session_id} failed: {e}")
+            return None
+        self.hits += 1
+        return result
+
+    def discard(self, session_id: str):
+        with self.lock:
+            entry = self.pending.pop(session_id, None)
+        if entry is not None:
+            entry[1].cancel()
+            self.misses += 1
@@ -0,0 +1,35 @@
+# token_utils.py
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Check if tiktoken is available
+try:
+    import tiktoken
+    tiktoken_available = True
+except ImportError:
+    tiktoken_available = False
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Count tokens with tiktoken, or estimate ~4 characters per token without it."""
+    if not text:
+        return 0
+    global tiktoken_available
+    if tiktoken_available:
+        try:
+            return len(_get_encoding(model).encode(text))
+        except Exception as e:
+            # Usually the encoding could not be downloaded; don't retry on every call
+            logger.warning(f"Token counting failed, falling back to estimate: {e}")
+            tiktoken_available = False
+    return len(text) // 4 + 1